@@ -0,0 +1,26 @@
+"""
+ASGI config for NGO_Hub_API project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+List and retrieve requests of the core viewsets run concurrently (see
+core.async_views), e.g.
+
+    uvicorn NGO_Hub_API.asgi:application --workers 2
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'NGO_Hub_API.settings')
+os.environ.setdefault('NGO_HUB_ASYNC_VIEWS', '1')
+
+application = get_asgi_application()
+
+# WhiteNoise is left out under ASGI (see settings), serve the static files here
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # noqa: E402
+
+application = ASGIStaticFilesHandler(application)
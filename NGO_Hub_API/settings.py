@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+from datetime import timedelta
+
+import dj_database_url
 import django_heroku
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -38,22 +41,25 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Only imported by the historical core migrations
     'cuser',
     'rest_framework',
     'rest_framework.authtoken',
-    'users',
-    'core',
+    'users.apps.UsersConfig',
+    'core.apps.CoreConfig',
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.db.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'cuser.middleware.CuserMiddleware',
+    'core.throttling.RateLimitHeadersMiddleware',
 ]
 
 ROOT_URLCONF = 'NGO_Hub_API.urls'
@@ -76,6 +82,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'NGO_Hub_API.wsgi.application'
 
+ASGI_APPLICATION = 'NGO_Hub_API.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
@@ -88,6 +96,33 @@ DATABASES = {
 }
 
 
+# Caches
+# The response cache (see core.cache) is local to each process by default.
+# With several gunicorn workers point it to a shared backend, e.g.
+# NGO_HUB_RESPONSE_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# NGO_HUB_RESPONSE_CACHE_LOCATION=/tmp/ngo-hub-responses
+
+RESPONSE_CACHE_BACKEND = os.environ.get('NGO_HUB_RESPONSE_CACHE_BACKEND', 'core.cache.LRUCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': RESPONSE_CACHE_BACKEND,
+        'LOCATION': os.environ.get('NGO_HUB_RESPONSE_CACHE_LOCATION', ''),
+        'TIMEOUT': 300,
+        # Least recently used responses are evicted beyond 5,000 entries or 64 MB
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'MAX_BYTES': 64 * 1024 * 1024,
+        } if RESPONSE_CACHE_BACKEND == 'core.cache.LRUCache' else {},
+    },
+}
+
+NGO_HUB_RESPONSE_CACHE = True
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -131,6 +166,79 @@ STATIC_URL = '/static/'
 django_heroku.settings(locals())
 
 
+# Database connections
+# The backends of core.db replace the Django ones: SQLite connections stay
+# open for NGO_HUB_CONN_MAX_AGE seconds, Postgres connections come from a
+# pool of NGO_HUB_DB_POOL_SIZE per process and go back to it after each
+# request. Reused connections are checked before their first query.
+DATABASE_ENGINES = {
+    'django.db.backends.sqlite3': 'core.db.sqlite3',
+    'django.db.backends.postgresql': 'core.db.postgresql',
+    'django.db.backends.postgresql_psycopg2': 'core.db.postgresql',
+}
+NGO_HUB_CONN_MAX_AGE = int(os.environ.get('NGO_HUB_CONN_MAX_AGE', 600))
+
+# Read replicas
+# Comma separated database URLs of read-only copies of the default database.
+# GET / HEAD requests read from them (see core.db.replicas). Locally, e.g.
+# NGO_HUB_READ_REPLICAS=sqlite:////tmp/replica.sqlite3 with the copy made by
+# `manage.py sync_sqlite_replicas`
+NGO_HUB_READ_REPLICAS = [
+    url for url in os.environ.get('NGO_HUB_READ_REPLICAS', '').split(',') if url
+]
+for index, url in enumerate(NGO_HUB_READ_REPLICAS, 1):
+    replica = dj_database_url.parse(url)
+    if replica['ENGINE'] == 'django.db.backends.sqlite3':
+        # Fails to connect, instead of creating an empty file, when missing
+        replica['NAME'] = 'file:%s?mode=ro' % replica['NAME']
+        replica['OPTIONS'] = {'uri': True}
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES['replica%d' % index] = replica
+
+DATABASE_ROUTERS = ['core.db.replicas.ReplicaRouter']
+# 'round_robin' or 'least_latency'
+NGO_HUB_REPLICA_STRATEGY = os.environ.get('NGO_HUB_REPLICA_STRATEGY', 'round_robin')
+# Clients read from the default database for this many seconds after a write,
+# pinned by their token or session in CACHES['default']: with replicas it
+# must be a cache shared by the worker processes, not the locmem default
+NGO_HUB_REPLICA_PIN_SECONDS = 5
+# Seconds before a replica that could not be connected to is tried again
+NGO_HUB_REPLICA_RETRY_SECONDS = 30
+
+for database in DATABASES.values():
+    database['ENGINE'] = DATABASE_ENGINES.get(database['ENGINE'], database['ENGINE'])
+    pooled = database['ENGINE'] == 'core.db.postgresql'
+    database['CONN_MAX_AGE'] = 0 if pooled else NGO_HUB_CONN_MAX_AGE
+
+NGO_HUB_DB_POOL_SIZE = int(os.environ.get('NGO_HUB_DB_POOL_SIZE', 10))
+# Seconds a request waits for a free connection before failing
+NGO_HUB_DB_POOL_TIMEOUT = 10
+# Idle connections older than this many seconds are closed
+NGO_HUB_DB_POOL_MAX_IDLE = 300
+
+# Run on every new SQLite connection: readers do not block the writer,
+# commits do not fsync, writers wait for the lock instead of failing
+NGO_HUB_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+# ASGI
+# Turned on by NGO_Hub_API/asgi.py: list and retrieve requests of the core
+# viewsets run concurrently on a thread pool (see core.async_views)
+NGO_HUB_ASYNC_VIEWS = os.environ.get('NGO_HUB_ASYNC_VIEWS') == '1'
+if NGO_HUB_ASYNC_VIEWS:
+    # WhiteNoise is sync only, it would move every request back to the
+    # single sync thread; asgi.py serves the static files instead
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE
+        if middleware != 'whitenoise.middleware.WhiteNoiseMiddleware'
+    ]
+
+
 # Django Rest Framework
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
@@ -139,17 +247,124 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly'
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'core.throttling.AnonRateThrottle',
+        'core.throttling.UserRateThrottle',
+        'core.throttling.RouteRateThrottle',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '25/minute',
         'user': '50/minute',
-    }
+    },
+    # Same output as the standard JSONRenderer, faster with orjson installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.fast.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Keyset (cursor) pagination for every list endpoint
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
 }
 
+# Rate limiting (see core.throttling)
+# The throttle state is shared by the worker processes through a SQLite
+# file (NGO_HUB_THROTTLE_DB, in the temporary directory by default). With
+# several hosts use a shared cache instead:
+# NGO_HUB_THROTTLE_STORE = 'core.throttling.CacheStore'
+# NGO_HUB_THROTTLE_STORE_OPTIONS = {'alias': '<memcached alias>'}
+NGO_HUB_THROTTLE_STORE = 'core.throttling.SQLiteStore'
+NGO_HUB_THROTTLE_STORE_OPTIONS = {'path': os.environ.get('NGO_HUB_THROTTLE_DB') or None}
+# Requests a client may send at once beyond the steady rate, by scope or
+# route name (default: the number of requests of the rate)
+NGO_HUB_THROTTLE_BURSTS = {}
+# Rates of single routes by route name, checked on top of the scope rates
+NGO_HUB_THROTTLE_ROUTE_RATES = {
+    'api-token-auth': '10/minute',
+    'ngo-bulk': '20/hour',
+    'ngo_verification-verify': '30/hour',
+}
+
+# Pagination
+# Default and maximum number of records per page (?page_size=)
+NGO_HUB_PAGE_SIZE = 50
+NGO_HUB_MAX_PAGE_SIZE = 200
+
+# Bulk registration
+# Maximum number of Ngos in one POST /core/ngo/bulk/
+NGO_HUB_BULK_MAX_ROWS = 10000
+
+# Geocoding (see core.gazetteer and core.geo)
+# Places the Ngo locations are matched against, run `manage.py load_gazetteer`
+# after changing the file
+NGO_HUB_GAZETTEER = os.path.join(BASE_DIR, 'core', 'data', 'gazetteer.tsv')
+# Search radius of ?near= on the Ngo list when ?radius_km= is not given
+NGO_HUB_NEAR_RADIUS_KM = 50
+
+# Duplicate detection (see core.duplicates)
+# POST /core/ngo/ refuses the Ngos that look already registered with a 409
+NGO_HUB_DUPLICATE_CHECK = True
+# Two names in the same city at least this similar (trigram Jaccard) are duplicates
+NGO_HUB_DUPLICATE_NAME_SIMILARITY = 0.8
+# Candidates sharing a key compared with a new Ngo, at most
+NGO_HUB_DUPLICATE_MAX_CANDIDATES = 100
+
+# Change feed (see core.changes)
+# Changes per response of /core/changes/ by default and at most (?limit=)
+NGO_HUB_CHANGES_BATCH_SIZE = 100
+NGO_HUB_CHANGES_MAX_BATCH_SIZE = 500
+# Longest ?wait= of a long poll, in seconds, below the gunicorn worker timeout
+NGO_HUB_CHANGES_MAX_WAIT = 25
+# A waiting request looks for the changes of the other processes this often
+NGO_HUB_CHANGES_POLL_SECONDS = 1.0
+# Server-Sent Events: seconds between keep-alive comments, and length of a
+# stream before the client reconnects. Raise the length with threaded or
+# gevent workers, a stream holds a sync worker.
+NGO_HUB_CHANGES_HEARTBEAT_SECONDS = 15
+NGO_HUB_CHANGES_STREAM_SECONDS = 25
+
+# Idempotency-Key of the POSTs creating Ngos
+# Stored responses are replayed to retries for this long
+NGO_HUB_IDEMPOTENCY_TTL = timedelta(hours=24)
+
+# Automated verification (see core.jobs and core.verification)
+# Base of the links in the emails sent to the Ngos
+NGO_HUB_PUBLIC_URL = os.environ.get('NGO_HUB_PUBLIC_URL', 'http://localhost:8000')
+# Network backends, core.verification.Locmem* are local stand-ins
+NGO_HUB_MX_BACKEND = 'core.verification.DnsMxBackend'
+NGO_HUB_HTTP_CHECK_BACKEND = 'core.verification.HttpClientBackend'
+NGO_HUB_SMS_BACKEND = 'core.verification.LogSmsBackend'
+NGO_HUB_HTTP_CHECK_TIMEOUT = 10
+# Emailed tokens and SMS codes expire after this long
+NGO_HUB_VERIFICATION_CODE_TTL = timedelta(days=2)
+# Runs of a job (and wrong codes) before it fails, first retry delay
+# doubled on every retry up to the maximum, in seconds
+NGO_HUB_VERIFICATION_MAX_ATTEMPTS = 5
+NGO_HUB_VERIFICATION_BACKOFF_SECONDS = 30
+NGO_HUB_VERIFICATION_MAX_BACKOFF_SECONDS = 3600
+# Jobs running at once per mail domain / website host / SMS backend
+NGO_HUB_VERIFICATION_DOMAIN_CONCURRENCY = 2
+# Running jobs of a worker silent for this long are queued again
+NGO_HUB_VERIFICATION_LEASE_SECONDS = 300
+
+# Token authentication
+# Tokens expire this long after their creation (None: never),
+# they are replaced on the next api-token-auth call
+NGO_HUB_TOKEN_LIFETIME = timedelta(days=30)
+# Resolved tokens are cached per process for NGO_HUB_TOKEN_CACHE_TTL seconds
+NGO_HUB_TOKEN_CACHE_TTL = 60
+NGO_HUB_TOKEN_CACHE_SIZE = 10000
+
+# Instrumentation (see core.metrics)
+# With several worker processes, a directory shared by the workers, emptied
+# on deploy, where each one writes its histograms for /metrics
+NGO_HUB_METRICS_DIR = os.environ.get('NGO_HUB_METRICS_DIR') or None
+NGO_HUB_METRICS_FLUSH_SECONDS = 5
+# /metrics is only served to staff users, and to the scrapers sending
+# "Authorization: Bearer <token>" when a token is set
+NGO_HUB_METRICS_TOKEN = os.environ.get('NGO_HUB_METRICS_TOKEN') or None
+# Requests slower than this are logged with their SQL (None: never)
+NGO_HUB_SLOW_REQUEST_MS = 1000
+
 # Using a custom user model called CustomUser rather than the default User model
 AUTH_USER_MODEL = 'users.CustomUser'
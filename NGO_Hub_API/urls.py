@@ -16,11 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from django.conf.urls import include, url
-from rest_framework.authtoken import views
+from core.metrics import metrics_view
+from users import views
 
 urlpatterns = [
     url(r'^core/', include('core.urls')),
     url(r'^api-auth/', include('rest_framework.urls')),
     path('admin/', admin.site.urls),
-    url(r'^api-token-auth/', views.obtain_auth_token)
+    url(r'^api-token-auth/', views.ObtainExpiringAuthToken.as_view(), name='api-token-auth'),
+    url(r'^metrics$', metrics_view, name='metrics'),
 ]
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Connect the signal handlers
+        from core import signals  # noqa: F401
+        # Time the queries of every connection, including the first one
+        from core import metrics  # noqa: F401
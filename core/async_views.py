@@ -0,0 +1,97 @@
+"""
+Async read views for the ASGI deployment (see NGO_Hub_API/asgi.py).
+
+Under ASGI Django runs every sync view in one shared thread, so a single
+slow query holds up every request of the worker. With NGO_HUB_ASYNC_VIEWS
+on, the viewsets return coroutine views instead: list and retrieve run
+concurrently on the thread pool of the event loop, each thread with its
+own database connection, while writes keep the single thread Django would
+use. Django 3.2 has no async ORM and DRF views are synchronous, so the
+queries and the rendering run in those threads, never in the event loop.
+"""
+import functools
+import tempfile
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+
+
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def spool(response):
+    """
+    Drains a streaming response into a temporary file. Django's ASGI handler
+    iterates streaming content inside the event loop, where the database
+    cannot be used, so the queryset behind it is consumed here instead.
+    """
+    content = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    for chunk in response.streaming_content:
+        content.write(chunk)
+    response.close()
+    content.seek(0)
+
+    def chunks():
+        with content:
+            yield from iter(lambda: content.read(CHUNK_SIZE), b'')
+
+    spooled = StreamingHttpResponse(chunks(), status=response.status_code)
+    for header, value in response.items():
+        spooled[header] = value
+    return spooled
+
+
+def run_view(view, request, args, kwargs):
+    """
+    Runs a sync view and renders its response, in the calling thread.
+    """
+    # Pool threads never see request_started / request_finished
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response = response.render()
+        if response.streaming:
+            response = spool(response)
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view, concurrent_methods):
+    """
+    Wraps a sync view in a coroutine view. Requests with one of the
+    concurrent_methods run on the thread pool, the others in the thread
+    Django uses for sync code.
+    """
+    run = functools.partial(run_view, view)
+    concurrent = sync_to_async(run, thread_sensitive=False)
+    serial = sync_to_async(run, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method.lower() in concurrent_methods:
+            return await concurrent(request, args, kwargs)
+        return await serial(request, args, kwargs)
+    return wrapper
+
+
+class AsyncReadMixin:
+    """
+    Returns coroutine views from as_view() when NGO_HUB_ASYNC_VIEWS is on,
+    async_actions being the actions that run concurrently.
+    """
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not getattr(settings, 'NGO_HUB_ASYNC_VIEWS', False):
+            return view
+        methods = {method for method, name in (actions or {}).items() if name in cls.async_actions}
+        if 'get' in methods:
+            methods.add('head')
+        return async_view(view, methods)
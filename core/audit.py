@@ -0,0 +1,87 @@
+"""
+Audit attribution of the records created and modified through the API.
+
+The acting user is passed explicitly: the viewsets (AuditMixin), the
+management commands and the bulk jobs run their writes inside
+`acting_as(user)`, and AuditUserField stores that user on save; bulk
+writes, which call no save, use fill_audit_fields. The user lives in a
+contextvar, so it follows the code under sync workers, threaded workers
+and asyncio tasks alike, and never leaks between concurrent requests.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import models
+
+
+_current_user = ContextVar('ngo_hub_current_user', default=None)
+
+
+def get_current_user():
+    """
+    Returns the user the current writes are attributed to, or None.
+    """
+    return _current_user.get()
+
+
+@contextmanager
+def acting_as(user):
+    """
+    Attributes the writes made inside the block to user.
+    """
+    token = _current_user.set(user)
+    try:
+        yield user
+    finally:
+        _current_user.reset(token)
+
+
+class AuditUserField(models.ForeignKey):
+    """
+    Foreign key to the user, filled on save with the user of acting_as().
+    With add_only=True it is only filled when the record is created.
+    """
+    def __init__(self, to=settings.AUTH_USER_MODEL, to_field=None, add_only=False, **kwargs):
+        self.add_only = add_only
+        kwargs.update({
+            'editable': False,
+            'null': True,
+        })
+        super().__init__(to, to_field=to_field, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        if add or not self.add_only:
+            user = get_current_user()
+            if user is not None and user.is_authenticated:
+                setattr(model_instance, self.attname, user.pk)
+                return user.pk
+        return super().pre_save(model_instance, add)
+
+
+def fill_audit_fields(instances, add=True):
+    """
+    Fills the AuditUserFields of instances as save() would, for bulk_create
+    and bulk_update which skip pre_save.
+    """
+    for instance in instances:
+        for field in instance._meta.concrete_fields:
+            if isinstance(field, AuditUserField):
+                field.pre_save(instance, add)
+
+
+class AuditMixin:
+    """
+    Runs the viewset writes as the authenticated user of the request.
+    """
+    def perform_create(self, serializer):
+        with acting_as(self.request.user):
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with acting_as(self.request.user):
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with acting_as(self.request.user):
+            super().perform_destroy(instance)
@@ -0,0 +1,192 @@
+"""
+Helpers shared by the benchmark management commands.
+Benchmarks always run against a throwaway test database, never against
+the configured one.
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+WORDS = (
+    'education health water sanitation children women rural urban relief '
+    'disaster food hunger shelter housing climate forest wildlife animal '
+    'literacy school hospital clinic medicine vaccine nutrition farming '
+    'microfinance skills employment youth elderly disability rights justice '
+    'legal aid environment recycling energy solar community development'
+).split()
+
+# Long tail of synthetic words so that term frequencies follow a Zipf
+# distribution like real text instead of every word matching every row.
+SYLLABLES = ('ka', 'lo', 'mi', 'ra', 'tu', 'ne', 'sho', 'vi', 'da', 'pe', 'zu', 'gor')
+VOCABULARY = WORDS + [
+    a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES
+]
+WEIGHTS = [1.0 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+CITIES = (
+    ('PUNE', 'MAHARASHTRA', 'INDIA'),
+    ('MUMBAI', 'MAHARASHTRA', 'INDIA'),
+    ('DELHI', 'DELHI', 'INDIA'),
+    ('NAIROBI', 'NAIROBI', 'KENYA'),
+    ('LAGOS', 'LAGOS', 'NIGERIA'),
+    ('DHAKA', 'DHAKA', 'BANGLADESH'),
+    ('LIMA', 'LIMA', 'PERU'),
+    ('AUSTIN', 'TEXAS', 'UNITED STATES'),
+)
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    """
+    Creates a migrated, file backed test database for the duration of the block.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    old_name = connection.settings_dict['NAME']
+    handle, path = tempfile.mkstemp(suffix='.sqlite3', prefix='ngo_hub_benchmark_')
+    os.close(handle)
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = path
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, keepdb=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity, keepdb=False)
+        test_settings['NAME'] = old_test_name
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def benchmark_user():
+    from django.contrib.auth import get_user_model
+    user, _ = get_user_model().objects.get_or_create(
+        username='benchmark', defaults={'email': 'benchmark@ngo-hub.com'})
+    return user
+
+
+def words(rng, count):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=count))
+
+
+def make_ngo(rng, index, user, locations=CITIES):
+    from core.models import Ngo
+    city, state, country = rng.choice(locations)
+    return Ngo(
+        created_by=user,
+        modified_by=user,
+        name='%s %s Foundation' % (words(rng, 2).title(), rng.choice(WORDS).title()),
+        purpose=words(rng, 12),
+        description=words(rng, 60),
+        location_city=city,
+        location_state=state,
+        location_country=country,
+        phone_primary='%010d' % index,
+        phone_secondary='9%09d' % index,
+        email='ngo%d@example.org' % index,
+        website='https://ngo%d.example.org' % index,
+    )
+
+
+def seed_users(count, prefix='member'):
+    """
+    Bulk inserts count users with an authentication token each.
+    Returns the new users.
+    """
+    from django.contrib.auth import get_user_model
+    from rest_framework.authtoken.models import Token
+    User = get_user_model()
+    start = User.objects.count()
+    User.objects.bulk_create([
+        User(username='%s%d' % (prefix, start + index), email='%s%d@example.org' % (prefix, start + index))
+        for index in range(count)
+    ])
+    users = list(User.objects.order_by('-id')[:count])[::-1]
+    tokens = [Token(user=user) for user in users]
+    for token in tokens:
+        token.key = token.generate_key()
+    Token.objects.bulk_create(tokens)
+    return users
+
+
+def seed_ngos(count, user=None, seed=0, batch_size=5000, users=None, locations=CITIES):
+    """
+    Bulk inserts count Ngos with their Ngo_Verification rows, created by
+    user, or by each of users in turn, located at one of locations.
+    Returns the ids of the new Ngos.
+    """
+    from core import gazetteer, geo
+    from core.models import Ngo, Ngo_Verification
+    users = users or [user or benchmark_user()]
+    rng = random.Random(seed)
+    start = Ngo.objects.count()
+    ids = []
+    for offset in range(0, count, batch_size):
+        ngos = [
+            make_ngo(rng, start + offset + i, users[(offset + i) % len(users)], locations)
+            for i in range(min(batch_size, count - offset))
+        ]
+        for ngo in ngos:
+            ngo.place_id = gazetteer.geocode(ngo.location_city, ngo.location_state, ngo.location_country)
+        Ngo.objects.bulk_create(ngos)
+        geo.add_places(ngo.place_id for ngo in ngos)
+        if ngos[0].pk is None:
+            # Backends that do not return primary keys from bulk_create
+            ngos = list(Ngo.objects.order_by('-id')[:len(ngos)])[::-1]
+        Ngo_Verification.objects.bulk_create(
+            [Ngo_Verification(ngo=ngo, modified_by_id=ngo.created_by_id) for ngo in ngos])
+        ids.extend(ngo.pk for ngo in ngos)
+    return ids
+
+
+def seed_details(ngo_ids, seed=0, batch_size=5000):
+    """
+    Bulk inserts an Ngo_Detail row for each of the given Ngos.
+    """
+    from core.models import Ngo_Detail
+    rng = random.Random(seed)
+
+    def choice(choices):
+        return rng.choice(choices)[0]
+
+    details = [
+        Ngo_Detail(
+            ngo_id=ngo_id,
+            orientation=choice(Ngo_Detail.ORIENTATION),
+            level=choice(Ngo_Detail.LEVEL),
+            activity=choice(Ngo_Detail.ACTIVITY),
+            staffing=choice(Ngo_Detail.STAFFING),
+            fund=choice(Ngo_Detail.FUND),
+            fund_acceptance_from=choice(Ngo_Detail.FUND_ACCEPTANCE_FROM),
+            legal_status=choice(Ngo_Detail.LEGAL_STATUS),
+            overhead_cost=rng.randint(0, 60),
+        )
+        for ngo_id in ngo_ids
+    ]
+    Ngo_Detail.objects.bulk_create(details, batch_size=batch_size)
+
+
+def measure(function, repeat=20):
+    """
+    Calls function repeat times, returns the timings in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        'median_ms': round(statistics.median(ordered), 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'max_ms': round(ordered[-1], 3),
+    }
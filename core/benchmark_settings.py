@@ -0,0 +1,17 @@
+"""
+Settings of the servers started by the benchmark_asgi command: the project
+settings on the benchmark database, without throttling, response cache or
+DEBUG query logging, so that every request goes down to the database.
+"""
+import os
+
+from NGO_Hub_API.settings import *  # noqa: F401,F403
+from NGO_Hub_API.settings import DATABASES, REST_FRAMEWORK
+
+DEBUG = False
+
+DATABASES['default']['NAME'] = os.environ['NGO_HUB_BENCHMARK_DATABASE']
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_THROTTLE_CLASSES=[])
+
+NGO_HUB_RESPONSE_CACHE = False
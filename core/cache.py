@@ -0,0 +1,305 @@
+"""
+Response cache for the read endpoints of the core viewsets.
+
+Responses are stored in the `responses` cache alias (see CACHES in
+settings) under a key made of the route, the query parameters, the
+serializer fingerprint and the current token of every tag the response
+depends on. Saving or deleting a record replaces the tokens of its tags,
+so every response built from the old state becomes unreachable at once
+and ages out through LRU eviction; nothing has to be enumerated.
+
+Tags of a record:
++ <model>            lists of that model
++ <model>:<pk>       the record itself
++ ngo:<ngo id>       everything about one Ngo (used by the profile)
+
+Only responses read from the default database are stored: a replica may
+still lag behind the write that replaced the tokens, and its response
+would then be served to the writer pinned to the default database.
+"""
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.db import replicas
+
+
+CACHE_ALIAS = 'responses'
+KEY_PREFIX = 'ngo-hub-response:'
+TAG_PREFIX = 'ngo-hub-tag:'
+
+
+class LRUCache(BaseCache):
+    """
+    Process local cache bounded by entry count (MAX_ENTRIES) and by the
+    total size of the pickled values (OPTIONS['MAX_BYTES']). The least
+    recently used entries are evicted one by one until both bounds hold.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _expired(self, expiry):
+        return expiry is not None and expiry <= time.time()
+
+    def _pop(self, key):
+        pickled, _ = self._entries.pop(key)
+        self._bytes -= len(pickled)
+
+    def _store(self, key, pickled, timeout):
+        if key in self._entries:
+            self._pop(key)
+        if len(pickled) > self._max_bytes:
+            return False
+        self._entries[key] = (pickled, self.get_backend_timeout(timeout))
+        self._bytes += len(pickled)
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            oldest = next(iter(self._entries))
+            self._pop(oldest)
+            self.evictions += 1
+        return True
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[1]):
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+            return self._store(key, pickled, timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._lookup(key)
+        if pickled is None:
+            return default
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            return self._store(key, pickled, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._lookup(key)
+            if pickled is None:
+                return False
+            self._entries[key] = (pickled, self.get_backend_timeout(timeout))
+            return True
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._pop(key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self._max_entries,
+                'max_bytes': self._max_bytes,
+                'evictions': self.evictions,
+            }
+
+
+# Hit / miss counters of this process
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    lookups = result['hits'] + result['misses']
+    result['hit_ratio'] = round(result['hits'] / lookups, 4) if lookups else None
+    backend = response_cache()
+    if hasattr(backend, 'info'):
+        result['backend'] = backend.info()
+    return result
+
+
+def enabled():
+    return getattr(settings, 'NGO_HUB_RESPONSE_CACHE', True)
+
+
+def response_cache():
+    return caches[CACHE_ALIAS]
+
+
+def record_tags(instance):
+    """
+    Returns the tags a saved or deleted record invalidates.
+    """
+    model_name = instance._meta.model_name
+    ngo_id = instance.pk if model_name == 'ngo' else getattr(instance, 'ngo_id', None)
+    tags = [model_name, '%s:%s' % (model_name, instance.pk)]
+    if ngo_id is not None:
+        tags.append('ngo:%s' % ngo_id)
+    return tags
+
+
+def _replace_tokens(tags):
+    cache = response_cache()
+    cache.set_many({TAG_PREFIX + tag: uuid.uuid4().hex for tag in tags}, None)
+    _count('invalidations', len(tags))
+
+
+def invalidate(tags):
+    """
+    Makes every response depending on one of the tags unreachable.
+    Done again on commit, so that a response cached from the old state
+    while the write transaction was still open does not survive either.
+    """
+    tags = list(tags)
+    if not tags:
+        return
+    _replace_tokens(tags)
+    transaction.on_commit(lambda: _replace_tokens(tags))
+
+
+def tag_tokens(tags):
+    """
+    Returns the current token of each tag, creating missing ones. A fresh
+    token is never equal to an old one, so an evicted tag cannot bring
+    stale responses back.
+    """
+    cache = response_cache()
+    keys = [TAG_PREFIX + tag for tag in tags]
+    tokens = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in tokens}
+    if missing:
+        cache.set_many(missing, None)
+        tokens.update(missing)
+    return [tokens[key] for key in keys]
+
+
+def serializer_fingerprint(serializer_class):
+    meta = getattr(serializer_class, 'Meta', None)
+    return '%s.%s:%s' % (
+        serializer_class.__module__, serializer_class.__qualname__,
+        ','.join(getattr(meta, 'fields', ()) or ()))
+
+
+def make_key(request, tags, fingerprint):
+    parts = [
+        request.get_host(),
+        request.path,
+        '&'.join('%s=%s' % (key, value) for key, value in sorted(request.query_params.lists())),
+        fingerprint,
+        str(getattr(settings, 'NGO_HUB_RESPONSE_CACHE_VERSION', 1)),
+    ] + tag_tokens(tags)
+    return KEY_PREFIX + hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class CachedResponseMixin:
+    """
+    Caches list and retrieve responses of a viewset.
+    cache_dependencies are the model names whose changes invalidate the list,
+    cache_object_tag formats the tag of a single record from its pk.
+    """
+    cache_dependencies = ()
+    cache_object_tag = None
+
+    def get_cache_dependencies(self):
+        return self.cache_dependencies or (self.get_queryset().model._meta.model_name,)
+
+    def get_cache_object_tag(self, pk):
+        template = self.cache_object_tag or self.get_queryset().model._meta.model_name + ':{pk}'
+        return template.format(pk=pk)
+
+    def cached_response(self, request, tags, build):
+        """
+        Returns the cached response for this request or stores the one build() returns.
+        """
+        if not enabled() or request.method not in ('GET', 'HEAD'):
+            return build()
+        cache = response_cache()
+        key = make_key(request, tags, serializer_fingerprint(self.get_serializer_class()))
+        entry = cache.get(key)
+        if entry is not None:
+            _count('hits')
+            response = Response(entry['data'], status=entry['status'])
+            response['X-Cache'] = 'HIT'
+            return response
+        _count('misses')
+        response = build()
+        if (response.status_code == status.HTTP_200_OK and not getattr(response, 'streaming', False)
+                and replicas.current_replica() is None):
+            cache.set(key, {'data': response.data, 'status': response.status_code})
+            _count('stores')
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        parent = super().list
+        return self.cached_response(
+            request, self.get_cache_dependencies(), lambda: parent(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        parent = super().retrieve
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.cached_response(
+            request, [self.get_cache_object_tag(pk)], lambda: parent(request, *args, **kwargs))
+
+
+def cache_response(*dependencies):
+    """
+    Caches a viewset action, dependencies being the model names it reads.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            return self.cached_response(
+                request, dependencies, lambda: method(self, request, *args, **kwargs))
+        return wrapper
+    return decorator
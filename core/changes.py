@@ -0,0 +1,213 @@
+"""
+Change feed of the directory, for the mirrors of partners.
+
+Every save and delete of an Ngo, Ngo_Verification or Ngo_Detail writes an
+Ngo_Change row in the same transaction (see core.signals), replacing the
+previous row of the record; deletes leave a tombstone. The row ids are the
+sequence numbers of the feed. They follow the commit order: SQLite has a
+single writer, and on Postgres the writers take a lock on the table until
+their commit, so a mirror never skips a change committed after it read.
+
+GET /core/changes/?since=<seq> returns the changes after since, oldest
+first, in batches of at most NGO_HUB_CHANGES_MAX_BATCH_SIZE, each with the
+current data of the record. since=0 returns every record. The client
+passes the last_seq of a response as the since of the next one. Modes:
++ ?wait=<seconds>   long poll, answers as soon as there is a change or after
+                    wait seconds (at most NGO_HUB_CHANGES_MAX_WAIT)
++ Accept: text/event-stream (or ?format=sse)
+                    Server-Sent Events, one "change" event per change with
+                    the sequence number as id, keep-alive comments in
+                    between; the stream ends after
+                    NGO_HUB_CHANGES_STREAM_SECONDS and EventSource resumes
+                    it from the Last-Event-ID header
+
+A waiting request is woken at once by the commits of its own process, and
+notices the others with one indexed MAX(id) query every
+NGO_HUB_CHANGES_POLL_SECONDS. Under gunicorn's sync workers a waiting
+request holds its worker, keep the waits below the worker timeout.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from rest_framework.renderers import BaseRenderer
+
+from core.fast import FastJSONRenderer, compile_serializer
+from core.models import Ngo, Ngo_Change, Ngo_Detail, Ngo_Verification
+from core.serializers import NgoSerializer, Ngo_DetailSerializer, Ngo_VerificationSerializer
+
+
+# Model name in the feed and serializer of the data of each model
+MODELS = OrderedDict([
+    ('ngo', (Ngo, NgoSerializer)),
+    ('ngo_verification', (Ngo_Verification, Ngo_VerificationSerializer)),
+    ('ngo_detail', (Ngo_Detail, Ngo_DetailSerializer)),
+])
+MODEL_NAMES = {model: name for name, (model, serializer_class) in MODELS.items()}
+
+# Stay below the bound parameter limit of the database
+MAX_IDS_PER_QUERY = 500
+
+# The feed is read from the default database, a lagging replica would
+# make it go backwards
+DATABASE = DEFAULT_DB_ALIAS
+
+_condition = threading.Condition()
+
+
+def lock(using):
+    """
+    Holds back the other writers of the feed until the commit, so that the
+    sequence numbers become visible in order. SQLite has a single writer already.
+    """
+    if connections[using].vendor == 'postgresql':
+        with connections[using].cursor() as cursor:
+            cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % Ngo_Change._meta.db_table)
+
+
+def notify():
+    """
+    Wakes the requests of this process waiting for a change.
+    """
+    with _condition:
+        _condition.notify_all()
+
+
+def record(instance, deleted=False, adding=False, using=DEFAULT_DB_ALIAS):
+    """
+    Appends the change of instance to the feed, a tombstone when deleted.
+    """
+    model = MODEL_NAMES[type(instance)]
+    changes = Ngo_Change.objects.using(using)
+    with transaction.atomic(using=using, savepoint=False):
+        lock(using)
+        if not adding:
+            changes.filter(model=model, object_id=instance.pk).delete()
+        changes.create(
+            model=model, object_id=instance.pk, deleted=deleted,
+            ngo_id=instance.pk if model == 'ngo' else instance.ngo_id)
+    transaction.on_commit(notify, using=using)
+
+
+def record_new_ngos(ngo_ids, using=DEFAULT_DB_ALIAS):
+    """
+    Appends the creation of the Ngos and of their Ngo_Verification rows,
+    for the bulk inserts that send no signals.
+    """
+    ngo_ids = list(ngo_ids)
+    rows = [Ngo_Change(model='ngo', object_id=pk, ngo_id=pk) for pk in ngo_ids]
+    for start in range(0, len(ngo_ids), MAX_IDS_PER_QUERY):
+        rows.extend(
+            Ngo_Change(model='ngo_verification', object_id=pk, ngo_id=ngo_id)
+            for pk, ngo_id in Ngo_Verification.objects.using(using).filter(
+                ngo_id__in=ngo_ids[start:start + MAX_IDS_PER_QUERY]).values_list('id', 'ngo_id'))
+    with transaction.atomic(using=using, savepoint=False):
+        lock(using)
+        Ngo_Change.objects.using(using).bulk_create(rows)
+    transaction.on_commit(notify, using=using)
+
+
+def latest_seq(using=DATABASE):
+    return Ngo_Change.objects.using(using).aggregate(seq=Max('id'))['seq'] or 0
+
+
+def record_data(model, ids):
+    """
+    Returns {id: serialized data} of the records of model that still exist.
+    """
+    model_class, serializer_class = MODELS[model]
+    queryset = model_class.objects.using(DATABASE)
+    compiled = compile_serializer(serializer_class)
+    data = {}
+    for start in range(0, len(ids), MAX_IDS_PER_QUERY):
+        chunk = queryset.filter(pk__in=ids[start:start + MAX_IDS_PER_QUERY])
+        if compiled is not None:
+            rows = list(compiled.values(chunk, extra=('id',)))
+            data.update(zip((row['id'] for row in rows), compiled.represent(rows)))
+        else:
+            data.update((instance.pk, serializer_class(instance).data) for instance in chunk)
+    return data
+
+
+def changes_since(since, limit):
+    """
+    Returns (changes, last_seq, more): at most limit changes after since,
+    the sequence number to read from next and whether more changes follow.
+    """
+    rows = list(Ngo_Change.objects.using(DATABASE).filter(id__gt=since).order_by('id')[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    ids = {}
+    for row in rows:
+        if not row.deleted:
+            ids.setdefault(row.model, []).append(row.object_id)
+    data = {model: record_data(model, model_ids) for model, model_ids in ids.items()}
+    changes = []
+    for row in rows:
+        change = {'seq': row.pk, 'model': row.model, 'id': row.object_id, 'ngo': row.ngo_id,
+                  'deleted': row.deleted, 'data': None}
+        if not row.deleted:
+            change['data'] = data[row.model].get(row.object_id)
+            if change['data'] is None:
+                # Deleted since, its tombstone follows
+                continue
+        changes.append(change)
+    return changes, rows[-1].pk if rows else since, more
+
+
+def wait(since, timeout):
+    """
+    Waits up to timeout seconds for a change after since.
+    Returns whether there is one.
+    """
+    deadline = time.monotonic() + timeout
+    poll_seconds = settings.NGO_HUB_CHANGES_POLL_SECONDS
+    while True:
+        if latest_seq() > since:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _condition:
+            _condition.wait(min(poll_seconds, remaining))
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets the clients ask for text/event-stream. The events are written by
+    stream(), errors (e.g. a missing token) are sent as an "error" event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b'event: error\ndata: %s\n\n' % FastJSONRenderer().render(data)
+
+
+def stream(since, limit, seconds, once=False):
+    """
+    Yields the Server-Sent Events of the changes after since for seconds,
+    or, with once, until the first batch of changes.
+    """
+    renderer = FastJSONRenderer()
+    deadline = time.monotonic() + seconds
+    heartbeat_seconds = settings.NGO_HUB_CHANGES_HEARTBEAT_SECONDS
+    # EventSource reconnects this many milliseconds after the end of the stream
+    yield b'retry: 1000\n\n'
+    while True:
+        changes, since, more = changes_since(since, limit)
+        for change in changes:
+            yield b'id: %d\nevent: change\ndata: %s\n\n' % (change['seq'], renderer.render(change))
+        if more:
+            continue
+        if once and changes:
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not wait(since, min(heartbeat_seconds, remaining)):
+            yield b': keep-alive\n\n'
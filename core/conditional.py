@@ -0,0 +1,96 @@
+"""
+Conditional requests for the core viewsets.
+
+Every record carries a version (incremented by the UPDATE of each save)
+and a modified_at timestamp. Retrieve answers with a strong ETag and
+Last-Modified, and returns 304 Not Modified for a matching If-None-Match /
+If-Modified-Since without serializing. Updates honour If-Match and fail
+with 412 when the record changed since the client read it. Only the
+version columns are read to compute the validators, never the full row.
+"""
+from django.db import transaction
+from django.http import Http404
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class ConditionalMixin:
+    """
+    Adds ETag / Last-Modified handling to retrieve, update and partial_update.
+    etag_fields and last_modified_fields are lookups on the viewset queryset.
+    """
+    etag_fields = ('version',)
+    last_modified_fields = ('modified_at',)
+
+    def get_validators(self):
+        """
+        Returns (etag, last_modified) of the requested object from its version columns.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        row = queryset.values_list(*(self.etag_fields + self.last_modified_fields)).first()
+        if row is None:
+            raise Http404
+        versions = row[:len(self.etag_fields)]
+        timestamps = [value for value in row[len(self.etag_fields):] if value is not None]
+        etag = quote_etag('%s-%s-%s' % (
+            queryset.model._meta.model_name,
+            self.kwargs[lookup_url_kwarg],
+            '.'.join('0' if version is None else str(version) for version in versions)))
+        return etag, max(timestamps) if timestamps else None
+
+    def set_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def is_not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+            # Weak comparison, as required for If-None-Match
+            return '*' in candidates or etag in [
+                candidate[2:] if candidate.startswith('W/') else candidate
+                for candidate in candidates]
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since is not None and last_modified is not None:
+            return int(last_modified.timestamp()) <= if_modified_since
+        return False
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        if self.is_not_modified(request, etag, last_modified):
+            return self.set_validators(
+                Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+
+    def update(self, request, *args, **kwargs):
+        if_match = request.META.get('HTTP_IF_MATCH')
+        with transaction.atomic():
+            if if_match is not None:
+                # Lock the row so that the check and the save see the same version
+                self.lock_object()
+                etag, last_modified = self.get_validators()
+                candidates = [candidate.strip() for candidate in if_match.split(',')]
+                # Strong comparison, as required for If-Match
+                if '*' not in candidates and etag not in candidates:
+                    return self.set_validators(
+                        Response(
+                            {'detail': 'The record was modified, fetch it again.'},
+                            status=status.HTTP_412_PRECONDITION_FAILED),
+                        etag, last_modified)
+            response = super().update(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                # In the transaction, the validators of the version just written
+                self.set_validators(response, *self.get_validators())
+        return response
+
+    def lock_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        list(self.get_queryset().model.objects.select_for_update()
+             .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+             .values_list('pk'))
@@ -0,0 +1,187 @@
+"""
+Database connection management.
+
+ENGINE is replaced in settings by the backends of this package:
++ core.db.sqlite3      persistent connections tuned for concurrent access
+                       (NGO_HUB_SQLITE_PRAGMAS run on every new connection)
++ core.db.postgresql   a bounded pool of NGO_HUB_DB_POOL_SIZE connections
+                       per process, shared by the threads of the process
+
+Both check a reused connection before its first query of a request and
+reconnect when the server dropped it. stats() reports the connections of
+this process, per database alias. Read replicas are in core.db.replicas.
+"""
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.db import OperationalError
+
+
+_counters = defaultdict(Counter)
+_counters_lock = threading.Lock()
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def count(alias, name, amount=1):
+    with _counters_lock:
+        _counters[alias][name] += amount
+
+
+def stats():
+    """
+    Returns {alias: {connects, closes, open, health_check_failures[, pool][, replica]}}.
+    """
+    from core.db.replicas import replicas
+
+    replica_stats = replicas.stats()
+    result = {}
+    with _counters_lock:
+        counters = {alias: dict(values) for alias, values in _counters.items()}
+    for alias in settings.DATABASES:
+        entry = {'connects': 0, 'closes': 0, 'health_check_failures': 0}
+        entry.update(counters.get(alias, {}))
+        entry['open'] = entry['connects'] - entry['closes']
+        pool = _pools.get(alias)
+        if pool is not None:
+            entry['pool'] = pool.stats()
+        if alias in replica_stats:
+            entry['replica'] = replica_stats[alias]
+        result[alias] = entry
+    return result
+
+
+class ConnectionPool:
+    """
+    At most size connections, handed out to one thread at a time. Threads
+    wait up to timeout seconds for a free connection. Idle connections are
+    checked with check() before being handed out and dropped after max_idle
+    seconds.
+    """
+    def __init__(self, size, timeout, max_idle, check, discard):
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._check = check
+        self._discard = discard
+        self._idle = deque()
+        self._in_use = 0
+        self._pid = os.getpid()
+        self._condition = threading.Condition()
+        self._stats = Counter()
+
+    def _after_fork(self):
+        # Connections inherited from the parent process belong to it
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle.clear()
+            self._in_use = 0
+
+    def acquire(self, connect):
+        """
+        Returns an idle connection, or a new one from connect().
+        """
+        deadline = None
+        with self._condition:
+            self._after_fork()
+            while True:
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    connection = returned_at = None
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise OperationalError(
+                        'No database connection available within %s seconds.' % self.timeout)
+                self._condition.wait(remaining)
+            self._in_use += 1
+        try:
+            if connection is not None:
+                if time.monotonic() - returned_at > self.max_idle or not self._check(connection):
+                    self._stats['discarded'] += 1
+                    self._discard(connection)
+                    connection = None
+                else:
+                    self._stats['reused'] += 1
+            if connection is None:
+                connection = connect()
+                self._stats['created'] += 1
+        except BaseException:
+            self._release_slot()
+            raise
+        return connection
+
+    def _release_slot(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    def release(self, connection, reusable=True):
+        """
+        Returns a connection to the pool, or discards it.
+        """
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            self._in_use -= 1
+            if reusable and len(self._idle) < self.size:
+                self._idle.append((connection, time.monotonic()))
+                connection = None
+            self._condition.notify()
+        if connection is not None:
+            self._stats['discarded'] += 1
+            self._discard(connection)
+
+    def stats(self):
+        with self._condition:
+            result = {'size': self.size, 'in_use': self._in_use, 'idle': len(self._idle)}
+            for name in ('created', 'reused', 'discarded', 'waits', 'timeouts'):
+                result[name] = self._stats[name]
+        return result
+
+
+def get_pool(alias, **kwargs):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(**kwargs)
+        return _pools[alias]
+
+
+class ConnectionMixin:
+    """
+    Counts connections and checks reused ones before the first query of a
+    request (the CONN_HEALTH_CHECKS behaviour of later Django versions).
+    """
+    health_check_needed = False
+
+    def connect(self):
+        super().connect()
+        self.health_check_needed = False
+        count(self.alias, 'connects')
+
+    def _close(self):
+        if self.connection is not None:
+            count(self.alias, 'closes')
+        return super()._close()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Called at the start and the end of every request
+        self.health_check_needed = self.connection is not None
+
+    def ensure_connection(self):
+        if self.health_check_needed and self.connection is not None and not self.in_atomic_block:
+            self.health_check_needed = False
+            if not self.is_usable():
+                count(self.alias, 'health_check_failures')
+                self.close()
+        super().ensure_connection()
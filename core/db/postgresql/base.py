@@ -0,0 +1,80 @@
+"""
+PostgreSQL backend taking its connections from a bounded per-process pool.
+Closing a connection (at the end of each request, CONN_MAX_AGE being 0)
+returns it to the pool with its transaction rolled back.
+"""
+from django.conf import settings
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from core.db import ConnectionMixin, count, get_pool
+
+
+# Isolation level the parent method read from the first new connection
+isolation_levels = {}
+
+
+def check(connection):
+    """
+    Returns whether a pooled connection still answers.
+    """
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except base.Database.Error:
+        return False
+    return True
+
+
+def discard(connection):
+    try:
+        connection.close()
+    except base.Database.Error:
+        pass
+
+
+class DatabaseWrapper(ConnectionMixin, base.DatabaseWrapper):
+
+    @property
+    def pool(self):
+        return get_pool(
+            self.alias,
+            size=getattr(settings, 'NGO_HUB_DB_POOL_SIZE', 10),
+            timeout=getattr(settings, 'NGO_HUB_DB_POOL_TIMEOUT', 10),
+            max_idle=getattr(settings, 'NGO_HUB_DB_POOL_MAX_IDLE', 300),
+            check=check,
+            discard=discard,
+        )
+
+    def get_new_connection(self, conn_params):
+        created = []
+
+        def connect():
+            created.append(True)
+            connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+            isolation_levels[self.alias] = self.isolation_level
+            return connection
+
+        connection = self.pool.acquire(connect)
+        if not created:
+            # Set by the parent method on new connections only
+            self.isolation_level = isolation_levels[self.alias]
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        count(self.alias, 'closes')
+        connection = self.connection
+        reusable = not connection.closed
+        if reusable:
+            try:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except base.Database.Error:
+                reusable = False
+        self.pool.release(connection, reusable)
@@ -0,0 +1,226 @@
+"""
+Read replicas.
+
+ReplicaMiddleware picks a replica for every GET / HEAD request, unless the
+client wrote something in the last NGO_HUB_REPLICA_PIN_SECONDS seconds
+(read your writes); ReplicaRouter then sends the reads of that request to
+it. Writes, other methods, transactions and code running outside requests
+always use the default database.
+
+Clients are pinned by their token or session in the default cache: with
+replicas, CACHES['default'] must be shared by all the worker processes
+(e.g. memcached), with the per process locmem cache another worker could
+still read from a stale replica.
+
+Replicas are picked round robin, or by their smallest average query time
+with NGO_HUB_REPLICA_STRATEGY = 'least_latency'. A replica that cannot be
+connected to is skipped for NGO_HUB_REPLICA_RETRY_SECONDS seconds, the
+request falling back to another replica or to the default database.
+"""
+import hashlib
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.utils.deprecation import MiddlewareMixin
+
+
+PIN_COOKIE = 'ngo_hub_primary'
+PIN_PREFIX = 'ngo-hub-primary:'
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Replica the reads of the current request go to, None for the default database
+_replica = ContextVar('ngo_hub_replica', default=None)
+
+
+def current_replica():
+    """
+    Returns the replica the reads of the current request go to, None for the default database.
+    """
+    return _replica.get()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+class ReplicaSet:
+    """
+    Replica selection with per replica latency averages and down times.
+    """
+    # Weight of the newest query time in the moving average
+    SMOOTHING = 0.1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._latency = {}
+        self._down_until = {}
+        self._stats = {}
+
+    def _count(self, alias, name):
+        entry = self._stats.setdefault(alias, {'requests': 0, 'failures': 0})
+        entry[name] += 1
+
+    def candidates(self):
+        """
+        Returns the available replicas, preferred one first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            aliases = [alias for alias in replica_aliases() if self._down_until.get(alias, 0) <= now]
+            if not aliases:
+                return []
+            if getattr(settings, 'NGO_HUB_REPLICA_STRATEGY', 'round_robin') == 'least_latency':
+                # Replicas without measurements are tried first
+                aliases.sort(key=lambda alias: self._latency.get(alias, 0))
+            else:
+                start = next(self._counter) % len(aliases)
+                aliases = aliases[start:] + aliases[:start]
+            self._count(aliases[0], 'requests')
+            return aliases
+
+    def mark_down(self, alias):
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + getattr(
+                settings, 'NGO_HUB_REPLICA_RETRY_SECONDS', 30)
+            self._count(alias, 'failures')
+
+    def record(self, alias, milliseconds):
+        with self._lock:
+            previous = self._latency.get(alias)
+            self._latency[alias] = milliseconds if previous is None else (
+                previous + self.SMOOTHING * (milliseconds - previous))
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                alias: dict(
+                    self._stats.get(alias, {'requests': 0, 'failures': 0}),
+                    latency_ms=round(self._latency[alias], 3) if alias in self._latency else None,
+                    down=self._down_until.get(alias, 0) > now,
+                )
+                for alias in replica_aliases()
+            }
+
+
+replicas = ReplicaSet()
+
+
+def available(alias):
+    """
+    Returns whether the replica can be used, connecting to it if needed.
+    """
+    connection = connections[alias]
+    if connection.connection is not None:
+        return True
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        replicas.mark_down(alias)
+        return False
+    return True
+
+
+def client_keys(request):
+    """
+    Returns the cache keys identifying the client of a request: hashes of
+    its token (Authorization header) and of its session cookie. The
+    address is no key, behind a proxy or router it is shared by clients.
+    """
+    credentials = [
+        request.META.get('HTTP_AUTHORIZATION'),
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME),
+    ]
+    return [
+        PIN_PREFIX + hashlib.sha1(credential.encode('utf-8')).hexdigest()
+        for credential in credentials if credential
+    ]
+
+
+def is_pinned(request):
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    keys = client_keys(request)
+    return bool(keys and cache.get_many(keys))
+
+
+def pin(request, response):
+    """
+    Sends the next reads of the client to the default database, on every
+    worker when the default cache is shared. The cookie also covers the
+    clients that send no credentials.
+    """
+    seconds = getattr(settings, 'NGO_HUB_REPLICA_PIN_SECONDS', 5)
+    keys = client_keys(request)
+    if keys:
+        cache.set_many(dict.fromkeys(keys, True), seconds)
+    response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    """
+    Picks the database the reads of the request go to.
+    """
+    def process_request(self, request):
+        replica = None
+        if request.method in SAFE_METHODS and replica_aliases() and not is_pinned(request):
+            candidates = replicas.candidates()
+            replica = candidates[0] if candidates else None
+        _replica.set(replica)
+
+    def process_response(self, request, response):
+        _replica.set(None)
+        if (request.method not in SAFE_METHODS and replica_aliases()
+                and response.status_code < 400):
+            pin(request, response)
+        return response
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of safe requests to the replica picked by ReplicaMiddleware.
+    """
+    def db_for_read(self, model, **hints):
+        replica = _replica.get()
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if available(replica):
+            return replica
+        # Stick to the fallback for the rest of the request
+        replica = next((alias for alias in replicas.candidates() if available(alias)), None)
+        _replica.set(replica)
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the default database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the default database
+        return db == DEFAULT_DB_ALIAS
+
+
+def record_latency(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        replicas.record(context['connection'].alias, (time.perf_counter() - started) * 1000)
+
+
+def time_replica_queries(sender, connection, **kwargs):
+    if connection.alias != DEFAULT_DB_ALIAS and record_latency not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_latency)
+
+
+connection_created.connect(time_replica_queries)
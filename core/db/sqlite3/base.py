@@ -0,0 +1,16 @@
+"""
+SQLite backend applying NGO_HUB_SQLITE_PRAGMAS to every new connection.
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+from core.db import ConnectionMixin
+
+
+class DatabaseWrapper(ConnectionMixin, base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for pragma, value in getattr(settings, 'NGO_HUB_SQLITE_PRAGMAS', {}).items():
+            connection.execute('PRAGMA %s = %s' % (pragma, value))
+        return connection
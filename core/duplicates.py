@@ -0,0 +1,279 @@
+"""
+Detection of the Ngos registered more than once.
+
+Every Ngo has signature keys in Ngo_Signature, kept current from the save
+signals (see core.signals) and by the importer:
++ one exact key per contact: the email, the website (host and path, without
+  scheme, www. or trailing slash) and each phone number (its last 10 digits)
++ NAME_BANDS locality sensitive keys of the name in its city: MinHash of
+  the character trigrams of the normalised name, cut in bands of
+  BAND_ROWS values. Two names whose trigram sets have a Jaccard similarity
+  of 0.8 share a band 98% of the time, at 0.3 only 6% of the time.
+
+Two Ngos are duplicates when they share a contact, or when they are in the
+same city and their names are at least NGO_HUB_DUPLICATE_NAME_SIMILARITY
+similar. A new Ngo is checked with one indexed lookup of its keys, whatever
+the size of the table. Bulk imports are indexed but not checked:
+`manage.py find_duplicate_ngos` clusters the whole table. The keys depend on the constants below, rebuild the table after a
+change of them (`find_duplicate_ngos --rebuild-index`).
+"""
+import hashlib
+import re
+import struct
+import unicodedata
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.models import Ngo, Ngo_Signature
+
+
+NAME_BANDS = 8
+BAND_ROWS = 4
+
+# Words that do not tell two Ngos apart
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'the', 'of', 'for', 'in', 'ngo', 'trust', 'society', 'foundation',
+    'organisation', 'organization', 'association', 'inc', 'ltd', 'limited', 'pvt', 'private',
+))
+
+# Phone numbers are compared on their last digits, without the country code
+PHONE_DIGITS = 10
+MIN_PHONE_DIGITS = 7
+
+# Ngo fields the signature is made of, in the order signature() takes them
+FIELDS = ('name', 'location_city', 'email', 'website', 'phone_primary', 'phone_secondary')
+
+MAX_IDS_PER_QUERY = 500
+
+NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+# One 16 bit MinHash value per 2 bytes of a BLAKE2b digest of the trigram:
+# a single hash call gives all the values of a trigram
+_UNPACK_HASHES = struct.Struct('>%dH' % (NAME_BANDS * BAND_ROWS)).unpack
+_DIGEST_SIZE = NAME_BANDS * BAND_ROWS * 2
+
+
+def _key(*parts):
+    """
+    Returns the signed 64 bit key of the parts, a BigIntegerField value.
+    """
+    digest = hashlib.blake2b('\x1f'.join(map(str, parts)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def normalize_name(name):
+    """
+    Returns the words of name lower-cased, without accents, punctuation
+    and STOP_WORDS (unless nothing else is left).
+    """
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(character for character in name if not unicodedata.combining(character)).lower()
+    words = NON_WORD_RE.sub(' ', name).split()
+    return ' '.join([word for word in words if word not in STOP_WORDS] or words)
+
+
+def shingles(name):
+    """
+    Returns the set of the character trigrams of the normalised name.
+    """
+    text = ' %s ' % normalize_name(name)
+    return {text[index:index + 3] for index in range(max(1, len(text) - 2))}
+
+
+def similarity(name1, name2):
+    """
+    Jaccard similarity of the trigram sets of the names, from 0 to 1.
+    """
+    set1, set2 = shingles(name1), shingles(name2)
+    return len(set1 & set2) / len(set1 | set2)
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def normalize_website(website):
+    website = (website or '').strip().lower()
+    parts = urlsplit(website if '//' in website else '//' + website)
+    host = parts.hostname or ''
+    if host.startswith('www.'):
+        host = host[4:]
+    return host + parts.path.rstrip('/') if host else ''
+
+
+def normalize_phone(phone):
+    digits = ''.join(character for character in phone or '' if character.isdigit())
+    return digits[-PHONE_DIGITS:] if len(digits) >= MIN_PHONE_DIGITS else ''
+
+
+def normalize_city(city):
+    return ' '.join((city or '').upper().split())
+
+
+def name_keys(name, city):
+    """
+    Returns the LSH band keys of the name in the city.
+    """
+    minimums = [min(values) for values in zip(*(
+        _UNPACK_HASHES(hashlib.blake2b(shingle.encode('utf-8'), digest_size=_DIGEST_SIZE).digest())
+        for shingle in shingles(name)))]
+    return [
+        _key('name', band, normalize_city(city), *minimums[band * BAND_ROWS:(band + 1) * BAND_ROWS])
+        for band in range(NAME_BANDS)
+    ]
+
+
+def contact_keys(email, website, phone_primary, phone_secondary):
+    """
+    Returns the (kind, key) pairs of the contacts, kind being email,
+    website or phone.
+    """
+    keys = []
+    for kind, value in (
+            ('email', normalize_email(email)),
+            ('website', normalize_website(website)),
+            ('phone', normalize_phone(phone_primary)),
+            ('phone', normalize_phone(phone_secondary))):
+        key = (kind, _key(kind, value)) if value else None
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def signature(name, city, email, website, phone_primary, phone_secondary):
+    """
+    Returns the (kind, key) pairs of an Ngo, kind being the matched field:
+    name, email, website or phone.
+    """
+    return [('name', key) for key in name_keys(name, city)] + contact_keys(
+        email, website, phone_primary, phone_secondary)
+
+
+def instance_values(instance):
+    return tuple(getattr(instance, field) for field in FIELDS)
+
+
+def name_similarity_threshold():
+    return getattr(settings, 'NGO_HUB_DUPLICATE_NAME_SIMILARITY', 0.8)
+
+
+def compare(values, other_values):
+    """
+    Returns (matched fields, name similarity) of two Ngos given as FIELDS
+    tuples. The names only count in the same city, the similarity is None
+    in different cities. The Ngos are duplicates when a field matched.
+    """
+    return _compare(_features(values), other_values)
+
+
+def _features(values):
+    """
+    Returns what other Ngos are compared with: (trigrams of the name,
+    normalised city, contact keys).
+    """
+    return shingles(values[0]), normalize_city(values[1]), {key for kind, key in contact_keys(*values[2:])}
+
+
+def _compare(features, other_values):
+    name_shingles, city, contacts = features
+    matches = sorted({kind for kind, key in contact_keys(*other_values[2:]) if key in contacts})
+    if normalize_city(other_values[1]) != city:
+        return matches, None
+    other_shingles = shingles(other_values[0])
+    name_similarity = len(name_shingles & other_shingles) / len(name_shingles | other_shingles)
+    if name_similarity >= name_similarity_threshold():
+        matches.insert(0, 'name')
+    return matches, name_similarity
+
+
+def find(values, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the registered duplicates of an Ngo given as a FIELDS tuple,
+    most similar first: [{'id', 'name', 'matches', 'name_similarity'}].
+    """
+    keys = [key for kind, key in signature(*values)]
+    candidates = Ngo.objects.using(using).filter(signatures__key__in=keys).distinct()
+    features = _features(values)
+    duplicates = []
+    limit = getattr(settings, 'NGO_HUB_DUPLICATE_MAX_CANDIDATES', 100)
+    for row in candidates.values_list('id', *FIELDS)[:limit]:
+        matches, name_similarity = _compare(features, row[1:])
+        if matches:
+            duplicates.append({
+                'id': row[0], 'name': row[1], 'matches': matches,
+                'name_similarity': None if name_similarity is None else round(name_similarity, 3),
+            })
+    duplicates.sort(key=lambda duplicate: (-len(duplicate['matches']), -(duplicate['name_similarity'] or 0)))
+    return duplicates
+
+
+class DuplicateNgo(APIException):
+    """
+    Answers a registration of an Ngo that looks already registered.
+    """
+    status_code = status.HTTP_409_CONFLICT
+    default_code = 'duplicate'
+    default_detail = 'This Ngo looks already registered. Resend with ?allow_duplicate=true to register it anyway.'
+
+    def __init__(self, duplicates):
+        super().__init__()
+        # Set after __init__, which would turn the ids into strings
+        self.detail = {'detail': self.detail, 'duplicates': duplicates}
+
+
+def check(values, using=DEFAULT_DB_ALIAS):
+    """
+    Raises DuplicateNgo when an Ngo given as a FIELDS tuple has duplicates.
+    """
+    if not getattr(settings, 'NGO_HUB_DUPLICATE_CHECK', True):
+        return
+    duplicates = find(values, using=using)
+    if duplicates:
+        raise DuplicateNgo(duplicates)
+
+
+def index_ngo(instance, created=False, using=DEFAULT_DB_ALIAS):
+    """
+    Writes the signature keys of a saved Ngo, only the changed ones.
+    """
+    keys = {key for kind, key in signature(*instance_values(instance))}
+    signatures = Ngo_Signature.objects.using(using)
+    stored = set() if created else set(signatures.filter(ngo_id=instance.pk).values_list('key', flat=True))
+    if keys == stored:
+        return
+    with transaction.atomic(using=using, savepoint=False):
+        if stored - keys:
+            signatures.filter(ngo_id=instance.pk, key__in=stored - keys).delete()
+        signatures.bulk_create([Ngo_Signature(ngo_id=instance.pk, key=key) for key in keys - stored])
+
+
+def index_ngos(ngos, using=DEFAULT_DB_ALIAS, signature_model=Ngo_Signature):
+    """
+    Writes the signature keys of Ngos bulk inserted (instances with their pk).
+    """
+    signature_model.objects.using(using).bulk_create([
+        signature_model(ngo_id=ngo.pk, key=key)
+        for ngo in ngos for key in {key for kind, key in signature(*instance_values(ngo))}
+    ], batch_size=MAX_IDS_PER_QUERY)
+
+
+def rebuild(signature_model=Ngo_Signature, ngo_model=Ngo, using=DEFAULT_DB_ALIAS, chunk_size=2000):
+    """
+    Rewrites the whole signature table. Takes the models as arguments to
+    run in migrations. Returns the number of Ngos indexed.
+    """
+    signature_model.objects.using(using).all().delete()
+    count = 0
+    chunk = []
+    for ngo in ngo_model.objects.using(using).only('id', *FIELDS).iterator(chunk_size=chunk_size):
+        chunk.append(ngo)
+        if len(chunk) >= chunk_size:
+            index_ngos(chunk, using, signature_model)
+            count, chunk = count + len(chunk), []
+    index_ngos(chunk, using, signature_model)
+    return count + len(chunk)
@@ -0,0 +1,78 @@
+"""
+Streaming export of the Ngo directory as NDJSON or CSV.
+
+Rows are read with values_list() and iterator(), so neither model
+instances nor the full result set are ever held in memory, and the
+Ngo_Verification and Ngo_Detail columns come from the same joined query.
+"""
+import csv
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.serializers import Ngo_DetailSerializer, NgoSerializer, Ngo_VerificationSerializer
+
+
+CHUNK_SIZE = 2000
+
+# (output column, queryset lookup)
+COLUMNS = (
+    [('id', 'id'), ('created_at', 'created_at')] +
+    [(field, field) for field in NgoSerializer.Meta.fields] +
+    [(field, 'Verification__' + field) for field in Ngo_VerificationSerializer.Meta.fields] +
+    [(field, 'detail__' + field) for field in Ngo_DetailSerializer.Meta.fields]
+)
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def export_rows(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yields one tuple per Ngo in the order of COLUMNS.
+    """
+    return (queryset.order_by('id')
+            .values_list(*[lookup for _, lookup in COLUMNS])
+            .iterator(chunk_size=chunk_size))
+
+
+def ndjson_lines(rows):
+    names = [name for name, _ in COLUMNS]
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + '\n'
+
+
+class _Echo:
+    """
+    File-like object handing the line written by csv.writer back to the caller.
+    """
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in COLUMNS])
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def stream(queryset, output):
+    """
+    Returns an iterator over the encoded lines of the export.
+    """
+    rows = export_rows(queryset)
+    if output == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
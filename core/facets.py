@@ -0,0 +1,144 @@
+"""
+Facet counts for the Ngo list filters.
+
+Ngo_Facet holds one (dimension, value, count) row per distinct value, so the
+facets endpoint reads a handful of rows instead of running a GROUP BY over
+the whole table. The counts are adjusted from the save and delete signals
+(see core.signals): only the dimensions whose value changed are touched.
+"""
+from collections import Counter, OrderedDict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from core.models import Ngo, Ngo_Detail, Ngo_Facet
+
+
+LOCATION_DIMENSIONS = ('location_country', 'location_state', 'location_city')
+DETAIL_DIMENSIONS = (
+    'orientation',
+    'level',
+    'activity',
+    'staffing',
+    'fund',
+    'fund_acceptance_from',
+    'legal_status',
+)
+
+# Facet dimensions of each model
+DIMENSIONS = OrderedDict([
+    (Ngo, LOCATION_DIMENSIONS),
+    (Ngo_Detail, DETAIL_DIMENSIONS),
+])
+
+# Lookup of every dimension on the Ngo queryset
+NGO_LOOKUPS = OrderedDict(
+    [(dimension, dimension) for dimension in LOCATION_DIMENSIONS] +
+    [(dimension, 'detail__' + dimension) for dimension in DETAIL_DIMENSIONS]
+)
+
+
+def facet_values(instance):
+    """
+    Returns {dimension: value} of the instance, empty values excluded.
+    """
+    return {
+        dimension: getattr(instance, dimension)
+        for dimension in DIMENSIONS[type(instance)]
+        if getattr(instance, dimension)
+    }
+
+
+def stored_facet_values(instance):
+    """
+    Returns {dimension: value} of the row currently stored for instance.
+    """
+    if instance.pk is None:
+        return {}
+    dimensions = DIMENSIONS[type(instance)]
+    row = type(instance).objects.filter(pk=instance.pk).values(*dimensions).first()
+    if row is None:
+        return {}
+    return {dimension: value for dimension, value in row.items() if value}
+
+
+def _add(dimension, value, delta):
+    updated = Ngo_Facet.objects.filter(dimension=dimension, value=value).update(
+        count=F('count') + delta)
+    if updated or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            Ngo_Facet.objects.create(dimension=dimension, value=value, count=delta)
+    except IntegrityError:
+        # Created concurrently
+        Ngo_Facet.objects.filter(dimension=dimension, value=value).update(
+            count=F('count') + delta)
+
+
+def apply_change(old, new):
+    """
+    Moves the counts from the old {dimension: value} to the new one.
+    """
+    for dimension in set(old) | set(new):
+        old_value, new_value = old.get(dimension), new.get(dimension)
+        if old_value == new_value:
+            continue
+        if old_value:
+            _add(dimension, old_value, -1)
+        if new_value:
+            _add(dimension, new_value, 1)
+
+
+def add_instances(instances):
+    """
+    Counts freshly bulk created instances (bulk_create sends no signals).
+    """
+    totals = Counter()
+    for instance in instances:
+        totals.update(facet_values(instance).items())
+    for (dimension, value), total in totals.items():
+        _add(dimension, value, total)
+
+
+def rebuild():
+    """
+    Recomputes every facet count with one GROUP BY per dimension.
+    """
+    facets = []
+    for model, dimensions in DIMENSIONS.items():
+        for dimension in dimensions:
+            rows = (model.objects.exclude(**{dimension: ''})
+                    .values_list(dimension).annotate(total=Count('pk')).order_by())
+            facets.extend(
+                Ngo_Facet(dimension=dimension, value=value, count=total) for value, total in rows)
+    with transaction.atomic():
+        Ngo_Facet.objects.all().delete()
+        Ngo_Facet.objects.bulk_create(facets)
+
+
+def precomputed_counts():
+    """
+    Returns {dimension: {value: count}} for every dimension in a single query.
+    """
+    counts = OrderedDict((dimension, OrderedDict()) for dimension in NGO_LOOKUPS)
+    rows = (Ngo_Facet.objects.filter(count__gt=0)
+            .order_by('dimension', '-count', 'value')
+            .values_list('dimension', 'value', 'count'))
+    for dimension, value, count in rows:
+        if dimension in counts:
+            counts[dimension][value] = count
+    return counts
+
+
+def queryset_counts(queryset):
+    """
+    Returns {dimension: {value: count}} aggregated over a filtered Ngo queryset.
+    Used when filters are applied, the matching rows are found via the indexes.
+    """
+    counts = OrderedDict()
+    for dimension, lookup in NGO_LOOKUPS.items():
+        rows = (queryset.exclude(**{lookup: ''}).exclude(**{lookup + '__isnull': True})
+                .values_list(lookup).annotate(total=Count('pk')).order_by('-total', lookup))
+        counts[dimension] = OrderedDict(rows)
+    return counts
@@ -0,0 +1,171 @@
+"""
+Fast read path for list responses.
+
+A ModelSerializer is compiled once into a list of (output name, column,
+converter) extractors. Lists are then built straight from values() rows,
+without model instances and without the per-field to_representation
+dispatch, and rendered with orjson when it is installed. The output is
+byte-identical to the regular serializer + JSONRenderer output; serializers
+with fields that cannot be compiled (nested, method or dotted source
+fields) keep using the regular path.
+"""
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.metrics import timer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Fields whose to_representation() returns a database value of the right
+# type unchanged (None is never passed to to_representation)
+IDENTITY_FIELDS = (
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.BooleanField,
+    serializers.IntegerField,
+)
+
+# Fields that subclass an identity field but do transform the value
+CONVERTED_FIELDS = (
+    serializers.MultipleChoiceField,
+    serializers.FilePathField,
+)
+
+
+class CompiledSerializer:
+    """
+    Precompiled extractors of a ModelSerializer.
+    """
+    def __init__(self, names, columns, converters):
+        self.names = names
+        self.columns = columns
+        self.converters = converters
+        self.identity = not any(converters)
+
+    def values(self, queryset, extra=()):
+        """
+        Returns a values() queryset with the serialized columns and extra columns.
+        """
+        extra = [column for column in extra if column not in self.columns]
+        # values() without columns would read them all
+        return queryset.values(*(self.columns + extra or ['pk']))
+
+    def select(self, names):
+        """
+        Returns the CompiledSerializer of the fields names only.
+        """
+        kept = [index for index, name in enumerate(self.names) if name in names]
+        return CompiledSerializer(
+            [self.names[index] for index in kept],
+            [self.columns[index] for index in kept],
+            [self.converters[index] for index in kept])
+
+    def represent(self, rows):
+        """
+        Builds the representation of values() rows.
+        """
+        names, columns = self.names, self.columns
+        if self.identity:
+            return [{name: row[column] for name, column in zip(names, columns)} for row in rows]
+        extractors = list(zip(names, columns, self.converters))
+        result = []
+        for row in rows:
+            item = {}
+            for name, column, converter in extractors:
+                value = row[column]
+                item[name] = converter(value) if converter is not None and value is not None else value
+            result.append(item)
+        return result
+
+
+_compiled = {}
+
+
+def compile_serializer(serializer_class):
+    """
+    Returns the CompiledSerializer of serializer_class, or None when one of
+    its fields has no direct column.
+    """
+    if serializer_class in _compiled:
+        return _compiled[serializer_class]
+    compiled = None
+    if issubclass(serializer_class, serializers.ModelSerializer):
+        names, columns, converters = [], [], []
+        model = serializer_class.Meta.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if (isinstance(field, (serializers.BaseSerializer, serializers.RelatedField,
+                                   serializers.ManyRelatedField, serializers.SerializerMethodField,
+                                   serializers.HiddenField))
+                    or '.' in field.source or field.source not in concrete):
+                names = None
+                break
+            names.append(name)
+            columns.append(field.source)
+            if isinstance(field, IDENTITY_FIELDS) and not isinstance(field, CONVERTED_FIELDS):
+                converters.append(None)
+            else:
+                converters.append(field.to_representation)
+        if names is not None:
+            compiled = CompiledSerializer(names, columns, converters)
+    _compiled[serializer_class] = compiled
+    return compiled
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer using orjson for compact output when it is installed.
+    Falls back to the standard renderer for indented output, for
+    ensure_ascii and for values orjson rejects (e.g. non-str keys).
+    """
+    ORJSON_OPTIONS = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if orjson is not None else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('render'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or self.ensure_ascii
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=self.ORJSON_OPTIONS)
+        except (TypeError, orjson.JSONEncodeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, keeps the output a strict javascript subset
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastListMixin:
+    """
+    Serves list requests rendered as JSON through the compiled serializer.
+    """
+    def get_compiled_serializer(self):
+        return compile_serializer(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None or not isinstance(getattr(request, 'accepted_renderer', None), JSONRenderer):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        paginator = self.paginator
+        if paginator is None:
+            rows = list(compiled.values(queryset))
+            with timer('serialize'):
+                return Response(compiled.represent(rows))
+        ordering = getattr(paginator, 'get_ordering', lambda view: ())(self)
+        page = paginator.paginate_queryset(compiled.values(queryset, extra=ordering), request, view=self)
+        with timer('serialize'):
+            data = compiled.represent(page)
+        return paginator.get_paginated_response(data)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from core import geo
+from core.facets import LOCATION_DIMENSIONS, NGO_LOOKUPS
+
+
+class NgoFilterBackend(BaseFilterBackend):
+    """
+    Filters the Ngo list by location and by the Ngo_Detail choice fields,
+    e.g. ?location_country=india&orientation=C,S
+    Comma separated values match any of them.
+    ?verified=true (or false) keeps the fully verified Ngos (or the others).
+    ?near=<latitude>,<longitude>&radius_km=<km> keeps the Ngos located
+    within the radius (NGO_HUB_NEAR_RADIUS_KM by default), see core.geo.
+    """
+
+    def get_filters(self, request):
+        filters = {}
+        for dimension, lookup in NGO_LOOKUPS.items():
+            raw = request.query_params.get(dimension)
+            if not raw:
+                continue
+            values = [value.strip() for value in raw.split(',') if value.strip()]
+            if dimension in LOCATION_DIMENSIONS:
+                # Locations are stored upper-cased, see Ngo.save()
+                values = [value.upper() for value in values]
+            if len(values) == 1:
+                filters[lookup] = values[0]
+            elif values:
+                filters[lookup + '__in'] = values
+        verified = request.query_params.get('verified', '').lower()
+        if verified in ('true', 'false'):
+            # Indexed column, see Ngo_Verification.transition()
+            filters['Verification__is_fully_verified'] = verified == 'true'
+        near = request.query_params.get('near')
+        if near:
+            point = geo.parse_point(*near.split(',', 1)) if ',' in near else None
+            try:
+                radius_km = float(request.query_params.get('radius_km', settings.NGO_HUB_NEAR_RADIUS_KM))
+            except ValueError:
+                radius_km = -1
+            if point is None or not 0 <= radius_km < float('inf'):
+                raise ValidationError({'near': 'Expected ?near=<latitude>,<longitude>&radius_km=<km>.'})
+            filters['place__in'] = geo.places_within(point[0], point[1], radius_km)
+        return filters
+
+    def filter_queryset(self, request, queryset, view):
+        filters = self.get_filters(request)
+        if filters:
+            queryset = queryset.filter(**filters)
+        return queryset
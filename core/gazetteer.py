@@ -0,0 +1,139 @@
+"""
+Offline geocoding of the Ngo locations.
+
+The gazetteer (NGO_HUB_GAZETTEER, core/data/gazetteer.tsv by default) is
+a tab separated file of places: id, city, state, country and the
+coordinates of the city centre. It is loaded into Geo_Place by the
+migrations and by `manage.py load_gazetteer`, which also locates the
+Ngos again. Ngo.save() sets the place of the Ngo from its location:
++ the city, state and country must match a place, names being compared
+  upper-cased, without accents and with single spaces
++ otherwise the city and country, when a single place has them
+Ngos elsewhere have no place and are left out of the distance queries.
+
+Places are indexed by the cell of a grid of CELL_DEGREES x CELL_DEGREES
+degrees they are in, see core.geo.
+"""
+import csv
+import functools
+import os
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Count
+
+
+PATH = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.tsv')
+
+CELL_DEGREES = 1.0
+ROWS = int(180 / CELL_DEGREES)
+COLUMNS = int(360 / CELL_DEGREES)
+
+# Other names of the countries of the gazetteer
+COUNTRY_ALIASES = {
+    'USA': 'UNITED STATES',
+    'US': 'UNITED STATES',
+    'UNITED STATES OF AMERICA': 'UNITED STATES',
+    'UK': 'UNITED KINGDOM',
+    'GREAT BRITAIN': 'UNITED KINGDOM',
+    'UAE': 'UNITED ARAB EMIRATES',
+    'COTE D IVOIRE': 'IVORY COAST',
+    'DRC': 'DEMOCRATIC REPUBLIC OF THE CONGO',
+    'DR CONGO': 'DEMOCRATIC REPUBLIC OF THE CONGO',
+    'CONGO': 'REPUBLIC OF THE CONGO',
+    'CZECHIA': 'CZECH REPUBLIC',
+    'BURMA': 'MYANMAR',
+}
+
+
+def normalize(name):
+    """
+    Returns name upper-cased, without accents and with single spaces.
+    """
+    name = unicodedata.normalize('NFKD', name or '')
+    return ' '.join(''.join(character for character in name if not unicodedata.combining(character)).upper().split())
+
+
+def path():
+    return getattr(settings, 'NGO_HUB_GAZETTEER', PATH)
+
+
+@functools.lru_cache(maxsize=None)
+def read(file_path):
+    """
+    Returns the places of the file, (id, city, state, country, latitude, longitude) tuples.
+    """
+    with open(file_path, encoding='utf-8', newline='') as stream:
+        rows = csv.DictReader((line for line in stream if not line.startswith('#')), delimiter='\t')
+        return tuple(
+            (int(row['id']), row['city'], row['state'], row['country'],
+             float(row['latitude']), float(row['longitude']))
+            for row in rows)
+
+
+@functools.lru_cache(maxsize=None)
+def lookups(file_path):
+    """
+    Returns the ({(city, state, country): id}, {(city, country): id or None}) lookups.
+    """
+    full, partial = {}, {}
+    for pk, city, state, country, latitude, longitude in read(file_path):
+        city, state, country = normalize(city), normalize(state), normalize(country)
+        full.setdefault((city, state, country), pk)
+        # Ambiguous without the state
+        partial[city, country] = None if partial.get((city, country), pk) != pk else pk
+    return full, partial
+
+
+def geocode(city, state, country):
+    """
+    Returns the id of the place of the location, or None.
+    """
+    full, partial = lookups(path())
+    city, state, country = normalize(city), normalize(state), normalize(country)
+    country = COUNTRY_ALIASES.get(country, country)
+    pk = full.get((city, state, country))
+    return pk if pk is not None else partial.get((city, country))
+
+
+def cell(latitude, longitude):
+    """
+    Returns the (row, column) of the grid cell of the coordinates.
+    """
+    row = min(int((latitude + 90) // CELL_DEGREES), ROWS - 1)
+    column = int((longitude + 180) // CELL_DEGREES) % COLUMNS
+    return row, column
+
+
+def load(place_model, ngo_model, using='default'):
+    """
+    Writes the places of the gazetteer to place_model, removes the others,
+    locates every Ngo again and counts the Ngos of every place. Takes the
+    models as arguments to run in migrations.
+    Returns (places, located Ngos).
+    """
+    places = read(path())
+    rows = []
+    for pk, city, state, country, latitude, longitude in places:
+        row, column = cell(latitude, longitude)
+        rows.append(place_model(
+            id=pk, city=city, state=state, country=country, latitude=latitude, longitude=longitude,
+            cell_row=row, cell_col=column))
+    place_model.objects.using(using).exclude(pk__in=[row.pk for row in rows]).delete()
+    existing = set(place_model.objects.using(using).values_list('pk', flat=True))
+    place_model.objects.using(using).bulk_create([row for row in rows if row.pk not in existing])
+    place_model.objects.using(using).bulk_update(
+        [row for row in rows if row.pk in existing],
+        ['city', 'state', 'country', 'latitude', 'longitude', 'cell_row', 'cell_col'], batch_size=500)
+    ngos = ngo_model.objects.using(using)
+    locations = list(ngos.values_list('location_city', 'location_state', 'location_country').distinct())
+    # One UPDATE per distinct location, the Ngos are not loaded
+    for city, state, country in locations:
+        place = geocode(city, state, country)
+        ngos.filter(location_city=city, location_state=state, location_country=country).update(place=place)
+    counts = dict(ngos.filter(place__isnull=False).values('place').annotate(
+        count=Count('id')).values_list('place', 'count'))
+    place_model.objects.using(using).update(ngo_count=0)
+    for pk, count in counts.items():
+        place_model.objects.using(using).filter(pk=pk).update(ngo_count=count)
+    return len(rows), sum(counts.values())
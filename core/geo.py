@@ -0,0 +1,192 @@
+"""
+Distance queries over the Ngos, nearest first.
+
+Ngos are located at the places of the gazetteer (see core.gazetteer), and
+Geo_Place rows are indexed by the cell of a grid of 1 x 1 degree they are
+in, with the number of Ngos of each place. A query starting at a point
+reads the places of its cell, then of the rings of cells around it, the
+ring width growing fourfold every time. Once the distance from the point to
+everything outside the cells read so far is known to exceed the distance
+of a place, that place is the nearest one left; its Ngos are read from
+the (place, id) index. The Ngos of a place, all at the same distance, come
+by id. Empty places are skipped with their count, so a query reads a
+handful of index ranges whatever the number of Ngos.
+"""
+import heapq
+import math
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import F
+
+from core import gazetteer
+from core.models import Geo_Place, Ngo
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# An Ngo and its distance from the query point, with the coordinates of its place
+Neighbour = namedtuple('Neighbour', 'ngo_id distance_km latitude longitude')
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great circle distance between two points (haversine formula).
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlambda = math.radians(longitude2 - longitude1) / 2
+    a = math.sin(half_dphi) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(half_dlambda) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_point(latitude, longitude):
+    """
+    Returns the (latitude, longitude) floats of the strings, or None when
+    they are not coordinates.
+    """
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def covers_all(half_width):
+    return 2 * half_width + 1 >= max(gazetteer.ROWS, gazetteer.COLUMNS)
+
+
+def box(row, column, half_width):
+    """
+    Returns the (SQL condition, params) of the places in the cells at most
+    half_width cells away from (row, column), columns wrapping around the
+    antimeridian.
+    """
+    condition, params = 'cell_row BETWEEN %s AND %s', [row - half_width, row + half_width]
+    if 2 * half_width + 1 >= gazetteer.COLUMNS:
+        return condition, params
+    low, high = column - half_width, column + half_width
+    if low < 0:
+        return condition + ' AND (cell_col >= %s OR cell_col <= %s)', params + [low + gazetteer.COLUMNS, high]
+    if high >= gazetteer.COLUMNS:
+        return condition + ' AND (cell_col >= %s OR cell_col <= %s)', params + [low, high - gazetteer.COLUMNS]
+    return condition + ' AND cell_col BETWEEN %s AND %s', params + [low, high]
+
+
+def outside_km(latitude, longitude, row, column, half_width):
+    """
+    Lower bound of the distance from the point to the places outside the box.
+    """
+    if covers_all(half_width):
+        return math.inf
+    size = gazetteer.CELL_DEGREES
+    bounds = [math.inf]
+    if row - half_width > 0:
+        # Due south is the shortest way below the box
+        bounds.append(math.radians(latitude - ((row - half_width) * size - 90)))
+    if row + half_width < gazetteer.ROWS - 1:
+        bounds.append(math.radians((row + half_width + 1) * size - 90 - latitude))
+    if 2 * half_width + 1 < gazetteer.COLUMNS:
+        # Distance to the nearest meridian edge of the box, or to the pole
+        # beyond 90 degrees of longitude
+        delta = min(longitude - ((column - half_width) * size - 180),
+                    (column + half_width + 1) * size - 180 - longitude)
+        if delta < 90:
+            bounds.append(math.asin(math.cos(math.radians(latitude)) * math.sin(math.radians(delta))))
+        else:
+            bounds.append(math.radians(90 - abs(latitude)))
+    return EARTH_RADIUS_KM * max(0.0, min(bounds))
+
+
+def nearest_places(latitude, longitude, radius_km=None):
+    """
+    Yields (distance_km, place id, latitude, longitude, ngo_count) of the
+    places having Ngos, nearest first, up to radius_km away.
+    """
+    row, column = gazetteer.cell(latitude, longitude)
+    heap = []
+    previous, half_width = None, 0
+    while True:
+        condition, params = box(row, column, half_width)
+        if previous is not None:
+            inner, inner_params = box(row, column, previous)
+            condition, params = '%s AND NOT (%s)' % (condition, inner), params + inner_params
+        # Raw SQL, building the ORM query would cost more than running it
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id, latitude, longitude, ngo_count FROM %s WHERE ngo_count > 0 AND %s'
+                % (Geo_Place._meta.db_table, condition), params)
+            for pk, place_latitude, place_longitude, count in cursor.fetchall():
+                heapq.heappush(heap, (
+                    distance_km(latitude, longitude, place_latitude, place_longitude),
+                    pk, place_latitude, place_longitude, count))
+        bound = outside_km(latitude, longitude, row, column, half_width)
+        if radius_km is not None:
+            bound = min(bound, radius_km)
+        while heap and heap[0][0] <= bound:
+            yield heapq.heappop(heap)
+        if bound == math.inf or bound == radius_km:
+            return
+        previous, half_width = half_width, max(2, half_width * 4)
+
+
+def nearest_ngos(latitude, longitude, limit, offset=0, radius_km=None, queryset=None):
+    """
+    Returns the Neighbours offset to offset + limit of the Ngos nearest to
+    the point, up to radius_km away. queryset (of Ngos) filters them.
+    """
+    filtered = queryset is not None
+    found = []
+    skip = offset
+    for distance, place, place_latitude, place_longitude, count in nearest_places(latitude, longitude, radius_km):
+        if not filtered and skip >= count:
+            skip -= count
+            continue
+        if filtered:
+            # The count of the place says nothing of the filtered Ngos
+            ids = list(queryset.filter(place_id=place).order_by('id').values_list('id', flat=True)[
+                :skip + limit - len(found)])
+            ids, skip = ids[skip:], max(0, skip - len(ids))
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id FROM %s WHERE place_id = %%s ORDER BY id LIMIT %%s OFFSET %%s'
+                    % Ngo._meta.db_table, [place, limit - len(found), skip])
+                ids, skip = [pk for pk, in cursor.fetchall()], 0
+        found.extend(Neighbour(pk, distance, place_latitude, place_longitude) for pk in ids)
+        if len(found) >= limit:
+            break
+    return found
+
+
+def places_within(latitude, longitude, radius_km):
+    """
+    Returns the ids of the places having Ngos up to radius_km away from the point.
+    """
+    return [place for distance, place, *rest in nearest_places(latitude, longitude, radius_km)]
+
+
+def apply_change(old_place, new_place):
+    """
+    Moves one Ngo from old_place to new_place in the counts (None: no place).
+    """
+    if old_place == new_place:
+        return
+    if old_place is not None:
+        Geo_Place.objects.filter(pk=old_place).update(ngo_count=F('ngo_count') - 1)
+    if new_place is not None:
+        Geo_Place.objects.filter(pk=new_place).update(ngo_count=F('ngo_count') + 1)
+
+
+def add_places(place_ids):
+    """
+    Counts the Ngos bulk inserted at the places (one id per Ngo).
+    """
+    counts = {}
+    for place in place_ids:
+        if place is not None:
+            counts[place] = counts.get(place, 0) + 1
+    for place, count in counts.items():
+        Geo_Place.objects.filter(pk=place).update(ngo_count=F('ngo_count') + count)
@@ -0,0 +1,84 @@
+"""
+Idempotent POSTs.
+
+A client may send an Idempotency-Key header with a POST. The first request
+with a key runs normally; its success response is stored in the same
+transaction as its writes, in Idempotency_Key. Retries with the same key
+get the stored response back (with Idempotent-Replayed: true) without
+running again. Two concurrent requests with the same key both run, but
+only one can insert the key: the other one's transaction, writes
+included, is rolled back and it answers with the winner's response.
+Reusing a key for a different request is a 422.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import Idempotency_Key
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    payload = json.dumps(request.data, cls=JSONEncoder, sort_keys=True)
+    return hashlib.sha256(
+        '\n'.join((request.method, request.path, payload)).encode('utf-8')).hexdigest()
+
+
+def stored_response(user, key, request_fingerprint):
+    """
+    Returns the response stored for the key, or None.
+    """
+    record = Idempotency_Key.objects.filter(user=user, key=key).first()
+    if record is None:
+        return None
+    ttl = getattr(settings, 'NGO_HUB_IDEMPOTENCY_TTL', None)
+    if ttl is not None and record.created_at < timezone.now() - ttl:
+        record.delete()
+        return None
+    if record.fingerprint != request_fingerprint:
+        return Response(
+            {'detail': 'This Idempotency-Key was used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(json.loads(record.response), status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(request, build):
+    """
+    Returns build() run at most once per Idempotency-Key of the user.
+    """
+    key = request.META.get(HEADER)
+    if not key or not request.user.is_authenticated:
+        return build()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {'detail': 'Idempotency-Key is longer than %d characters.' % MAX_KEY_LENGTH},
+            status=status.HTTP_400_BAD_REQUEST)
+    request_fingerprint = fingerprint(request)
+    response = stored_response(request.user, key, request_fingerprint)
+    if response is not None:
+        return response
+    try:
+        with transaction.atomic():
+            response = build()
+            if status.is_success(response.status_code):
+                Idempotency_Key.objects.create(
+                    user=request.user, key=key, fingerprint=request_fingerprint,
+                    status_code=response.status_code,
+                    response=json.dumps(response.data, cls=JSONEncoder))
+    except IntegrityError:
+        # The same key was stored concurrently, everything above is rolled back
+        response = stored_response(request.user, key, request_fingerprint)
+        if response is None:
+            raise
+    return response
@@ -0,0 +1,194 @@
+"""
+Bulk import of Ngos from CSV / JSON Lines or a list of dicts.
+
+Rows are read lazily, validated column by column with the Rules of
+core.models.Ngo (plus the email and URL checks of the serializer), and
+written with bulk_create in batches, each batch inside its own
+transaction. Invalid rows are reported with their errors and skipped,
+they never abort the batch they are in.
+"""
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator, validate_email
+from django.db import transaction
+
+from core import cache, changes, duplicates, facets, gazetteer, geo, search
+from core.audit import fill_audit_fields
+from core.models import Ngo, Ngo_Verification
+from core.serializers import NgoSerializer
+
+
+IMPORT_FIELDS = NgoSerializer.Meta.fields
+DEFAULT_BATCH_SIZE = 1000
+
+validate_url = URLValidator()
+
+# Validators of the fields the serializer checks besides Ngo.rules
+FIELD_VALIDATORS = {
+    'email': (validate_email,),
+    'website': (validate_url,),
+}
+
+MAX_LENGTHS = {field: Ngo._meta.get_field(field).max_length for field in IMPORT_FIELDS}
+
+
+def read_csv(stream):
+    """
+    Yields (line number, row) from a CSV text stream with a header line.
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    """
+    Yields (line number, row) from a JSON Lines text stream.
+    Lines that are not a JSON object yield a ValueError as row.
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            row = ValueError('Invalid JSON: %s' % error)
+        else:
+            if not isinstance(row, dict):
+                row = ValueError('Expected a JSON object')
+        yield line_number, row
+
+
+def read_rows(rows):
+    """
+    Yields (row number, row) from an iterable of dicts.
+    """
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            row = ValueError('Expected an object')
+        yield number, row
+
+
+def open_text(path_or_stream, encoding='utf-8'):
+    if hasattr(path_or_stream, 'read'):
+        if isinstance(path_or_stream, io.TextIOBase):
+            return path_or_stream
+        return io.TextIOWrapper(path_or_stream, encoding=encoding, newline='')
+    return open(path_or_stream, encoding=encoding, newline='')
+
+
+def validate_batch(numbered_rows):
+    """
+    Validates a batch of (number, row) pairs one column at a time.
+    Returns ([(number, cleaned row)], [(number, {field: [errors]})]).
+    """
+    errors = {}
+    columns = {}
+    numbers = []
+    for number, row in numbered_rows:
+        numbers.append(number)
+        if isinstance(row, Exception):
+            errors[number] = {'non_field_errors': [str(row)]}
+            row = {}
+        for field in IMPORT_FIELDS:
+            value = row.get(field)
+            columns.setdefault(field, []).append('' if value is None else str(value).strip())
+
+    # Standardization done by Ngo.save()
+    for field, normalizer in Ngo.rules.normalizers.items():
+        columns[field] = [normalizer(value) for value in columns[field]]
+
+    for field in IMPORT_FIELDS:
+        checks = Ngo.rules.checks.get(field, ())
+        validators = FIELD_VALIDATORS.get(field, ())
+        max_length = MAX_LENGTHS[field]
+        for number, value in zip(numbers, columns.get(field, ())):
+            if number in errors and 'non_field_errors' in errors[number]:
+                continue
+            if not value:
+                errors.setdefault(number, {}).setdefault(field, []).append('This field is required.')
+                continue
+            if max_length and len(value) > max_length:
+                errors.setdefault(number, {}).setdefault(field, []).append(
+                    'Ensure this field has no more than %d characters.' % max_length)
+                continue
+            failed = next((check for check in checks if not check.test(value)), None)
+            if failed is not None:
+                errors.setdefault(number, {}).setdefault(field, []).extend(failed.error(value).messages)
+                continue
+            for validator in validators:
+                try:
+                    validator(value)
+                except ValidationError as error:
+                    errors.setdefault(number, {}).setdefault(field, []).extend(error.messages)
+                    break
+
+    valid = [
+        (number, {field: columns[field][index] for field in IMPORT_FIELDS})
+        for index, number in enumerate(numbers) if number not in errors
+    ]
+    return valid, sorted(errors.items())
+
+
+def write_batch(cleaned_rows):
+    """
+    Inserts the Ngos and their Ngo_Verification rows in one transaction,
+    attributed to the user of acting_as(). Returns the created Ngos.
+    """
+    ngos = [Ngo(**row) for row in cleaned_rows]
+    if not ngos:
+        return []
+    fill_audit_fields(ngos)
+    for ngo in ngos:
+        ngo.place_id = gazetteer.geocode(ngo.location_city, ngo.location_state, ngo.location_country)
+    with transaction.atomic():
+        Ngo.objects.bulk_create(ngos)
+        if ngos[0].pk is None:
+            # The backend does not return primary keys from bulk_create. The
+            # transaction holds the write lock, the newest rows are ours.
+            ids = list(Ngo.objects.order_by('-id').values_list('id', flat=True)[:len(ngos)])
+            for ngo, pk in zip(ngos, reversed(ids)):
+                ngo.pk = pk
+        verifications = [Ngo_Verification(ngo=ngo) for ngo in ngos]
+        fill_audit_fields(verifications)
+        Ngo_Verification.objects.bulk_create(verifications)
+        # bulk_create sends no signals, update the derived tables here
+        search.index_ngos([ngo.pk for ngo in ngos])
+        duplicates.index_ngos(ngos)
+        changes.record_new_ngos([ngo.pk for ngo in ngos])
+        facets.add_instances(ngos)
+        geo.add_places(ngo.place_id for ngo in ngos)
+        cache.invalidate(['ngo', 'ngo_verification'])
+    return ngos
+
+
+def batches(numbered_rows, batch_size):
+    batch = []
+    for item in numbered_rows:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_ngos(numbered_rows, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Imports (number, row) pairs as produced by the read_* functions, run
+    inside acting_as(user).
+    Returns {'created': <count>, 'errors': [{'row': number, 'errors': {...}}]}.
+    """
+    report = {'created': 0, 'errors': []}
+    for batch in batches(numbered_rows, batch_size):
+        valid, errors = validate_batch(batch)
+        write_batch([row for _, row in valid])
+        report['created'] += len(valid)
+        report['errors'].extend({'row': number, 'errors': error} for number, error in errors)
+        if on_batch:
+            on_batch(report)
+    return report
@@ -0,0 +1,194 @@
+"""
+Database backed queue of the verification jobs.
+
+Requests only insert Verification_Job rows (enqueue) and answer 202. The
+workers (manage.py run_verification_workers) claim queued jobs whose
+run_after has passed, one at a time, and run their check (see
+core.verification):
++ a TemporaryError, or any unexpected error, puts the job back in the
+  queue with an exponential backoff, until it has run
+  NGO_HUB_VERIFICATION_MAX_ATTEMPTS times
++ a CheckFailed fails it for good
++ otherwise it succeeds, or waits for the Ngo to confirm a token or code
+
+At most NGO_HUB_VERIFICATION_DOMAIN_CONCURRENCY jobs run at once per
+domain (mail domain, website host, or the SMS backend), whatever the
+number of workers. A claim is a conditional UPDATE, so two workers never
+run the same job, and a worker that pushed a domain over its limit gives
+its claim back. Jobs of a worker that died are claimed again once their
+lease (NGO_HUB_VERIFICATION_LEASE_SECONDS) has run out; a worker whose
+lease ran out sends no email or SMS, sets no flag and records no outcome.
+A verification has at most one active job per kind.
+"""
+import logging
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from core import verification
+from core.models import Ngo_Verification, Verification_Job
+
+
+logger = logging.getLogger(__name__)
+
+# Queued jobs looked at per claim, jobs of busy domains are skipped
+CLAIM_CANDIDATES = 50
+
+
+def enqueue(ngo_verification, kinds):
+    """
+    Queues a job for each kind without an active job yet.
+    Returns the active jobs of the kinds, new ones included.
+    """
+    now = timezone.now()
+    ngo = ngo_verification.ngo
+    with transaction.atomic():
+        # Concurrent enqueues of the verification wait for each other, and
+        # the core_job_one_active_idx constraint stops what gets past the
+        # lock (SQLite has no row locks)
+        list(Ngo_Verification.objects.select_for_update().filter(pk=ngo_verification.pk).values_list('pk'))
+        # A new job sends a new token or code
+        ngo_verification.jobs.filter(status=Verification_Job.WAITING, expires_at__lte=now).update(
+            status=Verification_Job.FAILED, last_error='Expired', modified_at=now)
+        active = {
+            job.kind: job for job in ngo_verification.jobs.filter(
+                kind__in=kinds, status__in=Verification_Job.ACTIVE_STATUSES)
+        }
+        for kind in kinds:
+            if kind in active:
+                continue
+            job = Verification_Job(
+                verification=ngo_verification, kind=kind, domain=verification.job_domain(ngo, kind))
+            try:
+                with transaction.atomic():
+                    job.save()
+            except IntegrityError:
+                # Queued by a concurrent request meanwhile
+                job = ngo_verification.jobs.get(kind=kind, status__in=Verification_Job.ACTIVE_STATUSES)
+            active[kind] = job
+    return [active[kind] for kind in kinds]
+
+
+def worker_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def release_expired_leases(now):
+    """
+    Queues again the running jobs of workers that died.
+    """
+    return Verification_Job.objects.filter(
+        status=Verification_Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=settings.NGO_HUB_VERIFICATION_LEASE_SECONDS),
+    ).update(status=Verification_Job.QUEUED, locked_by='', locked_at=None)
+
+
+def claim(worker):
+    """
+    Claims the next runnable job for worker, or returns None.
+    """
+    now = timezone.now()
+    release_expired_leases(now)
+    limit = settings.NGO_HUB_VERIFICATION_DOMAIN_CONCURRENCY
+    candidates = list(
+        Verification_Job.objects.filter(status=Verification_Job.QUEUED, run_after__lte=now)
+        .order_by('run_after', 'id').values_list('id', 'domain')[:CLAIM_CANDIDATES])
+    if not candidates:
+        return None
+    running = dict(
+        Verification_Job.objects.filter(
+            status=Verification_Job.RUNNING, domain__in={domain for _, domain in candidates})
+        .values('domain').annotate(count=Count('id')).values_list('domain', 'count'))
+    for pk, domain in candidates:
+        if running.get(domain, 0) >= limit:
+            continue
+        claimed = Verification_Job.objects.filter(pk=pk, status=Verification_Job.QUEUED).update(
+            status=Verification_Job.RUNNING, locked_by=worker, locked_at=now,
+            attempts=F('attempts') + 1, modified_at=now)
+        if not claimed:
+            # Another worker was faster
+            continue
+        if Verification_Job.objects.filter(status=Verification_Job.RUNNING, domain=domain).count() > limit:
+            # Another worker claimed a job of the same domain meanwhile
+            Verification_Job.objects.filter(pk=pk).update(
+                status=Verification_Job.QUEUED, locked_by='', locked_at=None,
+                attempts=F('attempts') - 1, modified_at=now)
+            running[domain] = limit
+            continue
+        return Verification_Job.objects.select_related('verification__ngo').get(pk=pk)
+    return None
+
+
+def backoff(attempts):
+    """
+    Delay before the next run of a job that failed attempts times.
+    """
+    delay = min(settings.NGO_HUB_VERIFICATION_BACKOFF_SECONDS * 2 ** (attempts - 1),
+                settings.NGO_HUB_VERIFICATION_MAX_BACKOFF_SECONDS)
+    # Jitter, so that jobs failing together are not retried together
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run(job):
+    """
+    Runs a claimed job and records its outcome.
+    """
+    try:
+        job.status = verification.run_check(job)
+        job.last_error = ''
+    except verification.LeaseLost:
+        # Its emails, SMS and flag are left to the worker holding it now
+        logger.warning('Verification job %d lost its lease, its check is abandoned', job.pk)
+        return job
+    except verification.CheckFailed as error:
+        job.status = Verification_Job.FAILED
+        job.last_error = str(error)
+    except Exception as error:
+        if not isinstance(error, verification.TemporaryError):
+            logger.exception('Verification job %d failed', job.pk)
+        job.last_error = str(error) or error.__class__.__name__
+        if job.attempts >= settings.NGO_HUB_VERIFICATION_MAX_ATTEMPTS:
+            job.status = Verification_Job.FAILED
+        else:
+            job.status = Verification_Job.QUEUED
+            job.run_after = timezone.now() + backoff(job.attempts)
+    # Only while the claim holds: a job queued again after its lease ran
+    # out may be running on another worker now
+    claimed = verification.leased(job)
+    job.locked_by, job.locked_at, job.modified_at = '', None, timezone.now()
+    saved = claimed.update(**{field: getattr(job, field) for field in (
+        'status', 'last_error', 'run_after', 'locked_by', 'locked_at',
+        'secret', 'expires_at', 'failed_confirmations', 'modified_at')})
+    if not saved:
+        logger.warning('Verification job %d lost its lease, its outcome is dropped', job.pk)
+    return job
+
+
+def work(worker=None, burst=False, poll_seconds=1.0, stop=None):
+    """
+    Runs jobs until stop (a threading.Event) is set or, with burst, until
+    no job is runnable. Returns the number of jobs run.
+    """
+    worker = worker or worker_name()
+    count = 0
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            if stop is not None:
+                stop.wait(poll_seconds)
+            else:
+                time.sleep(poll_seconds)
+            continue
+        run(job)
+        count += 1
+    return count
@@ -0,0 +1,205 @@
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.authtoken.models import Token
+
+from core import benchmark
+from core.models import Ngo_Detail, Ngo_Verification
+
+
+HOST = '127.0.0.1'
+
+# Server command lines, the WSGI one is the Procfile's
+SERVERS = {
+    'wsgi': ('gunicorn', lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'NGO_Hub_API.wsgi',
+        '--bind', '%s:%d' % (HOST, port), '--workers', str(workers), '--backlog', '2048',
+        '--log-level', 'warning']),
+    'asgi': ('uvicorn', lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'NGO_Hub_API.asgi:application',
+        '--host', HOST, '--port', str(port), '--workers', str(workers), '--backlog', '2048',
+        '--no-access-log', '--log-level', 'warning']),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def read_response(reader):
+    """
+    Reads one HTTP/1.1 response, returns (status, keep alive).
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def client(port, requests, deadline, latencies, counters):
+    """
+    One connection sending requests back to back until the deadline,
+    reconnecting when the server closes the connection.
+    """
+    reader = writer = None
+    index = 0
+    while time.perf_counter() < deadline:
+        request = requests[index % len(requests)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(HOST, port)
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            counters['errors'] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            counters['errors'] += 1
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, requests, concurrency, duration):
+    latencies = []
+    counters = {'errors': 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, requests[offset:] + requests[:offset], started + duration, latencies, counters)
+        for offset in (index % len(requests) for index in range(concurrency))))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': counters['errors'],
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1)
+        if latencies else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Load tests the WSGI (gunicorn) and ASGI (uvicorn) servers on a throwaway '
+        'SQLite database and compares requests/second and p99 latency of the '
+        'list and retrieve routes at several concurrency levels.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', default='50,200,1000', help='Comma separated numbers of connections.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per run.')
+        parser.add_argument('--rows', type=int, default=2000, help='Number of seeded Ngos.')
+        parser.add_argument('--workers', type=int, default=1, help='Server processes of each server.')
+        parser.add_argument('--servers', default='wsgi,asgi')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_asgi runs against SQLite only.')
+        servers = options['servers'].split(',')
+        for name in servers:
+            if name not in SERVERS:
+                raise CommandError('Unknown server %r, expected wsgi or asgi.' % name)
+            if importlib.util.find_spec(SERVERS[name][0]) is None:
+                raise CommandError('%s is not installed.' % SERVERS[name][0])
+        concurrencies = [int(value) for value in options['concurrency'].split(',')]
+
+        results = []
+        with benchmark.benchmark_database():
+            user = benchmark.benchmark_user()
+            ids = benchmark.seed_ngos(options['rows'], user=user)
+            benchmark.seed_details(ids)
+            token = Token.objects.create(user=user)
+            ngo_id = ids[len(ids) // 2]
+            paths = [
+                '/core/ngo/',
+                '/core/ngo/%d/' % ngo_id,
+                '/core/ngo_verification/',
+                '/core/ngo_verification/%d/' % Ngo_Verification.objects.get(ngo_id=ngo_id).pk,
+                '/core/ngo_detail/',
+                '/core/ngo_detail/%d/' % Ngo_Detail.objects.get(ngo_id=ngo_id).pk,
+            ]
+            requests = [
+                ('GET %s HTTP/1.1\r\nHost: localhost\r\nAuthorization: Token %s\r\n'
+                 'Accept: application/json\r\n\r\n' % (path, token.key)).encode('ascii')
+                for path in paths
+            ]
+            environment = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE='core.benchmark_settings',
+                NGO_HUB_BENCHMARK_DATABASE=connection.settings_dict['NAME'],
+            )
+            for name in servers:
+                environment['NGO_HUB_ASYNC_VIEWS'] = '1' if name == 'asgi' else '0'
+                port = free_port()
+                process = subprocess.Popen(
+                    SERVERS[name][1](port, options['workers']), cwd=settings.BASE_DIR,
+                    env=environment, stdout=subprocess.DEVNULL)
+                try:
+                    self.wait_ready(process, port, requests)
+                    for concurrency in concurrencies:
+                        result = asyncio.run(load(port, requests, concurrency, options['duration']))
+                        result.update(server=name, concurrency=concurrency)
+                        results.append(result)
+                        if not options['json']:
+                            self.stdout.write(
+                                '%-5s %5d connections  %8.1f req/s  p50 %8s ms  p99 %8s ms  %d errors' % (
+                                    name, concurrency, result['rps'],
+                                    result['p50_ms'], result['p99_ms'], result['errors']))
+                finally:
+                    process.terminate()
+                    process.wait(timeout=30)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def wait_ready(self, process, port, requests, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError('The server exited with status %d.' % process.returncode)
+            try:
+                result = asyncio.run(load(port, requests, 1, 0.2))
+            except OSError:
+                result = None
+            if result and result['requests'] and not result['errors']:
+                return
+            time.sleep(0.2)
+        raise CommandError('The server did not answer within %d seconds.' % timeout)
@@ -0,0 +1,57 @@
+import itertools
+import random
+
+from django.core.management.base import BaseCommand
+
+from core import benchmark, duplicates
+from core.models import Ngo
+
+
+def scan_duplicates(values):
+    """
+    Compares the Ngo with every registered one, the reference of the comparison.
+    """
+    return [
+        row[0] for row in Ngo.objects.values_list('id', *duplicates.FIELDS).iterator()
+        if duplicates.compare(values, row[1:])[0]
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the duplicate check of a new Ngo (core.duplicates) against a '
+        'comparison with every registered Ngo at growing table sizes, on a '
+        'throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10000,100000',
+            help='Comma separated Ngo counts to measure at.')
+        parser.add_argument('--repeat', type=int, default=200, help='Checks per measurement.')
+        parser.add_argument('--scan-repeat', type=int, default=3, help='Checks per full scan measurement.')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(0)
+        # New registrations, a third of them sharing a contact with a registered Ngo
+        candidates = [benchmark.make_ngo(rng, 10 ** 8 + index, None) for index in range(100)]
+        for index, ngo in enumerate(candidates[::3]):
+            ngo.email = 'ngo%d@example.org' % index
+        candidates = [duplicates.instance_values(ngo) for ngo in candidates]
+        with benchmark.benchmark_database():
+            seeded = 0
+            for size in sizes:
+                benchmark.seed_ngos(size - seeded, seed=seeded)
+                duplicates.rebuild()
+                seeded = size
+                self.stdout.write('%d Ngos' % size)
+                cases = (
+                    ('signature check', options['repeat'], duplicates.find),
+                    ('full scan', options['scan_repeat'], scan_duplicates),
+                )
+                for name, repeat, check in cases:
+                    values = itertools.cycle(candidates)
+                    timing = benchmark.summarize(benchmark.measure(lambda: check(next(values)), repeat))
+                    self.stdout.write('  %-24s %9.3f ms (p95 %9.3f, max %9.3f)' % (
+                        name, timing['median_ms'], timing['p95_ms'], timing['max_ms']))
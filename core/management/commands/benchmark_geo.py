@@ -0,0 +1,73 @@
+import itertools
+import random
+
+from django.db.models import F, FloatField
+from django.db.models.functions import Cos, Power, Radians
+
+from django.core.management.base import BaseCommand
+
+from core import benchmark, gazetteer, geo
+from core.models import Ngo
+
+
+def scan_nearest_ids(latitude, longitude, limit):
+    """
+    The nearest Ngos by a distance computed for every Ngo, the reference
+    of the comparison (equirectangular distance, same order at city scale).
+    """
+    distance = (
+        Power(F('place__latitude') - latitude, 2) +
+        Power((F('place__longitude') - longitude) * Cos(Radians(latitude)), 2))
+    return list(
+        Ngo.objects.filter(place__isnull=False).annotate(distance=distance)
+        .order_by('distance', 'id').values_list('id', flat=True)[:limit])
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the nearest Ngo queries of core.geo against a full distance '
+        'scan at growing table sizes, on a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10000,100000,1000000',
+            help='Comma separated Ngo counts to measure at.')
+        parser.add_argument('--repeat', type=int, default=200, help='Queries per measurement.')
+        parser.add_argument('--scan-repeat', type=int, default=5, help='Queries per full scan measurement.')
+        parser.add_argument('--k', type=int, default=10, help='Nearest Ngos per query.')
+        parser.add_argument('--radius-km', type=float, default=100.0)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        k = options['k']
+        places = gazetteer.read(gazetteer.path())
+        locations = [(city, state, country) for pk, city, state, country, latitude, longitude in places]
+        rng = random.Random(0)
+        # Half the query points close to a place, half anywhere (oceans included)
+        origins = [
+            (max(-90.0, min(90.0, latitude + rng.uniform(-2, 2))), longitude + rng.uniform(-2, 2))
+            for pk, city, state, country, latitude, longitude in rng.choices(places, k=100)
+        ] + [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(100)]
+        rng.shuffle(origins)
+        with benchmark.benchmark_database():
+            seeded = 0
+            for size in sizes:
+                benchmark.seed_ngos(size - seeded, seed=seeded, locations=locations)
+                seeded = size
+                self.stdout.write('%d Ngos at %d places' % (size, len(places)))
+                cases = (
+                    ('%d nearest' % k, options['repeat'],
+                     lambda point: geo.nearest_ngos(point[0], point[1], k)),
+                    ('%d nearest, page 20' % k, options['repeat'],
+                     lambda point: geo.nearest_ngos(point[0], point[1], k, offset=19 * k)),
+                    ('within %g km' % options['radius_km'], options['repeat'],
+                     lambda point: geo.nearest_ngos(point[0], point[1], 50, radius_km=options['radius_km'])),
+                    ('%d nearest, full scan' % k, options['scan_repeat'],
+                     lambda point: scan_nearest_ids(point[0], point[1], k)),
+                )
+                for name, repeat, query in cases:
+                    points = itertools.cycle(origins)
+                    timing = benchmark.summarize(benchmark.measure(lambda: query(next(points)), repeat))
+                    self.stdout.write('  %-24s %9.3f ms (p95 %9.3f, max %9.3f)' % (
+                        name, timing['median_ms'], timing['p95_ms'], timing['max_ms']))
@@ -0,0 +1,233 @@
+import json
+import os
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, resolve
+
+from core import benchmark, throttling
+from core.models import Ngo_Detail, Ngo_Verification
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                                'benchmark_routes.json')
+PASSWORD = 'benchmark-password'
+
+# Namespaces whose routes are not ours to cover (the admin index is still measured)
+EXCLUDED_NAMESPACES = ('admin',)
+
+
+def ngo_payload(index):
+    ngo = benchmark.make_ngo(random.Random(index), 10 ** 6 + index, None)
+    return {field: getattr(ngo, field) for field in (
+        'name', 'purpose', 'description', 'location_city', 'location_state', 'location_country',
+        'phone_primary', 'phone_secondary', 'email', 'website')}
+
+
+# (name, method, path, body, auth), path and body being formatted with the
+# seeded ids. auth is 'token' (a member token), 'admin' (the staff user's
+# token, or its session for the admin) or None.
+SCENARIOS = (
+    ('api root', 'GET', '/core/', None, 'token'),
+    ('ngo list', 'GET', '/core/ngo/', None, 'token'),
+    ('ngo list filtered', 'GET', '/core/ngo/?location_country=INDIA&location_city=PUNE,DELHI', None, 'token'),
+    ('ngo list verified', 'GET', '/core/ngo/?verified=true', None, 'token'),
+    ('ngo list sparse', 'GET', '/core/ngo/?fields=name,location_city', None, 'token'),
+    ('ngo retrieve', 'GET', '/core/ngo/{ngo}/', None, 'token'),
+    ('ngo create', 'POST', '/core/ngo/', 'ngo', 'token'),
+    ('ngo update', 'PATCH', '/core/ngo/{ngo}/', {'website': 'https://updated.example.org'}, 'token'),
+    ('ngo search', 'GET', '/core/ngo/search/?q=education%20health', None, 'token'),
+    ('ngo facets', 'GET', '/core/ngo/facets/', None, 'token'),
+    ('ngo facets filtered', 'GET', '/core/ngo/facets/?location_country=INDIA', None, 'token'),
+    ('ngo nearby', 'GET', '/core/ngo/nearby/?lat=18.5&lon=73.8', None, 'token'),
+    ('ngo export', 'GET', '/core/ngo/export/?output=ndjson', None, 'token'),
+    ('ngo bulk', 'POST', '/core/ngo/bulk/', 'bulk', 'token'),
+    ('verification list', 'GET', '/core/ngo_verification/', None, 'token'),
+    ('verification retrieve', 'GET', '/core/ngo_verification/{verification}/', None, 'token'),
+    ('verification update', 'PATCH', '/core/ngo_verification/{verification}/', {'v_website': True}, 'token'),
+    ('verification verify', 'POST', '/core/ngo_verification/{verification}/verify/',
+     {'checks': ['website']}, 'token'),
+    ('verification jobs', 'GET', '/core/ngo_verification/{verification}/jobs/', None, 'token'),
+    ('verification events', 'GET', '/core/ngo_verification/{verification}/events/', None, 'token'),
+    ('verification confirm', 'POST', '/core/ngo_verification/{verification}/confirm/',
+     {'check': 'phone_primary', 'code': '000000'}, 'token'),
+    ('email confirmation', 'GET', '/core/verify_email/?token=unknown', None, None),
+    ('detail list', 'GET', '/core/ngo_detail/', None, 'token'),
+    ('detail retrieve', 'GET', '/core/ngo_detail/{detail}/', None, 'token'),
+    ('detail update', 'PATCH', '/core/ngo_detail/{detail}/', {'overhead_cost': 12}, 'token'),
+    ('profile list', 'GET', '/core/ngo_profile/', None, 'token'),
+    ('profile retrieve', 'GET', '/core/ngo_profile/{ngo}/', None, 'token'),
+    ('changes', 'GET', '/core/changes/?since=0', None, 'token'),
+    ('cache stats', 'GET', '/core/cache_stats/', None, 'admin'),
+    ('db stats', 'GET', '/core/db_stats/', None, 'admin'),
+    ('token auth', 'POST', '/api-token-auth/', 'credentials', None),
+    ('metrics', 'GET', '/metrics', None, 'admin'),
+    ('browsable api login', 'GET', '/api-auth/login/', None, None),
+    ('browsable api logout', 'GET', '/api-auth/logout/', None, None),
+    ('admin index', 'GET', '/admin/', None, 'admin'),
+)
+
+
+def route_names(patterns=None, namespace=''):
+    """
+    Yields the view name of every route of the URLconf.
+    """
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in EXCLUDED_NAMESPACES:
+                continue
+            prefix = namespace + pattern.namespace + ':' if pattern.namespace else namespace
+            yield from route_names(pattern.url_patterns, prefix)
+        else:
+            yield namespace + (pattern.name or pattern.lookup_str)
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a throwaway database, requests every route of the API and records '
+        'its status, query count and latency. Compares them with the JSON baseline '
+        'and fails when a route issues more queries (or with --latency-tolerance '
+        'is slower) than the baseline allows; --write records a new baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--write', action='store_true', help='Write the results as the new baseline.')
+        parser.add_argument(
+            '--tolerance', type=int, default=0, help='Extra queries allowed per route.')
+        parser.add_argument(
+            '--latency-tolerance', type=float, default=None,
+            help='Allowed relative slowdown of the median latency, e.g. 0.5 for 50%%. '
+                 'Not checked by default, latencies depend on the machine.')
+        parser.add_argument('--ngos', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not options['write'] and not os.path.exists(options['baseline']):
+            raise CommandError('No baseline at %s, run with --write first.' % options['baseline'])
+        # Measure the database path, not the response cache, and without
+        # the DEBUG query log (it is capped, counts would stop growing)
+        with override_settings(DEBUG=False, NGO_HUB_RESPONSE_CACHE=False,
+                               NGO_HUB_THROTTLE_STORE='core.throttling.LocalStore',
+                               NGO_HUB_THROTTLE_STORE_OPTIONS={},
+                               STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            with benchmark.benchmark_database():
+                results = self.run_scenarios(options)
+        if options['write']:
+            with open(options['baseline'], 'w') as stream:
+                json.dump(results, stream, indent=2, sort_keys=True)
+                stream.write('\n')
+            self.stdout.write('Baseline written to %s' % options['baseline'])
+            return
+        with open(options['baseline']) as stream:
+            baseline = json.load(stream)
+        failures = self.compare(results, baseline, options['tolerance'], options['latency_tolerance'])
+        if failures:
+            raise CommandError('%d regression(s):\n%s' % (len(failures), '\n'.join(failures)))
+        self.stdout.write(self.style.SUCCESS('No regression on %d routes.' % len(results)))
+
+    def seed(self, options):
+        users = benchmark.seed_users(options['users'])
+        ids = benchmark.seed_ngos(options['ngos'], users=users)
+        benchmark.seed_details(ids)
+        from core import duplicates, facets, search
+        search.index_ngos()
+        duplicates.rebuild()
+        facets.rebuild()
+        admin = benchmark.benchmark_user()
+        admin.is_staff = admin.is_superuser = True
+        admin.set_password(PASSWORD)
+        admin.save()
+        ngo = ids[len(ids) // 2]
+        return users, admin, {
+            'ngo': ngo,
+            'verification': Ngo_Verification.objects.get(ngo_id=ngo).pk,
+            'detail': Ngo_Detail.objects.get(ngo_id=ngo).pk,
+        }
+
+    def run_scenarios(self, options):
+        from rest_framework.authtoken.models import Token
+        users, admin, ids = self.seed(options)
+        member_token = Token.objects.get(user=users[0]).key
+        admin_token = Token.objects.get_or_create(user=admin)[0].key
+        covered = set()
+        results = {}
+
+        for index, (name, method, path, body, auth) in enumerate(SCENARIOS):
+            # Same payloads whatever --repeat is, the emails stay unique
+            counter = iter(range(index * 10 ** 5, (index + 1) * 10 ** 5))
+            path = path.format(**ids)
+            covered.add(resolve(path.split('?')[0]).view_name)
+            client = Client(raise_request_exception=False)
+            headers = {}
+            if auth == 'token':
+                headers['HTTP_AUTHORIZATION'] = 'Token %s' % member_token
+            elif auth == 'admin':
+                headers['HTTP_AUTHORIZATION'] = 'Token %s' % admin_token
+                client.force_login(admin)
+
+            def request():
+                # Every measured request starts with full rate limit buckets
+                throttling.get_store().clear()
+                data = body
+                if body == 'ngo':
+                    data = ngo_payload(next(counter))
+                elif body == 'bulk':
+                    data = [ngo_payload(next(counter)) for _ in range(10)]
+                elif body == 'credentials':
+                    data = {'username': admin.username, 'password': PASSWORD}
+                call = getattr(client, method.lower())
+                if data is None:
+                    response = call(path, **headers)
+                elif body == 'credentials':
+                    response = call(path, data, **headers)
+                else:
+                    response = call(path, json.dumps(data), content_type='application/json', **headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                return response
+
+            # Warm up the per process caches (tokens, compiled serializers)
+            request()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            # Read before the next requests reset the query log
+            query_count = len(queries)
+            timings = benchmark.summarize(benchmark.measure(request, options['repeat']))
+            results[name] = {
+                'method': method,
+                'path': path,
+                'status': response.status_code,
+                'queries': query_count,
+                'median_ms': timings['median_ms'],
+                'p95_ms': timings['p95_ms'],
+                'requests_per_second': round(1000 / timings['median_ms'], 1) if timings['median_ms'] else None,
+            }
+            self.stdout.write('%-24s %-6s %3d  %3d queries  median %8.2f ms  p95 %8.2f ms' % (
+                name, method, response.status_code, query_count, timings['median_ms'], timings['p95_ms']))
+
+        missing = sorted(set(route_names()) - covered)
+        if missing:
+            raise CommandError('Routes without a scenario in benchmark_routes: %s' % ', '.join(missing))
+        return results
+
+    def compare(self, results, baseline, tolerance, latency_tolerance):
+        failures = []
+        for name, result in sorted(results.items()):
+            expected = baseline.get(name)
+            if expected is None:
+                failures.append('%s: not in the baseline' % name)
+                continue
+            if result['status'] != expected['status']:
+                failures.append('%s: status %d, baseline %d' % (name, result['status'], expected['status']))
+            if result['queries'] > expected['queries'] + tolerance:
+                failures.append('%s: %d queries, baseline %d' % (name, result['queries'], expected['queries']))
+            if (latency_tolerance is not None
+                    and result['median_ms'] > expected['median_ms'] * (1 + latency_tolerance)):
+                failures.append('%s: median %.2f ms, baseline %.2f ms' % (
+                    name, result['median_ms'], expected['median_ms']))
+        return failures
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from core import benchmark, search
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares full-text index queries with an icontains scan '
+        'at growing table sizes, on a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10000,100000,1000000',
+            help='Comma separated Ngo counts to measure at.')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--queries', default='education,sanitation children,solar,kalomi,gorgorgor',
+            help='Comma separated search queries.')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        queries = [query for query in options['queries'].split(',') if query]
+        with benchmark.benchmark_database():
+            seeded = 0
+            for size in sizes:
+                benchmark.seed_ngos(size - seeded, seed=seeded)
+                seeded = size
+                search.index_ngos()
+                self.stdout.write('%d Ngos' % size)
+                for query in queries:
+                    indexed = benchmark.summarize(benchmark.measure(
+                        lambda: search.search_ngo_ids(query, 50), options['repeat']))
+                    scan = benchmark.summarize(benchmark.measure(
+                        lambda: search.scan_ngo_ids(query, 50), options['repeat']))
+                    self.stdout.write(
+                        '  %-24s index %9.3f ms (p95 %9.3f)   icontains %9.3f ms (p95 %9.3f)' % (
+                            query, indexed['median_ms'], indexed['p95_ms'],
+                            scan['median_ms'], scan['p95_ms']))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from core import benchmark
+from core.fast import FastJSONRenderer, compile_serializer, orjson
+from core.models import Ngo, Ngo_Detail, Ngo_Verification
+from core.serializers import Ngo_DetailSerializer, NgoSerializer, Ngo_VerificationSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the regular serializer + JSONRenderer path with the compiled '
+        'values() + FastJSONRenderer path on list pages, on a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000', help='Comma separated page sizes.')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        targets = (
+            (Ngo, NgoSerializer),
+            (Ngo_Verification, Ngo_VerificationSerializer),
+            (Ngo_Detail, Ngo_DetailSerializer),
+        )
+        self.stdout.write('orjson %s' % ('installed' if orjson else 'not installed, stdlib json'))
+        with benchmark.benchmark_database():
+            ids = benchmark.seed_ngos(sizes[-1])
+            benchmark.seed_details(ids)
+            for model, serializer_class in targets:
+                compiled = compile_serializer(serializer_class)
+                for size in sizes:
+                    queryset = model.objects.order_by('id')[:size]
+
+                    def regular():
+                        return JSONRenderer().render(serializer_class(list(queryset), many=True).data)
+
+                    def fast():
+                        return FastJSONRenderer().render(compiled.represent(compiled.values(queryset)))
+
+                    if regular() != fast():
+                        raise CommandError('%s output differs at %d rows' % (serializer_class.__name__, size))
+                    slow_timing = benchmark.summarize(benchmark.measure(regular, options['repeat']))
+                    fast_timing = benchmark.summarize(benchmark.measure(fast, options['repeat']))
+                    self.stdout.write(
+                        '%-28s %6d rows  regular %9.2f ms  fast %9.2f ms  x%.1f' % (
+                            serializer_class.__name__, size,
+                            slow_timing['median_ms'], fast_timing['median_ms'],
+                            slow_timing['median_ms'] / fast_timing['median_ms']))
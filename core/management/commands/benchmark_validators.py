@@ -0,0 +1,118 @@
+import random
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmark, validation
+from core.models import Ngo, Ngo_Detail
+
+
+# The validators as they were before core.validation, the reference of
+# the comparison (results must match, timings are compared)
+def legacy_isalphaspace(value):
+    if not all(x.isalpha() or x.isspace() for x in value):
+        raise ValidationError('invalid')
+
+
+def legacy_isnumeric(value):
+    if not all(x.isnumeric() for x in value):
+        raise ValidationError('invalid')
+
+
+def legacy_minlength(value, min):
+    if len(value) < min:
+        raise ValidationError('invalid')
+
+
+def legacy_choice(selection, choice):
+    values = [item[0] for item in choice]
+    if selection not in values:
+        raise ValidationError('invalid')
+
+
+def legacy_ngo(values):
+    """
+    The checks of the former Ngo.save(), stopping at the first error.
+    """
+    legacy_minlength(values['name'], 2)
+    legacy_minlength(values['purpose'], 50)
+    legacy_minlength(values['description'], 300)
+    for field in ('location_city', 'location_state', 'location_country'):
+        values[field] = values[field].upper()
+    for field in ('name', 'location_city', 'location_state', 'location_country'):
+        legacy_isalphaspace(values[field])
+    legacy_isnumeric(values['phone_primary'])
+    legacy_isnumeric(values['phone_secondary'])
+
+
+def passes(function, *args):
+    try:
+        function(*args)
+    except ValidationError:
+        return False
+    return True
+
+
+SAMPLES = (
+    '', ' ', '\t\n', 'Pune', 'New Delhi', 'São Paulo', 'Mumbai\tCentral', 'R2D2', 'A-B', 'Ångström Hall',
+    '42', '०१२३', '½', '12 34', 'x' * 10000, 'word ' * 2000, 'word ' * 1999 + 'w0rd',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the precompiled validators of core.validation with the former '
+        'per character validators, on single values and on whole Ngo records.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10000, help='Calls per measurement.')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        self.check_equivalence()
+        iterations = options['iterations']
+        rng = random.Random(0)
+        description = benchmark.words(rng, 1400)[:10000]
+        choices = Ngo_Detail.LEGAL_STATUS
+        check = validation.choice(choices)
+        record = {
+            field: getattr(benchmark.make_ngo(rng, 0, None), field)
+            for field in ('name', 'purpose', 'description', 'location_city', 'location_state',
+                          'location_country', 'phone_primary', 'phone_secondary')
+        }
+        record['description'] = description
+        cases = (
+            ('alphaspace short', lambda: legacy_isalphaspace('New Delhi'),
+             lambda: validation.isalphaspace('New Delhi')),
+            ('alphaspace 10,000 chars', lambda: legacy_isalphaspace(description),
+             lambda: validation.isalphaspace(description)),
+            ('numeric', lambda: legacy_isnumeric('9876543210'),
+             lambda: validation.isnumeric('9876543210')),
+            ('choice', lambda: legacy_choice('NPL', choices),
+             lambda: check.test('NPL')),
+            ('Ngo record', lambda: legacy_ngo(dict(record)),
+             lambda: Ngo.rules.errors(dict(record))),
+        )
+        for name, legacy, compiled in cases:
+            legacy_timing = benchmark.summarize(benchmark.measure(
+                lambda: [legacy() for _ in range(iterations)], options['repeat']))
+            compiled_timing = benchmark.summarize(benchmark.measure(
+                lambda: [compiled() for _ in range(iterations)], options['repeat']))
+            self.stdout.write('%-24s legacy %10.3f us  compiled %10.3f us  x%.1f' % (
+                name,
+                legacy_timing['median_ms'] * 1000 / iterations,
+                compiled_timing['median_ms'] * 1000 / iterations,
+                legacy_timing['median_ms'] / compiled_timing['median_ms']))
+
+    def check_equivalence(self):
+        for value in SAMPLES:
+            if passes(legacy_isalphaspace, value) != validation.isalphaspace(value):
+                raise CommandError('isalphaspace differs on %r' % value[:40])
+            if passes(legacy_isnumeric, value) != validation.isnumeric(value):
+                raise CommandError('isnumeric differs on %r' % value[:40])
+        for choices in (Ngo_Detail.ORIENTATION, Ngo_Detail.LEVEL, Ngo_Detail.LEGAL_STATUS):
+            for selection in [key for key, label in choices] + ['', 'X', 'c']:
+                if selection and passes(legacy_choice, selection, choices) != validation.choice(
+                        choices).test(selection):
+                    raise CommandError('choice differs on %r' % selection)
@@ -0,0 +1,158 @@
+import json
+import multiprocessing
+import os
+from itertools import combinations
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from core import duplicates
+from core.models import Ngo, Ngo_Signature
+
+
+def sign_rows(rows):
+    """
+    Returns (id, contact keys, name keys, normalised name) of (id, *FIELDS)
+    rows, run by the workers.
+    """
+    signed = []
+    for row in rows:
+        keys = duplicates.signature(*row[1:])
+        signed.append((
+            row[0],
+            [key for kind, key in keys if kind != 'name'],
+            [key for kind, key in keys if kind == 'name'],
+            duplicates.normalize_name(row[1])))
+    return signed
+
+
+def similar_pairs(pairs):
+    """
+    Returns the pairs of ((id, name), (id, name)) whose names are similar
+    enough, run by the workers.
+    """
+    threshold = duplicates.name_similarity_threshold()
+    return [(pk1, pk2) for (pk1, name1), (pk2, name2) in pairs if duplicates.similarity(name1, name2) >= threshold]
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class UnionFind:
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, item):
+        root = item
+        while self.parents.get(root, root) != root:
+            root = self.parents[root]
+        while item != root:
+            parent = self.parents[item]
+            self.parents[item] = root
+            item = parent
+        return root
+
+    def union(self, item1, item2):
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 != root2:
+            self.parents[max(root1, root2)] = min(root1, root2)
+
+
+class Command(BaseCommand):
+    help = (
+        'Clusters the registered Ngos that look like duplicates of each other '
+        '(see core.duplicates), the signatures computed by worker processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1, help='Worker processes.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Ngos per worker task.')
+        parser.add_argument(
+            '--format', choices=('text', 'json'), default='text',
+            help='text: one line per Ngo, json: one JSON list of ids and names per cluster.')
+        parser.add_argument(
+            '--rebuild-index', action='store_true',
+            help='Also rewrite the signature table used by the registration check.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        rows = Ngo.objects.order_by('id').values_list('id', *duplicates.FIELDS).iterator(chunk_size=chunk_size)
+        # Read here, the pool feeds the workers from a thread of its own
+        chunks = list(chunked(rows, chunk_size))
+        names = {row[0]: row[1] for chunk in chunks for row in chunk}
+        cities = {row[0]: row[2] for chunk in chunks for row in chunk}
+
+        if options['processes'] > 1:
+            # The workers only compute, they must not share the connections of this process
+            connections.close_all()
+            pool = multiprocessing.Pool(options['processes'])
+            imap = pool.imap
+        else:
+            pool, imap = None, map
+        try:
+            contact_buckets, name_buckets, normalized = {}, {}, {}
+            signed = []
+            for chunk in imap(sign_rows, chunks):
+                for pk, contact_keys, name_keys, name in chunk:
+                    for key in contact_keys:
+                        contact_buckets.setdefault(key, []).append(pk)
+                    for key in name_keys:
+                        name_buckets.setdefault(key, []).append(pk)
+                    normalized[pk] = name
+                    if options['rebuild_index']:
+                        signed.append((pk, contact_keys + name_keys))
+            del chunks
+
+            # A shared contact is a duplicate
+            clusters = UnionFind()
+            for pks in contact_buckets.values():
+                for pk in pks[1:]:
+                    clusters.union(pks[0], pk)
+            # A shared band of the name only makes candidates. The same
+            # normalised name is a duplicate, the others are compared once.
+            candidates = set()
+            for pks in name_buckets.values():
+                representatives = {}
+                for pk in pks:
+                    clusters.union(representatives.setdefault(normalized[pk], pk), pk)
+                candidates.update(
+                    (pk1, pk2) for pk1, pk2 in combinations(sorted(representatives.values()), 2)
+                    if clusters.find(pk1) != clusters.find(pk2))
+            pairs = (((pk1, names[pk1]), (pk2, names[pk2])) for pk1, pk2 in sorted(candidates))
+            for chunk in imap(similar_pairs, chunked(pairs, chunk_size)):
+                for pk1, pk2 in chunk:
+                    clusters.union(pk1, pk2)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if options['rebuild_index']:
+            with transaction.atomic():
+                Ngo_Signature.objects.all().delete()
+                Ngo_Signature.objects.bulk_create(
+                    (Ngo_Signature(ngo_id=pk, key=key) for pk, keys in signed for key in set(keys)),
+                    batch_size=duplicates.MAX_IDS_PER_QUERY)
+
+        members = {}
+        for pk in names:
+            members.setdefault(clusters.find(pk), []).append(pk)
+        found = sorted((pks for pks in members.values() if len(pks) > 1), key=lambda pks: (-len(pks), pks[0]))
+        for pks in found:
+            if options['format'] == 'json':
+                self.stdout.write(json.dumps([{'id': pk, 'name': names[pk], 'city': cities[pk]} for pk in pks]))
+            else:
+                self.stdout.write('%d Ngos:' % len(pks))
+                for pk in pks:
+                    self.stdout.write('  %8d  %s (%s)' % (pk, names[pk], cities[pk]))
+        self.stderr.write('%d Ngos, %d clusters of duplicates holding %d Ngos.' % (
+            len(names), len(found), sum(len(pks) for pks in found)))
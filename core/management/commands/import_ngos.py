@@ -0,0 +1,69 @@
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importer
+from core.audit import acting_as
+
+
+class Command(BaseCommand):
+    help = 'Imports Ngos from a CSV or JSON Lines file in batched transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON Lines file, - for stdin.')
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'),
+            help='Input format, guessed from the file extension by default.')
+        parser.add_argument(
+            '--user', required=True,
+            help='Username recorded as creator of the imported Ngos.')
+        parser.add_argument('--batch-size', type=int, default=importer.DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--errors', help='Write the per-row errors as JSON Lines to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError('User "%s" does not exist.' % options['user'])
+
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            if path.endswith('.csv'):
+                input_format = 'csv'
+            elif path.endswith(('.jsonl', '.ndjson')):
+                input_format = 'jsonl'
+            else:
+                raise CommandError('Cannot guess the format of "%s", use --format.' % path)
+
+        stream = importer.open_text(sys.stdin if path == '-' else path)
+        reader = importer.read_csv if input_format == 'csv' else importer.read_jsonl
+        started = time.perf_counter()
+
+        def progress(report):
+            self.stdout.write(
+                '%d imported, %d rejected' % (report['created'], len(report['errors'])),
+                ending='\r')
+            self.stdout.flush()
+
+        with stream, acting_as(user):
+            report = importer.import_ngos(
+                reader(stream), batch_size=options['batch_size'],
+                on_batch=progress if options['verbosity'] > 1 else None)
+
+        if options['errors']:
+            with open(options['errors'], 'w') as errors_file:
+                for error in report['errors']:
+                    errors_file.write(json.dumps(error) + '\n')
+        elif options['verbosity'] > 0:
+            for error in report['errors'][:20]:
+                self.stderr.write('Row %(row)s: %(errors)s' % error)
+            if len(report['errors']) > 20:
+                self.stderr.write('... %d more, use --errors' % (len(report['errors']) - 20))
+
+        self.stdout.write(self.style.SUCCESS('%d Ngos imported, %d rows rejected in %.1fs.' % (
+            report['created'], len(report['errors']), time.perf_counter() - started)))
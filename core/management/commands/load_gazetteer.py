@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core import cache, gazetteer
+from core.models import Geo_Place, Ngo
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads the places of NGO_HUB_GAZETTEER, locates every Ngo again and '
+        'recounts the Ngos of every place.'
+    )
+
+    def handle(self, *args, **options):
+        gazetteer.read.cache_clear()
+        gazetteer.lookups.cache_clear()
+        places, located = gazetteer.load(Geo_Place, Ngo)
+        cache.invalidate(['ngo'])
+        self.stdout.write(self.style.SUCCESS(
+            '%d places loaded, %d of %d Ngos located.' % (places, located, Ngo.objects.count())))
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Idempotency_Key
+
+
+class Command(BaseCommand):
+    help = 'Deletes the Idempotency-Key records older than NGO_HUB_IDEMPOTENCY_TTL.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - settings.NGO_HUB_IDEMPOTENCY_TTL
+        deleted, _ = Idempotency_Key.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write('Deleted %d expired keys.' % deleted)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import facets
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the precomputed Ngo facet counts.'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        self.stdout.write(self.style.SUCCESS('Facet counts rebuilt.'))
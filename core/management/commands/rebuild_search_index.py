@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the Ngo full-text search index from the core_ngo table.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.index_ngos()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
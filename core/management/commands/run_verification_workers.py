@@ -0,0 +1,55 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+
+def run_worker(burst, poll_seconds):
+    """
+    Runs one worker in this process until SIGTERM / SIGINT.
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    return jobs.work(burst=burst, poll_seconds=poll_seconds, stop=stop)
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the verification jobs queued by POST /core/ngo_verification/<id>/verify/. '
+        'Stops after the running jobs on SIGTERM or SIGINT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes.')
+        parser.add_argument(
+            '--burst', action='store_true', help='Exit once no job is runnable.')
+        parser.add_argument(
+            '--poll-seconds', type=float, default=1.0, help='Wait between two empty claims.')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            count = run_worker(options['burst'], options['poll_seconds'])
+            self.stdout.write('%d jobs run.' % count)
+            return
+        # The workers must not share the connections of this process
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=run_worker, args=(options['burst'], options['poll_seconds']),
+                name='verification-worker-%d' % index)
+            for index in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # The workers got the SIGINT too, let them finish their job
+            for process in processes:
+                process.join()
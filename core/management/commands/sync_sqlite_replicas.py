@@ -0,0 +1,36 @@
+import sqlite3
+
+import dj_database_url
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the default SQLite database to the SQLite files of '
+        'NGO_HUB_READ_REPLICAS, to run with read replicas locally.'
+    )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        if not primary['ENGINE'].endswith('sqlite3'):
+            raise CommandError('The default database is not SQLite.')
+        paths = [
+            replica['NAME'] for replica in map(dj_database_url.parse, settings.NGO_HUB_READ_REPLICAS)
+            if replica['ENGINE'] == 'django.db.backends.sqlite3'
+        ]
+        if not paths:
+            raise CommandError('NGO_HUB_READ_REPLICAS has no SQLite database.')
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for path in paths:
+                target = sqlite3.connect(path)
+                try:
+                    # Consistent snapshot, even while the primary is written to
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write('Copied %s to %s' % (primary['NAME'], path))
+        finally:
+            source.close()
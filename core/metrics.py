@@ -0,0 +1,302 @@
+"""
+Request instrumentation.
+
+MetricsMiddleware measures every request: wall time, number and time of
+the database queries, serializer and renderer time and response size. It
+sends them back in a Server-Timing header, adds them to the histograms
+served in the Prometheus text format at /metrics (to staff users and to
+the bearer of NGO_HUB_METRICS_TOKEN), and logs the SQL of requests slower
+than NGO_HUB_SLOW_REQUEST_MS.
+
+The histograms live in the memory of each process. With several worker
+processes, set NGO_HUB_METRICS_DIR to a directory shared by the workers
+(emptied on deploy): each process writes its histograms to <pid>.json
+there at most every NGO_HUB_METRICS_FLUSH_SECONDS seconds, and /metrics
+adds the files of all the processes up.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.utils.deprecation import MiddlewareMixin
+
+
+logger = logging.getLogger(__name__)
+
+# Executed statements kept for the slow request log
+MAX_LOGGED_QUERIES = 100
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    'ngo_hub_request_duration_seconds': ('Wall time of the requests.', SECONDS_BUCKETS),
+    'ngo_hub_request_db_queries': ('Database queries per request.', COUNT_BUCKETS),
+    'ngo_hub_request_db_duration_seconds': ('Database time per request.', SECONDS_BUCKETS),
+    'ngo_hub_request_serialize_duration_seconds': ('Serializer time per request.', SECONDS_BUCKETS),
+    'ngo_hub_request_render_duration_seconds': ('Renderer time per request.', SECONDS_BUCKETS),
+    'ngo_hub_response_size_bytes': ('Size of the response bodies.', BYTES_BUCKETS),
+}
+REQUESTS_TOTAL = 'ngo_hub_requests_total'
+
+
+class Measurements:
+    """
+    What one request spent its time on.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = []
+        self.timings = {'serialize': 0.0, 'render': 0.0}
+        self.depth = {}
+
+
+# Measurements of the current request, shared with the threads it runs in
+_current = ContextVar('ngo_hub_measurements', default=None)
+
+
+@contextmanager
+def timer(name):
+    """
+    Adds the time spent in the block to the current request's timing name.
+    Nested blocks of the same name are counted once.
+    """
+    measurements = _current.get()
+    if measurements is None:
+        yield
+        return
+    depth = measurements.depth.get(name, 0)
+    measurements.depth[name] = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        measurements.depth[name] = depth
+        if not depth:
+            measurements.timings[name] += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """
+    Counts the time spent in to_representation() as serializer time.
+    """
+    def to_representation(self, instance):
+        with timer('serialize'):
+            return super().to_representation(instance)
+
+
+def record_query(execute, sql, params, many, context):
+    measurements = _current.get()
+    if measurements is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        measurements.queries += 1
+        measurements.db_time += elapsed
+        if len(measurements.statements) < MAX_LOGGED_QUERIES:
+            measurements.statements.append((context['connection'].alias, sql, elapsed))
+
+
+def time_queries(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(time_queries)
+
+
+class Registry:
+    """
+    Histograms and counters of this process, by metric name and labels.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in HISTOGRAMS}
+        self._counters = {REQUESTS_TOTAL: {}}
+        self._flushed = 0.0
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            series = self._histograms[name].get(labels)
+            if series is None:
+                # Bucket counts (+Inf last), sum
+                series = self._histograms[name][labels] = [[0] * (len(buckets) + 1), 0.0]
+            series[0][bisect_left(buckets, value)] += 1
+            series[1] += value
+
+    def increment(self, name, labels):
+        with self._lock:
+            self._counters[name][labels] = self._counters[name].get(labels, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': {
+                    name: [[list(labels), counts[:], total] for labels, (counts, total) in series.items()]
+                    for name, series in self._histograms.items()
+                },
+                'counters': {
+                    name: [[list(labels), value] for labels, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+            }
+
+    def flush(self, force=False):
+        """
+        Writes the snapshot to NGO_HUB_METRICS_DIR, at most once per flush interval.
+        """
+        directory = getattr(settings, 'NGO_HUB_METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or (not force and now - self._flushed < getattr(
+                settings, 'NGO_HUB_METRICS_FLUSH_SECONDS', 5)):
+            return
+        self._flushed = now
+        path = os.path.join(directory, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as stream:
+            json.dump(self.snapshot(), stream)
+        os.replace(path + '.tmp', path)
+
+
+registry = Registry()
+
+
+def collect():
+    """
+    Returns the snapshots of all the processes added up.
+    """
+    directory = getattr(settings, 'NGO_HUB_METRICS_DIR', None)
+    if not directory:
+        snapshots = [registry.snapshot()]
+    else:
+        registry.flush(force=True)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(directory, filename)) as stream:
+                        snapshots.append(json.load(stream))
+                except (OSError, ValueError):
+                    continue
+    histograms = {name: {} for name in HISTOGRAMS}
+    counters = {REQUESTS_TOTAL: {}}
+    for snapshot in snapshots:
+        for name, series in snapshot['histograms'].items():
+            for labels, counts, total in series:
+                merged = histograms.setdefault(name, {}).setdefault(
+                    tuple(labels), [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        for name, series in snapshot['counters'].items():
+            for labels, value in series:
+                merged = counters.setdefault(name, {})
+                merged[tuple(labels)] = merged.get(tuple(labels), 0) + value
+    return histograms, counters
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs)
+
+
+def exposition():
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    histograms, counters = collect()
+    lines = [
+        '# HELP %s Requests by route, method and status.' % REQUESTS_TOTAL,
+        '# TYPE %s counter' % REQUESTS_TOTAL,
+    ]
+    for labels, value in sorted(counters[REQUESTS_TOTAL].items()):
+        lines.append('%s%s %d' % (REQUESTS_TOTAL, _labels(('route', 'method', 'status'), labels), value))
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for labels, (counts, total) in sorted(histograms.get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, _labels(('route', 'method'), labels, [('le', bound)]), cumulative))
+            lines.append('%s_sum%s %r' % (name, _labels(('route', 'method'), labels), total))
+            lines.append('%s_count%s %d' % (name, _labels(('route', 'method'), labels), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for the scrapers sending the
+    NGO_HUB_METRICS_TOKEN bearer token and for the logged in staff users.
+    """
+    token = getattr(settings, 'NGO_HUB_METRICS_TOKEN', None)
+    scraper = token and constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % token)
+    if not scraper and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Measures every request, see the module docstring.
+    """
+    def process_request(self, request):
+        _current.set(Measurements())
+
+    def process_response(self, request, response):
+        measurements = _current.get()
+        if measurements is None:
+            return response
+        _current.set(None)
+        total = time.perf_counter() - measurements.started
+
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.url_name or 'unnamed') if match else 'unmatched'
+        labels = (route, request.method)
+        registry.increment(REQUESTS_TOTAL, labels + (str(response.status_code),))
+        registry.observe('ngo_hub_request_duration_seconds', labels, total)
+        registry.observe('ngo_hub_request_db_queries', labels, measurements.queries)
+        registry.observe('ngo_hub_request_db_duration_seconds', labels, measurements.db_time)
+        registry.observe('ngo_hub_request_serialize_duration_seconds', labels,
+                         measurements.timings['serialize'])
+        registry.observe('ngo_hub_request_render_duration_seconds', labels,
+                         measurements.timings['render'])
+        if not response.streaming:
+            registry.observe('ngo_hub_response_size_bytes', labels, len(response.content))
+        registry.flush()
+
+        response['Server-Timing'] = ', '.join([
+            'total;dur=%.2f' % (total * 1000),
+            'db;dur=%.2f;desc="%d queries"' % (measurements.db_time * 1000, measurements.queries),
+            'serialize;dur=%.2f' % (measurements.timings['serialize'] * 1000),
+            'render;dur=%.2f' % (measurements.timings['render'] * 1000),
+        ])
+
+        threshold = getattr(settings, 'NGO_HUB_SLOW_REQUEST_MS', None)
+        if threshold is not None and total * 1000 >= threshold:
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms\n%s',
+                request.method, request.get_full_path(), route, total * 1000,
+                measurements.queries, measurements.db_time * 1000,
+                '\n'.join('[%s %.1f ms] %s' % (alias, elapsed * 1000, sql)
+                          for alias, sql, elapsed in measurements.statements))
+        return response
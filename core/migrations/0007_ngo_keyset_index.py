@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_auto_20180910_0520'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ngo',
+            index=models.Index(fields=['created_at', 'id'], name='core_ngo_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from core import search
+
+
+def create_search_index(apps, schema_editor):
+    search.create_index(schema_editor)
+    search.index_ngos(using=schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_ngo_keyset_index'),
+    ]
+
+    operations = [
+        # The index table is vendor specific (FTS5 / tsvector + GIN),
+        # see core.search
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
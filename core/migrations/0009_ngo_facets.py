@@ -0,0 +1,85 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+FACET_DIMENSIONS = (
+    ('Ngo', ('location_country', 'location_state', 'location_city')),
+    ('Ngo_Detail', (
+        'orientation', 'level', 'activity', 'staffing',
+        'fund', 'fund_acceptance_from', 'legal_status')),
+)
+
+
+def populate_facets(apps, schema_editor):
+    Ngo_Facet = apps.get_model('core', 'Ngo_Facet')
+    facets = []
+    for model_name, dimensions in FACET_DIMENSIONS:
+        model = apps.get_model('core', model_name)
+        for dimension in dimensions:
+            rows = (model.objects.exclude(**{dimension: ''})
+                    .values_list(dimension).annotate(total=Count('pk')).order_by())
+            facets.extend(
+                Ngo_Facet(dimension=dimension, value=value, count=total) for value, total in rows)
+    Ngo_Facet.objects.bulk_create(facets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_ngo_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ngo_Facet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=32)),
+                ('value', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ngo',
+            index=models.Index(fields=['location_country', 'location_state', 'location_city'], name='core_ngo_location_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo',
+            index=models.Index(fields=['location_city'], name='core_ngo_city_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['orientation', 'level'], name='core_detail_orient_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['level'], name='core_detail_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['activity'], name='core_detail_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['staffing'], name='core_detail_staffing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['fund', 'fund_acceptance_from'], name='core_detail_fund_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['fund_acceptance_from'], name='core_detail_fund_from_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo_detail',
+            index=models.Index(fields=['legal_status'], name='core_detail_legal_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ngo_facet',
+            unique_together={('dimension', 'value')},
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:00
+
+import core.audit
+from django.conf import settings
+from django.db import migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0010_record_versions'),
+    ]
+
+    operations = [
+        # Same columns as cuser's CurrentUserField, only the field class changes
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='ngo',
+                name='created_by',
+                field=core.audit.AuditUserField(editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='CreatedNgo', to=settings.AUTH_USER_MODEL),
+            ),
+            migrations.AlterField(
+                model_name='ngo',
+                name='modified_by',
+                field=core.audit.AuditUserField(editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ModifiedNgo', to=settings.AUTH_USER_MODEL),
+            ),
+            migrations.AlterField(
+                model_name='ngo_verification',
+                name='modified_by',
+                field=core.audit.AuditUserField(editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='VerifiedNgo', to=settings.AUTH_USER_MODEL),
+            ),
+        ]),
+    ]
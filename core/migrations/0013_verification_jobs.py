@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:28
+
+import core.audit
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Verification_Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('email', 'Email'), ('website', 'Website'), ('phone_primary', 'Primary Phone Number'), ('phone_secondary', 'Secondary Phone Number')], max_length=15)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('waiting', 'Waiting for confirmation'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=9)),
+                ('domain', models.CharField(max_length=255)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=255)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('secret', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('failed_confirmations', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('requested_by', core.audit.AuditUserField(editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='RequestedVerificationJobs', to=settings.AUTH_USER_MODEL)),
+                ('verification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='core.ngo_verification')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='verification_job',
+            index=models.Index(fields=['status', 'run_after'], name='core_job_status_run_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='verification_job',
+            index=models.Index(fields=['domain', 'status'], name='core_job_domain_status_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_fully_verified(apps, schema_editor):
+    Ngo_Verification = apps.get_model('core', 'Ngo_Verification')
+    Ngo_Verification.objects.using(schema_editor.connection.alias).filter(
+        verified_phone_primary=True, verified_phone_secondary=True, v_email=True, v_website=True,
+    ).update(is_fully_verified=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0013_verification_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ngo_verification',
+            name='is_fully_verified',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Verification_Event',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(blank=True, max_length=24)),
+                ('event', models.CharField(choices=[('verified', 'Field verified'), ('revoked', 'Field verification revoked'), ('completed', 'Fully verified'), ('reopened', 'No longer fully verified')], max_length=9)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='VerificationEvents', to=settings.AUTH_USER_MODEL)),
+                ('verification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='core.ngo_verification')),
+            ],
+        ),
+        migrations.RunPython(mark_fully_verified, migrations.RunPython.noop),
+    ]
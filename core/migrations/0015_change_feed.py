@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:37
+
+from django.db import migrations, models
+
+
+def record_existing(apps, schema_editor):
+    """
+    One change per existing record, so that since=0 returns all of them.
+    """
+    alias = schema_editor.connection.alias
+    Ngo_Change = apps.get_model('core', 'Ngo_Change')
+    for model in ('ngo', 'ngo_verification', 'ngo_detail'):
+        records = apps.get_model('core', model).objects.using(alias).order_by('id')
+        rows = records.values_list('id', 'id' if model == 'ngo' else 'ngo_id').iterator()
+        batch = []
+        for object_id, ngo_id in rows:
+            batch.append(Ngo_Change(model=model, object_id=object_id, ngo_id=ngo_id))
+            if len(batch) >= 1000:
+                Ngo_Change.objects.using(alias).bulk_create(batch)
+                batch = []
+        Ngo_Change.objects.using(alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_verification_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ngo_Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('ngo', 'Ngo'), ('ngo_verification', 'Ngo Verification'), ('ngo_detail', 'Ngo Detail')], max_length=16)),
+                ('object_id', models.PositiveIntegerField()),
+                ('ngo_id', models.PositiveIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('model', 'object_id')},
+            },
+        ),
+        migrations.RunPython(record_existing, migrations.RunPython.noop),
+    ]
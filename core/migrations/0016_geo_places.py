@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from core import gazetteer
+
+
+def load_gazetteer(apps, schema_editor):
+    gazetteer.load(apps.get_model('core', 'Geo_Place'), apps.get_model('core', 'Ngo'),
+                   using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geo_Place',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('city', models.CharField(max_length=255)),
+                ('state', models.CharField(max_length=255)),
+                ('country', models.CharField(max_length=255)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('cell_row', models.PositiveSmallIntegerField()),
+                ('cell_col', models.PositiveSmallIntegerField()),
+                ('ngo_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ngo',
+            name='place',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ngos', to='core.geo_place'),
+        ),
+        migrations.AddIndex(
+            model_name='ngo',
+            index=models.Index(fields=['place', 'id'], name='core_ngo_place_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='geo_place',
+            index=models.Index(fields=['cell_row', 'cell_col'], name='core_place_cell_idx'),
+        ),
+        migrations.RunPython(load_gazetteer, migrations.RunPython.noop),
+    ]
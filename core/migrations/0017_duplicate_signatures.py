@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from core import duplicates
+
+
+def index_ngos(apps, schema_editor):
+    duplicates.rebuild(apps.get_model('core', 'Ngo_Signature'), apps.get_model('core', 'Ngo'),
+                       using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_geo_places'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ngo_Signature',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('ngo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='signatures', to='core.ngo')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ngo_signature',
+            index=models.Index(fields=['key', 'ngo'], name='core_signature_key_idx'),
+        ),
+        migrations.RunPython(index_ngos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-17 21:51
+
+from django.db import migrations, models
+
+
+ACTIVE_STATUSES = ('queued', 'running', 'waiting')
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    """
+    Keeps the newest active job of each verified field, the others fail.
+    """
+    Verification_Job = apps.get_model('core', 'Verification_Job')
+    jobs = Verification_Job.objects.using(schema_editor.connection.alias).filter(status__in=ACTIVE_STATUSES)
+    kept = set()
+    duplicates = []
+    for pk, verification_id, kind in jobs.order_by('-id').values_list('pk', 'verification_id', 'kind'):
+        if (verification_id, kind) in kept:
+            duplicates.append(pk)
+        kept.add((verification_id, kind))
+    jobs.filter(pk__in=duplicates).update(status='failed', last_error='Duplicate', locked_by='', locked_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_duplicate_signatures'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='verification_job',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ACTIVE_STATUSES)), fields=('verification', 'kind'), name='core_job_one_active_idx'),
+        ),
+    ]
@@ -1,52 +1,56 @@
-from django.db import models
-from cuser.fields import CurrentUserField
-from django.core.validators import validate_email
-from django.core.exceptions import ValidationError
-from django.utils.translation import gettext_lazy as _
+from django.conf import settings
+from django.db import models, router, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from core import gazetteer, validation
+from core.audit import AuditUserField
 
 
 def validate_isalphaspace(value):
     """
     Vaildates if the value is alphabet and space
     """
-    if all(x.isalpha() or x.isspace() for x in value):
-        raise ValidationError(
-            _('%(value)s : cannot contain anything other than alphabet, space'),
-            params={'value': value},
-        )
+    if not validation.isalphaspace(value):
+        raise validation.alphaspace().error(value)
 
 
 def validate_isnumeric(value):
     """
-    Vaildates if the value is alphabet and space
+    Vaildates if the value is numeric
     """
-    if all(x.isnumeric() for x in value):
-        raise ValidationError(
-            _('%(value)s : cannot contain anything other than number'),
-            params={'value': value},
-        )
+    if not validation.isnumeric(value):
+        raise validation.numeric().error(value)
 
 def validate_minlength(value, min):
     """
     Vaildates the minimum length of the value
     """
     if len(value)<min:
-        raise ValidationError(
-            _('%(value)s : length is less than %(constraint)s'),
-            params={'value': value, 'constraint': min},
-        )
+        raise validation.min_length(min).error(value)
 
 
 def validate_choice(selection, choice):
     """
     Vaildates if selection in choices
     """
-    values = [item[0] for item in choice]
-    if selection not in values:
-        raise ValidationError(
-            _('%(selection)s : selection is not in %(values)s'),
-            params={'selection': selection, 'values': values},
-        )
+    check = validation.choice(choice)
+    if selection and not check.test(selection):
+        raise check.error(selection)
+
+
+def increment_version(instance):
+    """
+    Makes the next save increment the version in the UPDATE itself, so
+    that concurrent saves never write the same version.
+    """
+    instance.version = models.F('version') + 1
+
+
+def load_version(instance, using):
+    """
+    Reads the version the save wrote, in the transaction of the save.
+    """
+    instance.refresh_from_db(using=using, fields=['version'])
 
 
 # Ngo Class
@@ -68,14 +72,20 @@ class Ngo(models.Model):
     
     # Date and Time of creation of record for this Ngo
     created_at = models.DateTimeField(auto_now_add=True)
+
+    # Date and Time of last modification of record for this Ngo
+    modified_at = models.DateTimeField(auto_now=True)
+
+    # Incremented on every save, used as the ETag of the record
+    version = models.PositiveIntegerField(default=1)
     
     # This Ngo record was created by <User>
     # Use User.created_Ngos.all() to see all Ngos they created
-    created_by = CurrentUserField(add_only=True, related_name="CreatedNgo",blank=False,null=False,on_delete=models.DO_NOTHING)
+    created_by = AuditUserField(add_only=True, related_name="CreatedNgo",blank=False,null=False,on_delete=models.DO_NOTHING)
     
     # This Ngo record was modified by <User>
     # Use User.modified_Ngos.all() to see all Ngos they modified
-    modified_by = CurrentUserField(related_name="ModifiedNgo",blank=False,null=False,on_delete=models.DO_NOTHING)
+    modified_by = AuditUserField(related_name="ModifiedNgo",blank=False,null=False,on_delete=models.DO_NOTHING)
     
     name = models.TextField(
         help_text='Name of the Ngo | 2,000 characters max | 2 characters min',
@@ -117,26 +127,72 @@ class Ngo(models.Model):
         help_text='Website of the Ngo | 200 characters max',
         max_length=200,blank=False,null=False)
 
+    # Gazetteer place of the location, set on save (see core.gazetteer)
+    # Use <Geo_Place>.ngos.all() to see the Ngos located there
+    place = models.ForeignKey('Geo_Place', related_name="ngos",blank=True,null=True,editable=False,db_index=False,on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            # Ngos of a place, see core.geo.nearest_ngos
+            models.Index(fields=['place', 'id'], name='core_ngo_place_id_idx'),
+            # Keyset pagination order, see core.pagination.KeysetPagination
+            models.Index(fields=['created_at', 'id'], name='core_ngo_created_id_idx'),
+            # Location filters, see core.filters.NgoFilterBackend
+            models.Index(
+                fields=['location_country', 'location_state', 'location_city'],
+                name='core_ngo_location_idx'),
+            models.Index(fields=['location_city'], name='core_ngo_city_idx'),
+        ]
+
+    # Validations and standardizations, run by save() and the serializers
+    rules = validation.Rules(
+        checks={
+            'name': (validation.min_length(2), validation.alphaspace()),
+            'purpose': (validation.min_length(50),),
+            'description': (validation.min_length(300),),
+            'location_city': (validation.alphaspace(),),
+            'location_state': (validation.alphaspace(),),
+            'location_country': (validation.alphaspace(),),
+            'phone_primary': (validation.numeric(),),
+            'phone_secondary': (validation.numeric(),),
+        },
+        normalizers={
+            'location_city': str.upper,
+            'location_state': str.upper,
+            'location_country': str.upper,
+        })
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stored place, the Ngo counts of the places are adjusted after a move
+        instance._stored_place_id = instance.__dict__.get('place_id')
+        return instance
 
     def save(self, *args, **kwargs):
         """
         Overrides save method to perform validations and standardizations.
         """
-        validate_minlength(self.name,2)
-        validate_minlength(self.purpose,50)
-        validate_minlength(self.description,300)
-        self.location_city = self.location_city.upper()
-        self.location_state = self.location_state.upper()
-        self.location_country = self.location_country.upper()
-        validate_isalphaspace(self.name)
-        validate_isalphaspace(self.location_city)
-        validate_isalphaspace(self.location_state)
-        validate_isalphaspace(self.location_country)
-        validate_isnumeric(self.phone_p)
-        validate_isnumeric(self.phone_s)
-        # Initiate Ngo Verification
-        Ngo_Verification(Ngo=self).save()
-        super().save(*args, **kwargs)  # Call the "real" save() method.
+        self.rules.clean(self)
+        self.place_id = gazetteer.geocode(self.location_city, self.location_state, self.location_country)
+        adding = self._state.adding
+        if not adding:
+            increment_version(self)
+        using = kwargs.get('using') or router.db_for_write(Ngo, instance=self)
+        # The Ngo and its verification row are created together or not at all
+        with transaction.atomic(using=using, savepoint=False):
+            try:
+                super().save(*args, **kwargs)  # Call the "real" save() method.
+            except BaseException:
+                if not adding:
+                    # Not saved, the stored version is unknown
+                    del self.version
+                raise
+            if not adding:
+                load_version(self, using)
+            if adding:
+                # Initiate Ngo Verification
+                Ngo_Verification(ngo=self, modified_by_id=self.modified_by_id).save(using=using)
 
 
 # Ngo Verification Class
@@ -154,7 +210,7 @@ class Ngo_Verification(models.Model):
     ngo = models.OneToOneField(Ngo, on_delete=models.CASCADE, related_name="Verification",blank=False,null=False)
     # This Ngo was verified by <User>
     # Use User.verified_Ngos.all() to see all Ngos they verified
-    modified_by = CurrentUserField(related_name="VerifiedNgo",blank=False,null=False,on_delete=models.DO_NOTHING)
+    modified_by = AuditUserField(related_name="VerifiedNgo",blank=False,null=False,on_delete=models.DO_NOTHING)
     # Verification Status of Primary Phone Number
     verified_phone_primary = models.BooleanField(default=False)
     # Verification Status of Secondary Phone Number
@@ -163,16 +219,148 @@ class Ngo_Verification(models.Model):
     v_email = models.BooleanField(default=False)
     # Verification Status of Website
     v_website = models.BooleanField(default=False)
-    
+    # Date and Time of last modification of the verification status
+    modified_at = models.DateTimeField(auto_now=True)
+    # Incremented on every save, used as the ETag of the record
+    version = models.PositiveIntegerField(default=1)
+    # Verification Status of the Ngo: all the fields verified
+    # Only written by transition(), use it to list the verified Ngos
+    is_fully_verified = models.BooleanField(default=False,editable=False,db_index=True)
+
+    # Verification flags
+    FLAGS = ('verified_phone_primary', 'verified_phone_secondary', 'v_email', 'v_website')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stored flags, the next save logs the ones that changed
+        instance._stored_flags = {flag: getattr(instance, flag) for flag in cls.FLAGS if flag in instance.__dict__}
+        return instance
+
+    def get_stored_flags(self, using):
+        """
+        Returns the flags stored for this record, all False for a new one.
+        They are read from the database when the instance was not loaded
+        with them (built with the pk of a stored record, or loaded with
+        only() / defer()); an instance built with a stored pk is updated.
+        """
+        if self.pk is None:
+            return dict.fromkeys(self.FLAGS, False)
+        adding = self._state.adding
+        stored = {} if adding else dict(getattr(self, '_stored_flags', {}))
+        missing = [flag for flag in self.FLAGS if flag not in stored]
+        if missing:
+            row = (Ngo_Verification.objects.using(using).select_for_update()
+                   .filter(pk=self.pk).values(*missing).first())
+            if row is None:
+                return dict.fromkeys(self.FLAGS, False)
+            self._state.adding = False
+            stored.update(row)
+        return stored
 
     def save(self, *args, **kwargs):
         """
-        Overrides save method to check if verification finished.
+        Overrides save method to log the changed flags and move the verification status.
+        A save changing no flag does nothing more than the update.
         """
-        if self.verified_phone_primary and self.verified_phone_secondary and self.v_email and self.v_website:
-            Ngo_Detail(Ngo=self.Ngo).save()
-        super().save(*args, **kwargs)  # Call the "real" save() method.
+        update_fields = kwargs.get('update_fields')
+        using = kwargs.get('using') or router.db_for_write(Ngo_Verification, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            stored = self.get_stored_flags(using)
+            adding = self._state.adding
+            if not adding:
+                increment_version(self)
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name != 'is_fully_verified'
+                    and (update_fields is None or field.name in update_fields)]
+            changed = [
+                flag for flag in self.FLAGS
+                if (update_fields is None or flag in update_fields)
+                and getattr(self, flag) != stored[flag]]
+            try:
+                super().save(*args, **kwargs)  # Call the "real" save() method.
+            except BaseException:
+                if not adding:
+                    # Not saved, the stored version is unknown
+                    del self.version
+                raise
+            if not adding:
+                load_version(self, using)
+            if changed:
+                Verification_Event.objects.using(using).bulk_create([
+                    Verification_Event(
+                        verification=self, field=flag, user_id=self.modified_by_id,
+                        event=Verification_Event.VERIFIED if getattr(self, flag) else Verification_Event.REVOKED)
+                    for flag in changed])
+                self.transition(using)
+        self._stored_flags = {flag: getattr(self, flag) for flag in self.FLAGS}
+
+    def transition(self, using=None):
+        """
+        Sets is_fully_verified from the stored flags. The conditional UPDATEs
+        let one save only make each transition, however many saves race, and
+        the hooks (verification_completed / verification_reopened) are sent
+        once, after the commit.
+        """
+        rows = Ngo_Verification.objects.using(using).filter(pk=self.pk)
+        complete = models.Q(**dict.fromkeys(self.FLAGS, True))
+        if rows.filter(complete, is_fully_verified=False).update(is_fully_verified=True):
+            self.is_fully_verified, event, signal = True, Verification_Event.COMPLETED, verification_completed
+        elif rows.filter(~complete, is_fully_verified=True).update(is_fully_verified=False):
+            self.is_fully_verified, event, signal = False, Verification_Event.REOPENED, verification_reopened
+        else:
+            return
+        Verification_Event.objects.using(using).create(verification=self, user_id=self.modified_by_id, event=event)
+        transaction.on_commit(
+            lambda: signal.send(sender=Ngo_Verification, instance=self), using=using)
+
 
+# Sent once, after the commit, when an Ngo_Verification becomes fully
+# verified, and when it stops being fully verified (arguments: instance)
+verification_completed = Signal()
+verification_reopened = Signal()
+
+
+# Verification Event Class
+class Verification_Event(models.Model):
+    """
+    The class is responsible to log the changes of an Ngo Verification:
+    which field was verified or revoked, by whom and when, and when the
+    Ngo became (or stopped being) fully verified. Events are only appended.
+    """
+
+    # Event choices
+    VERIFIED = 'verified'
+    REVOKED = 'revoked'
+    COMPLETED = 'completed'
+    REOPENED = 'reopened'
+    EVENT = (
+        (VERIFIED, 'Field verified'),
+        (REVOKED, 'Field verification revoked'),
+        (COMPLETED, 'Fully verified'),
+        (REOPENED, 'No longer fully verified'),
+    )
+
+    # The verification
+    # Use <Ngo_Verification>.events.all() to see its history
+    verification = models.ForeignKey(Ngo_Verification, on_delete=models.CASCADE, related_name="events")
+    # Verification flag, empty for the changes of the verification status
+    field = models.CharField(max_length=24,blank=True)
+    # What happened | Choice
+    event = models.CharField(max_length=9,choices=EVENT)
+    # The change was made by <User>
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="VerificationEvents",blank=True,null=True,on_delete=models.DO_NOTHING)
+    # Date and Time of the change
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        """
+        Overrides save method to keep the log append-only.
+        """
+        if not self._state.adding:
+            raise ValueError('Verification events cannot be changed.')
+        super().save(*args, **kwargs)  # Call the "real" save() method.
 
 
 # Ngo Detail Class
@@ -277,25 +465,246 @@ class Ngo_Detail(models.Model):
     # Overhead Cost of the Ngo | Choice
     # % of funding spent on overheads
     overhead_cost = models.PositiveSmallIntegerField()
+    # Date and Time of last modification of the details
+    modified_at = models.DateTimeField(auto_now=True)
+    # Incremented on every save, used as the ETag of the record
+    version = models.PositiveIntegerField(default=1)
 
+    # Validations, run by save() and the serializers
+    rules = validation.Rules(checks={
+        'orientation': (validation.choice(ORIENTATION),),
+        'level': (validation.choice(LEVEL),),
+        'activity': (validation.choice(ACTIVITY),),
+        'staffing': (validation.choice(STAFFING),),
+        'fund': (validation.choice(FUND),),
+        'fund_acceptance_from': (validation.choice(FUND_ACCEPTANCE_FROM),),
+        'legal_status': (validation.choice(LEGAL_STATUS),),
+    })
 
     def save(self, *args, **kwargs):
         """
         Overrides save method to check if verification finished.
         """
-        if self.orientation:
-            validate_choice(self.orientation, self.ORIENTATION)
-        if self.level:
-            validate_choice(self.level, self.LEVEL)
-        if self.activity:
-            validate_choice(self.activity, self.ACTIVITY)
-        if self.staffing:
-            validate_choice(self.staffing, self.STAFFING)
-        if self.fund:
-            validate_choice(self.fund, self.FUND)
-        if self.fund_acceptance_from:
-            validate_choice(self.fund_acceptance_from, self.FUND_ACCEPTANCE_FROM)
-        if self.legal_status:
-            validate_choice(self.legal_status, self.LEGAL_STATUS)
-        super().save(*args, **kwargs)  # Call the "real" save() method.
-    overhead_cost = models.PositiveSmallIntegerField(blank=False,null=False)
+        self.rules.clean(self)
+        adding = self._state.adding
+        if not adding:
+            increment_version(self)
+        using = kwargs.get('using') or router.db_for_write(Ngo_Detail, instance=self)
+        # The version written by the UPDATE is read back in its transaction
+        with transaction.atomic(using=using, savepoint=False):
+            try:
+                super().save(*args, **kwargs)  # Call the "real" save() method.
+            except BaseException:
+                if not adding:
+                    # Not saved, the stored version is unknown
+                    del self.version
+                raise
+            if not adding:
+                load_version(self, using)
+
+    class Meta:
+        # Choice filters, see core.filters.NgoFilterBackend
+        indexes = [
+            models.Index(fields=['orientation', 'level'], name='core_detail_orient_level_idx'),
+            models.Index(fields=['level'], name='core_detail_level_idx'),
+            models.Index(fields=['activity'], name='core_detail_activity_idx'),
+            models.Index(fields=['staffing'], name='core_detail_staffing_idx'),
+            models.Index(fields=['fund', 'fund_acceptance_from'], name='core_detail_fund_idx'),
+            models.Index(fields=['fund_acceptance_from'], name='core_detail_fund_from_idx'),
+            models.Index(fields=['legal_status'], name='core_detail_legal_idx'),
+        ]
+
+
+# Geo Place Class
+class Geo_Place(models.Model):
+    """
+    The class is responsible to hold a place of the gazetteer the Ngos are
+    located at (see core.gazetteer), with the grid cell of its coordinates:
+    the spatial index of the distance queries, see core.geo.
+    """
+    # Id of the place in the gazetteer
+    id = models.PositiveIntegerField(primary_key=True)
+    # Name of the place
+    city = models.CharField(max_length=255)
+    state = models.CharField(max_length=255)
+    country = models.CharField(max_length=255)
+    # Coordinates of the centre of the place, WGS84 degrees
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    # Grid cell of the coordinates, see core.gazetteer.cell
+    cell_row = models.PositiveSmallIntegerField()
+    cell_col = models.PositiveSmallIntegerField()
+    # Number of Ngos located here, kept current by core.signals
+    ngo_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell_row', 'cell_col'], name='core_place_cell_idx'),
+        ]
+
+
+# Ngo Facet Class
+class Ngo_Facet(models.Model):
+    """
+    The class is responsible to hold precomputed facet counts.
+    One row per (dimension, value) holding the number of Ngos with that value.
+    Kept current incrementally from the save and delete paths, see core.facets.
+    """
+    # Filterable field, e.g. location_country or orientation
+    dimension = models.CharField(max_length=32)
+    # Value of the field
+    value = models.CharField(max_length=255)
+    # Number of Ngos having this value
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('dimension', 'value'),)
+
+
+# Ngo Signature Class
+class Ngo_Signature(models.Model):
+    """
+    The class is responsible to hold the similarity index of the duplicate
+    detection, see core.duplicates. One row per signature key of an Ngo:
+    Ngos sharing a key are candidate duplicates.
+    """
+    # The Ngo
+    # Use <Ngo>.signatures.all() to see its keys
+    ngo = models.ForeignKey(Ngo, on_delete=models.CASCADE, related_name="signatures")
+    # Hash of a contact or of a band of the MinHash of the name
+    key = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'ngo'], name='core_signature_key_idx'),
+        ]
+
+
+# Idempotency Key Class
+class Idempotency_Key(models.Model):
+    """
+    The class is responsible to remember the response of a POST sent with an
+    Idempotency-Key header, so that a retry of it is answered with the same
+    response instead of being applied twice, see core.idempotency.
+    """
+    # Client that sent the request
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Idempotency-Key header of the request
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and body of the request
+    fingerprint = models.CharField(max_length=64)
+    # Stored response
+    status_code = models.PositiveSmallIntegerField()
+    response = models.TextField()
+    # Date and Time of the first request, keys expire after NGO_HUB_IDEMPOTENCY_TTL
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = (('user', 'key'),)
+
+
+# Verification Job Class
+class Verification_Job(models.Model):
+    """
+    The class is responsible to hold an automated verification of one
+    field of an Ngo, run in the background by the verification workers,
+    see core.jobs and core.verification.
+    """
+
+    # Verified field choices
+    KIND = (
+        ('email', 'Email'),
+        ('website', 'Website'),
+        ('phone_primary', 'Primary Phone Number'),
+        ('phone_secondary', 'Secondary Phone Number'),
+    )
+
+    # Status choices
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    WAITING = 'waiting'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (WAITING, 'Waiting for confirmation'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (QUEUED, RUNNING, WAITING)
+
+    # The verification this job updates
+    # Use <Ngo_Verification>.jobs.all() to see its jobs
+    verification = models.ForeignKey(Ngo_Verification, on_delete=models.CASCADE, related_name="jobs")
+    # This job was requested by <User>
+    requested_by = AuditUserField(add_only=True, related_name="RequestedVerificationJobs",on_delete=models.DO_NOTHING)
+    # Verified field | Choice
+    kind = models.CharField(max_length=15,choices=KIND)
+    # Status of the job | Choice
+    status = models.CharField(max_length=9,choices=STATUS,default=QUEUED)
+    # Host the check contacts, the workers limit the jobs running per domain
+    domain = models.CharField(max_length=255)
+    # Number of runs so far, retries stop at NGO_HUB_VERIFICATION_MAX_ATTEMPTS
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not run before this Date and Time (retry backoff)
+    run_after = models.DateTimeField(default=timezone.now)
+    # Worker running the job and since when
+    locked_by = models.CharField(max_length=255,blank=True)
+    locked_at = models.DateTimeField(blank=True,null=True)
+    # Hash of the token or code sent to the Ngo, while waiting for its confirmation
+    secret = models.CharField(max_length=64,blank=True,db_index=True)
+    # The token or code expires at this Date and Time
+    expires_at = models.DateTimeField(blank=True,null=True)
+    # Wrong codes submitted so far
+    failed_confirmations = models.PositiveSmallIntegerField(default=0)
+    # Error of the last run
+    last_error = models.TextField(blank=True)
+    # Date and Time of creation and last modification of the job
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Claim order of the workers
+            models.Index(fields=['status', 'run_after'], name='core_job_status_run_idx'),
+            # Running jobs per domain
+            models.Index(fields=['domain', 'status'], name='core_job_domain_status_idx'),
+        ]
+        constraints = [
+            # One queued, running or waiting job per verified field
+            models.UniqueConstraint(
+                fields=['verification', 'kind'], condition=models.Q(status__in=('queued', 'running', 'waiting')),
+                name='core_job_one_active_idx'),
+        ]
+
+
+# Ngo Change Class
+class Ngo_Change(models.Model):
+    """
+    The class is responsible to hold the change feed read by the mirrors of
+    the directory, see core.changes. The id of a row is the sequence number
+    of the change. A new change of a record replaces its previous row, so
+    the feed holds one row per record, the deleted ones (tombstones) included.
+    """
+
+    # Changed model choices
+    MODEL = (
+        ('ngo', 'Ngo'),
+        ('ngo_verification', 'Ngo Verification'),
+        ('ngo_detail', 'Ngo Detail'),
+    )
+
+    # Changed model | Choice
+    model = models.CharField(max_length=16,choices=MODEL)
+    # Primary key of the changed record, kept after its deletion
+    object_id = models.PositiveIntegerField()
+    # Primary key of the Ngo of the record (its own for an Ngo)
+    ngo_id = models.PositiveIntegerField()
+    # The record was deleted
+    deleted = models.BooleanField(default=False)
+    # Date and Time of the change
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('model', 'object_id'),)
@@ -0,0 +1,250 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class PageSizePagination(BasePagination):
+    """
+    Common page size handling and response layout of the core paginators.
+    """
+    page_size_query_param = 'page_size'
+    page_size = getattr(settings, 'NGO_HUB_PAGE_SIZE', 50)
+    max_page_size = getattr(settings, 'NGO_HUB_MAX_PAGE_SIZE', 200)
+
+    def get_page_size(self, request):
+        """
+        Returns the requested page size, capped at max_page_size.
+        """
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class KeysetPagination(PageSizePagination):
+    """
+    Cursor (keyset) pagination over a unique, indexed ordering.
+    Instead of OFFSET the next page is fetched with a
+    `WHERE (a, b) > (last_a, last_b)` predicate, so every page costs
+    the same regardless of how deep the client has scrolled.
+    The view may set `keyset_ordering` (the last field must be unique),
+    default is ('id',).
+    """
+    cursor_query_param = 'cursor'
+    ordering = ('id',)
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.limit = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            position = self.parse_position(position, queryset.model)
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position, reverse))
+
+        # Fetch one extra row to know whether there is a following page.
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return results
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+    def get_order_by(self, reverse):
+        prefix = '-' if reverse else ''
+        return [prefix + field for field in self.ordering]
+
+    def get_keyset_filter(self, position, reverse):
+        """
+        Builds the lexicographic row comparison
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            term = Q(**{'%s__%s' % (field, lookup): position[index]})
+            for previous, value in zip(self.ordering[:index], position[:index]):
+                term &= Q(**{previous: value})
+            condition |= term
+        return condition
+
+    def get_position(self, instance):
+        """
+        Returns the ordering values of a model instance or of a values() row.
+        """
+        if isinstance(instance, dict):
+            return [instance[field] for field in self.ordering]
+        position = []
+        for field in self.ordering:
+            value = instance
+            for part in field.split('__'):
+                value = getattr(value, part)
+            position.append(value)
+        return position
+
+    def encode_cursor(self, position, reverse):
+        token = json.dumps(
+            {'p': [self.dump_value(value) for value in position], 'r': int(reverse)},
+            separators=(',', ':'))
+        token = urlsafe_b64encode(token.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        """
+        Returns the (position, reverse) tuple stored in the opaque cursor.
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(token.encode('ascii')).decode('ascii'))
+            position = data['p']
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def parse_position(self, position, model):
+        """
+        Converts the cursor values with their ordering field, a crafted
+        cursor is a 404 rather than an error of the query.
+        """
+        parsed = []
+        for field, value in zip(self.get_ordering_fields(model), position):
+            if value is None or not isinstance(value, (str, int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = field.to_python(value)
+            except (ValidationError, TypeError, ValueError, OverflowError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None or isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                raise NotFound(self.invalid_cursor_message)
+            if settings.USE_TZ and hasattr(value, 'utcoffset') and timezone.is_naive(value):
+                value = timezone.make_aware(value, timezone.utc)
+            parsed.append(value)
+        return parsed
+
+    def get_ordering_fields(self, model):
+        """
+        Returns the model fields of the ordering, following the relations.
+        """
+        fields = []
+        for name in self.ordering:
+            opts = model._meta
+            for part in name.split('__'):
+                field = opts.pk if part == 'pk' else opts.get_field(part)
+                if field.is_relation:
+                    opts = field.related_model._meta
+            if field.is_relation:
+                field = field.target_field
+            fields.append(field)
+        return fields
+
+    def dump_value(self, value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+
+class RankedPagination(PageSizePagination):
+    """
+    Page number pagination over an id list ranked by an index
+    (e.g. core.search). The ranking query itself does the LIMIT/OFFSET,
+    only the ids of the requested page ever leave the database.
+    """
+    page_query_param = 'page'
+    invalid_page_message = _('Invalid page')
+    # Offsets past this are refused, larger ones overflow the database integers
+    max_offset = 2 ** 31
+
+    def paginate_ids(self, fetch_ids, request):
+        """
+        fetch_ids(limit, offset) must return the ranked ids of that window.
+        """
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+        try:
+            self.number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.number - 1) * self.limit
+        if self.number < 1 or offset > self.max_offset:
+            raise NotFound(self.invalid_page_message)
+
+        ids = fetch_ids(self.limit + 1, offset)
+        self.has_next = len(ids) > self.limit
+        return ids[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.number <= 1:
+            return None
+        if self.number == 2:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, self.number - 1)
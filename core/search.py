@@ -0,0 +1,171 @@
+"""
+Full-text search over Ngo name, purpose and description.
+
+The inverted index lives next to core_ngo and is kept current from the
+Ngo post_save / post_delete signals (see core.signals):
++ SQLite: an FTS5 virtual table ranked with bm25()
++ PostgreSQL: a tsvector table with a GIN index ranked with ts_rank()
+Any other database falls back to an unranked icontains scan.
+The index is written on the database of the Ngo (the `using` of the
+signals) and searched on the database the router reads Ngos from.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models import Q
+
+
+SQLITE_TABLE = 'core_ngo_fts'
+POSTGRES_TABLE = 'core_ngo_search'
+
+# Column weights: a match in the name counts more than one in the description
+SQLITE_WEIGHTS = (10.0, 2.0, 1.0)
+
+MAX_IDS_PER_QUERY = 500
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """
+    Splits the raw user query into search terms.
+    Operators are never passed through, the terms are ANDed.
+    """
+    return TOKEN_RE.findall(query or '')
+
+
+def _fts5_query(terms):
+    return ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def create_index(schema_editor=None, using=DEFAULT_DB_ALIAS):
+    """
+    Creates the index table for the database vendor.
+    """
+    cursor_source = schema_editor.connection if schema_editor else connections[using]
+    with cursor_source.cursor() as cursor:
+        if cursor_source.vendor == 'sqlite':
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+                "name, purpose, description, tokenize='porter unicode61')" % SQLITE_TABLE)
+        elif cursor_source.vendor == 'postgresql':
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS %s ("
+                "ngo_id integer PRIMARY KEY REFERENCES core_ngo (id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)" % POSTGRES_TABLE)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS %s_document_gin ON %s USING GIN (document)"
+                % (POSTGRES_TABLE, POSTGRES_TABLE))
+
+
+def drop_index(schema_editor=None, using=DEFAULT_DB_ALIAS):
+    cursor_source = schema_editor.connection if schema_editor else connections[using]
+    with cursor_source.cursor() as cursor:
+        if cursor_source.vendor == 'sqlite':
+            cursor.execute('DROP TABLE IF EXISTS %s' % SQLITE_TABLE)
+        elif cursor_source.vendor == 'postgresql':
+            cursor.execute('DROP TABLE IF EXISTS %s' % POSTGRES_TABLE)
+
+
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', purpose), 'B') || "
+    "setweight(to_tsvector('english', description), 'C')"
+)
+
+
+def index_ngos(ngo_ids=None, using=DEFAULT_DB_ALIAS):
+    """
+    (Re)indexes the given Ngo ids, or the whole table when ngo_ids is None.
+    The documents are built from core_ngo in a single statement.
+    """
+    if ngo_ids is not None:
+        ngo_ids = list(ngo_ids)
+        # Stay below the bound parameter limit of the database
+        for start in range(0, len(ngo_ids), MAX_IDS_PER_QUERY):
+            _index_ngos(ngo_ids[start:start + MAX_IDS_PER_QUERY], using)
+    else:
+        _index_ngos(None, using)
+
+
+def _index_ngos(ngo_ids, using):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            if ngo_ids is None:
+                cursor.execute('DELETE FROM %s' % SQLITE_TABLE)
+                where, params = '', []
+            else:
+                placeholders = ', '.join(['%s'] * len(ngo_ids))
+                cursor.execute(
+                    'DELETE FROM %s WHERE rowid IN (%s)' % (SQLITE_TABLE, placeholders), ngo_ids)
+                where, params = ' WHERE id IN (%s)' % placeholders, ngo_ids
+            cursor.execute(
+                'INSERT INTO %s (rowid, name, purpose, description) '
+                'SELECT id, name, purpose, description FROM core_ngo%s' % (SQLITE_TABLE, where),
+                params)
+        elif connection.vendor == 'postgresql':
+            if ngo_ids is None:
+                where, params = '', []
+            else:
+                where, params = ' WHERE id = ANY(%s)', [ngo_ids]
+            cursor.execute(
+                'INSERT INTO %s (ngo_id, document) SELECT id, %s FROM core_ngo%s '
+                'ON CONFLICT (ngo_id) DO UPDATE SET document = EXCLUDED.document'
+                % (POSTGRES_TABLE, POSTGRES_DOCUMENT, where),
+                params)
+
+
+def index_ngo(ngo, using=DEFAULT_DB_ALIAS):
+    index_ngos([ngo.pk], using)
+
+
+def unindex_ngo(ngo_id, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % SQLITE_TABLE, [ngo_id])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('DELETE FROM %s WHERE ngo_id = %%s' % POSTGRES_TABLE, [ngo_id])
+
+
+def search_ngo_ids(query, limit, offset=0, using=None):
+    """
+    Returns the ids of the Ngos matching every term of query, best match first.
+    """
+    from core.models import Ngo
+    terms = tokenize(query)
+    if not terms:
+        return []
+    connection = connections[using or router.db_for_read(Ngo)]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY bm25({table}, {weights}), rowid LIMIT %s OFFSET %s'.format(
+                    table=SQLITE_TABLE, weights=', '.join(map(str, SQLITE_WEIGHTS))),
+                [_fts5_query(terms), limit, offset])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT ngo_id FROM {table}, plainto_tsquery('english', %s) query "
+                "WHERE document @@ query "
+                "ORDER BY ts_rank(document, query) DESC, ngo_id LIMIT %s OFFSET %s".format(
+                    table=POSTGRES_TABLE),
+                [' '.join(terms), limit, offset])
+        else:
+            return scan_ngo_ids(query, limit, offset, connection.alias)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def scan_ngo_ids(query, limit, offset=0, using=None):
+    """
+    Unindexed icontains scan over the table, the fallback and benchmark baseline.
+    """
+    # Imported here so that migrations can use this module
+    from core.models import Ngo
+    queryset = Ngo.objects.using(using)
+    for term in tokenize(query):
+        queryset = queryset.filter(
+            Q(name__icontains=term) | Q(purpose__icontains=term) | Q(description__icontains=term))
+    return list(queryset.order_by('id').values_list('id', flat=True)[offset:offset + limit])
@@ -1,7 +1,9 @@
 from rest_framework import serializers
-from core.models import Ngo, Ngo_Verification, Ngo_Detail
+from core.metrics import TimedSerializerMixin
+from core.models import Ngo, Ngo_Verification, Ngo_Detail, Verification_Event, Verification_Job
+from core.validation import ValidatedSerializerMixin
 
-class NgoSerializer(serializers.ModelSerializer):
+class NgoSerializer(ValidatedSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the Class Ngo
     """
@@ -21,7 +23,7 @@ class NgoSerializer(serializers.ModelSerializer):
             )
 
 
-class Ngo_VerificationSerializer(serializers.ModelSerializer):
+class Ngo_VerificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the Class Ngo_Verification
     """
@@ -31,11 +33,13 @@ class Ngo_VerificationSerializer(serializers.ModelSerializer):
             'verified_phone_primary',
             'verified_phone_secondary',
             'v_email',
-            'v_website'
+            'v_website',
+            'is_fully_verified',
             )
+        read_only_fields = ('is_fully_verified',)
 
 
-class Ngo_DetailSerializer(serializers.ModelSerializer):
+class Ngo_DetailSerializer(ValidatedSerializerMixin, TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the Class Ngo_Detail
     """
@@ -51,3 +55,58 @@ class Ngo_DetailSerializer(serializers.ModelSerializer):
             'legal_status',
             'overhead_cost',
             )
+
+
+class NgoProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Read only serializer for the Class Ngo with its verification and detail nested.
+    Expects the relations to be fetched with select_related(), see NgoProfileViewSet.
+    """
+    verification = Ngo_VerificationSerializer(source='Verification', read_only=True)
+    detail = Ngo_DetailSerializer(read_only=True)
+    created_by = serializers.SlugRelatedField(slug_field='username', read_only=True)
+    modified_by = serializers.SlugRelatedField(slug_field='username', read_only=True)
+
+    class Meta:
+        model = Ngo
+        fields = ('id', 'created_at', 'created_by', 'modified_by') + NgoSerializer.Meta.fields + (
+            'verification',
+            'detail',
+            )
+        read_only_fields = fields
+
+
+class Verification_JobSerializer(serializers.ModelSerializer):
+    """
+    Read only serializer for the Class Verification_Job
+    """
+    class Meta:
+        model = Verification_Job
+        fields = (
+            'id',
+            'kind',
+            'status',
+            'attempts',
+            'run_after',
+            'last_error',
+            'created_at',
+            'modified_at',
+            )
+        read_only_fields = fields
+
+
+class Verification_EventSerializer(serializers.ModelSerializer):
+    """
+    Read only serializer for the Class Verification_Event
+    """
+    user = serializers.SlugRelatedField(slug_field='username', read_only=True)
+
+    class Meta:
+        model = Verification_Event
+        fields = (
+            'field',
+            'event',
+            'user',
+            'created_at',
+            )
+        read_only_fields = fields
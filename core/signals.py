@@ -0,0 +1,110 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core import cache, changes, duplicates, facets, geo, search
+from core.models import Ngo, Ngo_Detail, Ngo_Verification, verification_completed
+
+
+@receiver(post_save, sender=Ngo)
+def ngo_saved(sender, instance, raw=False, using=None, **kwargs):
+    """
+    Keeps the full-text search index current.
+    """
+    if raw:
+        return
+    search.index_ngo(instance, using=using)
+
+
+@receiver(post_delete, sender=Ngo)
+def ngo_deleted(sender, instance, using=None, **kwargs):
+    search.unindex_ngo(instance.pk, using=using)
+
+
+@receiver(post_save, sender=Ngo)
+def ngo_signature_saved(sender, instance, created=False, raw=False, using=None, **kwargs):
+    """
+    Keeps the keys of the duplicate detection current, see core.duplicates.
+    Deleted with the Ngo.
+    """
+    if raw:
+        return
+    duplicates.index_ngo(instance, created=created, using=using)
+
+
+@receiver(post_save, sender=Ngo)
+def ngo_place_saved(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Keeps the Ngo counts of the places current, see core.geo.
+    """
+    if raw:
+        return
+    # Instances not loaded from the database are taken as not moved
+    stored = None if created else getattr(instance, '_stored_place_id', instance.place_id)
+    geo.apply_change(stored, instance.place_id)
+    instance._stored_place_id = instance.place_id
+
+
+@receiver(post_delete, sender=Ngo)
+def ngo_place_deleted(sender, instance, **kwargs):
+    geo.apply_change(instance.place_id, None)
+
+
+@receiver(pre_save, sender=Ngo)
+@receiver(pre_save, sender=Ngo_Detail)
+def facet_source_saving(sender, instance, raw=False, **kwargs):
+    """
+    Remembers the stored facet values to adjust the counts after the save.
+    """
+    instance._stored_facet_values = {} if raw else facets.stored_facet_values(instance)
+
+
+@receiver(post_save, sender=Ngo)
+@receiver(post_save, sender=Ngo_Detail)
+def facet_source_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    facets.apply_change(instance.__dict__.pop('_stored_facet_values', {}), facets.facet_values(instance))
+
+
+@receiver(post_delete, sender=Ngo)
+@receiver(post_delete, sender=Ngo_Detail)
+def facet_source_deleted(sender, instance, **kwargs):
+    facets.apply_change(facets.facet_values(instance), {})
+
+
+@receiver(post_save, sender=Ngo)
+@receiver(post_save, sender=Ngo_Verification)
+@receiver(post_save, sender=Ngo_Detail)
+@receiver(post_delete, sender=Ngo)
+@receiver(post_delete, sender=Ngo_Verification)
+@receiver(post_delete, sender=Ngo_Detail)
+def record_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached responses built from the record.
+    """
+    cache.invalidate(cache.record_tags(instance))
+
+
+@receiver(post_save, sender=Ngo)
+@receiver(post_save, sender=Ngo_Verification)
+@receiver(post_save, sender=Ngo_Detail)
+def change_saved(sender, instance, created=False, using=None, **kwargs):
+    """
+    Appends the change to the change feed, fixtures included.
+    """
+    changes.record(instance, adding=created, using=using)
+
+
+@receiver(post_delete, sender=Ngo)
+@receiver(post_delete, sender=Ngo_Verification)
+@receiver(post_delete, sender=Ngo_Detail)
+def change_deleted(sender, instance, using=None, **kwargs):
+    changes.record(instance, deleted=True, using=using)
+
+
+@receiver(verification_completed)
+def verification_completed_detail(sender, instance, **kwargs):
+    """
+    Opens the details of a fully verified Ngo, to be filled by the Ngo.
+    """
+    Ngo_Detail.objects.get_or_create(ngo_id=instance.ngo_id, defaults={'overhead_cost': 0})
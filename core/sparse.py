@@ -0,0 +1,127 @@
+"""
+Sparse fieldsets of the read endpoints.
+
+?fields=name,location_city returns only these fields of every record,
+?exclude=description,purpose all the others; both can be combined. The
+serializer drops the other fields and the query reads only the columns
+of the fields left: only() on the queryset, and the values() columns on
+the fast list path (see core.fast). The primary key and the pagination
+ordering are always read. Unknown field names are a 400. A sparse
+representation has its own ETag, and its own entry in the response cache
+(the key holds the query string).
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.http import quote_etag
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import ListSerializer
+
+
+_readable_fields = {}
+
+
+def readable_fields(serializer_class):
+    """
+    Returns {name: source} of the fields serializer_class outputs.
+    """
+    if serializer_class not in _readable_fields:
+        _readable_fields[serializer_class] = {
+            name: field.source for name, field in serializer_class().fields.items() if not field.write_only}
+    return _readable_fields[serializer_class]
+
+
+def parse_names(raw):
+    """
+    Returns the names of a comma separated list, or None when not given.
+    """
+    if raw is None:
+        return None
+    return [name.strip() for name in raw.split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Adds ?fields= and ?exclude= to the GET requests of the sparse_actions.
+    """
+    sparse_actions = ('list', 'retrieve')
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def get_sparse_fields(self):
+        """
+        Returns the names of the serializer fields to output, or None for all of them.
+        """
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = self._parse_sparse_fields()
+        return self._sparse_fields
+
+    def _parse_sparse_fields(self):
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None
+        if getattr(self, 'action', None) not in self.sparse_actions:
+            return None
+        requested = parse_names(request.query_params.get(self.fields_query_param))
+        excluded = parse_names(request.query_params.get(self.exclude_query_param))
+        if requested is None and excluded is None:
+            return None
+        available = readable_fields(self.get_serializer_class())
+        errors = {}
+        for param, names in ((self.fields_query_param, requested), (self.exclude_query_param, excluded)):
+            unknown = [name for name in names or () if name not in available]
+            if unknown:
+                errors[param] = 'Unknown field(s) %s, expected some of %s.' % (
+                    ', '.join(unknown), ', '.join(available))
+        if errors:
+            raise ValidationError(errors)
+        return [
+            name for name in available
+            if (requested is None or name in requested) and name not in (excluded or ())
+        ]
+
+    def get_sparse_columns(self):
+        """
+        Returns the model fields to load for the sparse fields, or None to
+        load them all (a field is not a column of the model).
+        """
+        names = self.get_sparse_fields()
+        if names is None:
+            return None
+        sources = readable_fields(self.get_serializer_class())
+        opts = self.queryset.model._meta
+        columns = []
+        for source in [sources[name] for name in names] + list(getattr(self, 'keyset_ordering', ())):
+            try:
+                field = opts.get_field(source)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.many_to_many:
+                return None
+            columns.append(source)
+        return columns or ['pk']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        columns = self.get_sparse_columns()
+        return queryset if columns is None else queryset.only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        names = self.get_sparse_fields()
+        if names is not None:
+            fields = serializer.child.fields if isinstance(serializer, ListSerializer) else serializer.fields
+            for name in [name for name in fields if name not in names]:
+                fields.pop(name)
+        return serializer
+
+    def get_compiled_serializer(self):
+        compiled = super().get_compiled_serializer()
+        names = self.get_sparse_fields()
+        return compiled if compiled is None or names is None else compiled.select(names)
+
+    def get_validators(self):
+        etag, last_modified = super().get_validators()
+        names = self.get_sparse_fields()
+        if names is not None:
+            # Another representation of the record, another strong ETag
+            etag = quote_etag('%s;%s' % (etag.strip('"'), '+'.join(names)))
+        return etag, last_modified
@@ -1,3 +1,1238 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core import benchmark, db, duplicates, export, facets, fast, geo, importer, jobs, search, throttling, validation, verification
+from core.audit import acting_as, get_current_user
+from core.cache import LRUCache, response_cache
+from core.db import replicas
+from core.models import Ngo, Ngo_Detail, Ngo_Verification, Verification_Job
+from core.serializers import NgoProfileSerializer, NgoSerializer
+from core.views import NgoViewSet
+
+
+@override_settings(
+    NGO_HUB_THROTTLE_STORE='core.throttling.LocalStore', NGO_HUB_THROTTLE_STORE_OPTIONS={},
+    NGO_HUB_RESPONSE_CACHE=False)
+class ApiTestCase(TestCase):
+    """
+    Requests of an authenticated user, throttled in memory, without the response cache.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('member', 'member@example.org', 'secret-password')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        throttling.get_store().clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % self.token.key)
+
+
+def ngo_data(index, **fields):
+    """
+    Returns the POST data of a valid Ngo, distinct for every index.
+    """
+    data = {
+        'name': 'Helping Hands %s' % ''.join(chr(ord('a') + int(digit)) for digit in str(index)),
+        'purpose': 'Feeding the children of the city and teaching them to read and write.',
+        'description': ' '.join(['Volunteers cook and serve meals every day of the week.'] * 7),
+        'location_city': 'Pune',
+        'location_state': 'Maharashtra',
+        'location_country': 'India',
+        'phone_primary': '20%08d' % index,
+        'phone_secondary': '30%08d' % index,
+        'email': 'ngo%d@example.org' % index,
+        'website': 'https://ngo%d.example.org' % index,
+    }
+    data.update(fields)
+    return data
+
+
+def cursor(position, reverse=False):
+    token = json.dumps({'p': position, 'r': int(reverse)}).encode('ascii')
+    return urlsafe_b64encode(token).decode('ascii')
+
+
+class KeysetPaginationTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ids = benchmark.seed_ngos(7, user=cls.user)
+
+    def list_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [ngo['id'] for ngo in response.data['results']], response.data
+
+    def test_pages_follow_each_other(self):
+        ids, data = self.list_ids('/core/ngo_profile/?page_size=3')
+        seen = list(ids)
+        self.assertIsNone(data['previous'])
+        while data['next']:
+            ids, data = self.list_ids(data['next'])
+            seen.extend(ids)
+        self.assertEqual(seen, self.ids)
+
+    def test_previous_link_returns_the_previous_page(self):
+        first, data = self.list_ids('/core/ngo_profile/?page_size=3')
+        second, data = self.list_ids(data['next'])
+        previous, data = self.list_ids(data['previous'])
+        self.assertEqual(previous, first)
+        self.assertEqual(second, self.ids[3:6])
+
+    def test_invalid_cursors_are_not_found(self):
+        ngo = self.client.get('/core/ngo_profile/?page_size=1').data['results'][0]
+        cursors = [
+            'not base64!',
+            cursor([ngo['created_at']]),
+            cursor(['garbage', 1]),
+            cursor([{'a': 1}, 1]),
+            cursor([None, 1]),
+            cursor([[ngo['created_at']], 1]),
+            cursor([ngo['created_at'], 'x']),
+            cursor([ngo['created_at'], 10 ** 30]),
+            cursor([5, 1]),
+        ]
+        for token in cursors:
+            with self.subTest(cursor=token):
+                response = self.client.get('/core/ngo_profile/', {'cursor': token})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_naive_cursor_dates_are_read_as_utc(self):
+        data = self.client.get('/core/ngo_profile/?page_size=2').data
+        last = data['results'][-1]
+        naive = last['created_at'].replace('Z', '').split('+')[0]
+        following, data = self.list_ids('/core/ngo_profile/?page_size=2&cursor=%s' % cursor([naive, last['id']]))
+        self.assertEqual(following, self.ids[2:4])
+
+
+class NgoProfileTests(ApiTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ids = benchmark.seed_ngos(60, user=cls.user)
+        # Half of the Ngos have their details
+        benchmark.seed_details(ids[::2])
+
+    def test_list_query_count_does_not_grow_with_the_page(self):
+        # Resolves the token once, later requests find it in the token cache
+        self.client.get('/core/ngo_profile/?page_size=1')
+        for page_size in (1, 10, 50):
+            with self.subTest(page_size=page_size), self.assertNumQueries(1):
+                response = self.client.get('/core/ngo_profile/', {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+            self.assertEqual(
+                [ngo['detail'] is None for ngo in response.data['results']],
+                [index % 2 == 1 for index in range(page_size)])
+
+
+class ConditionalRequestTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.assertEqual(self.client.post('/core/ngo/', ngo_data(1)).status_code, 201)
+        self.ngo = Ngo.objects.get()
+        self.url = '/core/ngo/%d/' % self.ngo.pk
+
+    def test_retrieve_sends_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"ngo-%d-1"' % self.ngo.pk)
+        self.assertIn('Last-Modified', response)
+
+    def test_matching_if_none_match_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='W/%s' % etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_update_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'name': 'Helping Hands Pune'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"ngo-%d-2"' % self.ngo.pk)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_stale_if_match_is_a_precondition_failure(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.patch(self.url, {'name': 'Helping Hands Pune'})
+        response = self.client.patch(self.url, {'name': 'Helping Hands Mumbai'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response['ETag'], '"ngo-%d-2"' % self.ngo.pk)
+        self.assertEqual(Ngo.objects.get().name, 'Helping Hands Pune')
+
+    def test_concurrent_saves_get_distinct_versions(self):
+        # Both read version 1 before either saves
+        first, second = Ngo.objects.get(), Ngo.objects.get()
+        first.name = 'Helping Hands Pune'
+        first.save()
+        second.name = 'Helping Hands Mumbai'
+        second.save()
+        self.assertEqual((first.version, second.version), (2, 3))
+        verification = Ngo_Verification.objects.get()
+        stale = Ngo_Verification.objects.get()
+        verification.v_email = True
+        verification.save()
+        stale.v_website = True
+        stale.save(update_fields=['v_website', 'modified_at', 'version'])
+        self.assertEqual(Ngo_Verification.objects.get().version, 3)
+        benchmark.seed_details([self.ngo.pk])
+        detail, stale = Ngo_Detail.objects.get(), Ngo_Detail.objects.get()
+        detail.save()
+        stale.save()
+        self.assertEqual(Ngo_Detail.objects.get().version, 3)
+
+
+class SearchTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/core/ngo/', ngo_data(1, name='Clean River Trust'))
+        self.client.post('/core/ngo/', ngo_data(2, name='River Children Home'))
+
+    def test_search_ranks_the_name_matches(self):
+        response = self.client.get('/core/ngo/search/', {'q': 'clean river'})
+        self.assertEqual([ngo['name'] for ngo in response.data['results']], ['Clean River Trust'])
+        response = self.client.get('/core/ngo/search/', {'q': 'river'})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_search_index_follows_updates_and_deletes(self):
+        ngo = Ngo.objects.get(name='Clean River Trust')
+        ngo.name = 'Clear Lake Trust'
+        ngo.save()
+        self.assertEqual(search.search_ngo_ids('clean', 10), [])
+        self.assertEqual(search.search_ngo_ids('lake', 10), [ngo.pk])
+        ngo.delete()
+        self.assertEqual(search.search_ngo_ids('lake', 10), [])
+
+    def test_pages_past_the_offset_limit_are_not_found(self):
+        response = self.client.get('/core/ngo/search/', {'q': 'river', 'page_size': 1, 'page': 2})
+        self.assertEqual(len(response.data['results']), 1)
+        for page in (0, 'x', 2 ** 62, 10 ** 20):
+            for url, params in (('/core/ngo/search/', {'q': 'river'}), ('/core/ngo/nearby/', {'lat': 18.5, 'lon': 73.8})):
+                with self.subTest(url=url, page=page):
+                    response = self.client.get(url, dict(params, page=page))
+                    self.assertEqual(response.status_code, 404)
+                    self.assertEqual(response.data['detail'], 'Invalid page')
+
+
+class ReplicaPinTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def test_clients_behind_one_address_are_pinned_apart(self):
+        writer = self.factory.post('/core/ngo/', HTTP_AUTHORIZATION='Token writer', REMOTE_ADDR='10.0.0.1')
+        reader = self.factory.get('/core/ngo/', HTTP_AUTHORIZATION='Token reader', REMOTE_ADDR='10.0.0.1')
+        replicas.pin(writer, HttpResponse())
+        self.assertTrue(replicas.is_pinned(self.factory.get('/core/ngo/', HTTP_AUTHORIZATION='Token writer')))
+        self.assertFalse(replicas.is_pinned(reader))
+
+    def test_session_clients_are_pinned_by_their_session(self):
+        writer = self.factory.post('/core/ngo/')
+        writer.COOKIES[settings.SESSION_COOKIE_NAME] = 'session-1'
+        reader = self.factory.get('/core/ngo/')
+        reader.COOKIES[settings.SESSION_COOKIE_NAME] = 'session-2'
+        response = HttpResponse()
+        replicas.pin(writer, response)
+        self.assertFalse(replicas.is_pinned(reader))
+        reader.COOKIES[settings.SESSION_COOKIE_NAME] = 'session-1'
+        self.assertTrue(replicas.is_pinned(reader))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_clients_without_credentials_have_no_keys(self):
+        self.assertEqual(replicas.client_keys(self.factory.get('/core/ngo/', REMOTE_ADDR='10.0.0.1')), [])
+
+
+@override_settings(NGO_HUB_RESPONSE_CACHE=True)
+class ReplicaCacheTests(ApiTestCase):
+    """
+    The reads of unpinned clients go to a replica, here the default database itself.
+    """
+
+    def setUp(self):
+        super().setUp()
+        response_cache().clear()
+        patches = [
+            mock.patch.object(replicas, 'replica_aliases', return_value=['replica']),
+            mock.patch.object(replicas.replicas, 'candidates', return_value=['replica']),
+            mock.patch.object(replicas.ReplicaRouter, 'db_for_read', return_value=None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_responses_read_from_a_replica_are_not_stored(self):
+        self.client.post('/core/ngo/', ngo_data(1))
+        reader = APIClient()
+        reader.force_authenticate(self.user)
+        self.assertEqual(reader.get('/core/ngo/')['X-Cache'], 'MISS')
+        self.assertEqual(reader.get('/core/ngo/')['X-Cache'], 'MISS')
+        # The writer is pinned to the default database, whose response is stored
+        self.assertEqual(self.client.get('/core/ngo/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/core/ngo/')['X-Cache'], 'HIT')
+        self.assertEqual(reader.get('/core/ngo/')['X-Cache'], 'HIT')
+
+
+class MetricsViewTests(TestCase):
+
+    def test_anonymous_clients_are_forbidden(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_staff_users_read_the_metrics(self):
+        user = get_user_model().objects.create_user('staff', 'staff@example.org', 'secret-password', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ngo_hub_requests_total', response.content.decode())
+
+    @override_settings(NGO_HUB_METRICS_TOKEN='scraper-token')
+    def test_the_token_bearer_reads_the_metrics(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper-token').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, 403)
+
+
+@override_settings(NGO_HUB_HTTP_CHECK_BACKEND='core.verification.LocmemHttpBackend')
+class VerificationJobTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/core/ngo/', ngo_data(1))
+        self.verification = Ngo_Verification.objects.get()
+
+    def test_website_check_verifies_the_website(self):
+        job, = jobs.enqueue(self.verification, ['website'])
+        self.assertEqual(jobs.work(worker='worker-1', burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Verification_Job.SUCCEEDED, ''))
+        self.assertTrue(Ngo_Verification.objects.get().v_website)
+
+    def test_temporary_errors_are_retried_later(self):
+        job, = jobs.enqueue(self.verification, ['website'])
+        with self.settings(NGO_HUB_HTTP_CHECK_RESPONSES={'https://ngo1.example.org': 503}):
+            jobs.work(worker='worker-1', burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Verification_Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('503', job.last_error)
+
+    def test_outcome_of_an_expired_lease_is_dropped(self):
+        job, = jobs.enqueue(self.verification, ['website'])
+        stale = jobs.claim('worker-1')
+        # The lease of worker-1 runs out, worker-2 claims the job again
+        Verification_Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(
+            seconds=settings.NGO_HUB_VERIFICATION_LEASE_SECONDS + 1))
+        self.assertEqual(jobs.claim('worker-2').pk, job.pk)
+        with self.assertLogs('core.jobs', 'WARNING'):
+            jobs.run(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), (Verification_Job.RUNNING, 'worker-2', 2))
+        # The flag is left to worker-2
+        self.assertFalse(Ngo_Verification.objects.get().v_website)
+
+    @override_settings(NGO_HUB_SMS_BACKEND='core.verification.LocmemSmsBackend')
+    def test_no_sms_is_sent_once_the_lease_ran_out(self):
+        verification.LocmemSmsBackend.outbox = []
+        job, = jobs.enqueue(self.verification, ['phone_primary'])
+        stale = jobs.claim('worker-1')
+        # Not claimed again yet, but it can be at any time
+        Verification_Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(
+            seconds=settings.NGO_HUB_VERIFICATION_LEASE_SECONDS + 1))
+        stale.locked_at = Verification_Job.objects.get(pk=job.pk).locked_at
+        with self.assertLogs('core.jobs', 'WARNING'):
+            jobs.run(stale)
+        self.assertEqual(verification.LocmemSmsBackend.outbox, [])
+        self.assertEqual(jobs.work(worker='worker-2', burst=True), 1)
+        self.assertEqual(len(verification.LocmemSmsBackend.outbox), 1)
+        self.assertEqual(Verification_Job.objects.get().status, Verification_Job.WAITING)
+
+    def test_a_field_has_one_active_job(self):
+        first, = jobs.enqueue(self.verification, ['website'])
+        self.assertEqual([job.pk for job in jobs.enqueue(self.verification, ['website', 'email'])][0], first.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Verification_Job.objects.create(verification=self.verification, kind='website', domain='ngo1.example.org')
+        jobs.work(worker='worker-1', burst=True)
+        self.assertNotEqual(jobs.enqueue(self.verification, ['website'])[0].pk, first.pk)
+
+
+class RedirectingHandler(BaseHTTPRequestHandler):
+    """
+    /private redirects to a private address, /hop to /ok, /ok records its Host header.
+    """
+    hosts = []
+
+    def do_HEAD(self):
+        locations = {'/private': 'http://10.0.0.1/', '/hop': '/ok', '/loop': '/loop'}
+        if self.path in locations:
+            self.send_response(302)
+            self.send_header('Location', locations[self.path])
+        else:
+            self.hosts.append(self.headers['Host'])
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LoopbackHttpBackend(verification.HttpClientBackend):
+    """
+    Allows the test server, every other address is refused.
+    """
+    def is_allowed(self, address):
+        return address == '127.0.0.1'
+
+
+class HttpCheckBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        server = HTTPServer(('127.0.0.1', 0), RedirectingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.port = server.server_port
+        RedirectingHandler.hosts = []
+        self.backend = LoopbackHttpBackend()
+
+    def test_redirects_are_followed(self):
+        self.assertEqual(self.backend.status('http://127.0.0.1:%d/hop' % self.port, 5), 200)
+        self.assertEqual(RedirectingHandler.hosts, ['127.0.0.1:%d' % self.port])
+
+    def test_every_hop_is_checked(self):
+        with self.assertRaisesMessage(verification.CheckFailed, '10.0.0.1 is not a public address'):
+            self.backend.status('http://127.0.0.1:%d/private' % self.port, 5)
+        with self.assertRaises(verification.CheckFailed):
+            self.backend.status('http://127.0.0.1:%d/loop' % self.port, 5)
+
+    def test_the_checked_address_is_connected_to(self):
+        resolve = socket.getaddrinfo
+        answers = iter(['127.0.0.1', '10.0.0.1'])
+
+        def rebinding_getaddrinfo(host, *args, **kwargs):
+            # The second lookup of the name would point to a private address
+            return resolve(next(answers) if host == 'ngo.test' else host, *args, **kwargs)
+
+        with mock.patch('socket.getaddrinfo', rebinding_getaddrinfo):
+            self.assertEqual(self.backend.status('http://ngo.test:%d/ok' % self.port, 5), 200)
+        self.assertEqual(RedirectingHandler.hosts, ['ngo.test:%d' % self.port])
+
+    def test_private_addresses_are_refused(self):
+        backend = verification.HttpClientBackend()
+        for url in ('http://127.0.0.1:%d/ok' % self.port, 'http://169.254.169.254/', 'file:///etc/passwd'):
+            with self.subTest(url=url), self.assertRaises(verification.CheckFailed):
+                backend.status(url, 5)
+        self.assertEqual(RedirectingHandler.hosts, [])
+
+
+class GcraTests(SimpleTestCase):
+
+    def test_burst_then_one_request_per_interval(self):
+        tat = None
+        for remaining in (2, 1, 0):
+            decision, tat = throttling.gcra(tat, 100.0, 10.0, 3)
+            self.assertEqual((decision.allowed, decision.remaining), (True, remaining))
+        decision, tat = throttling.gcra(tat, 100.0, 10.0, 3)
+        self.assertEqual((decision.allowed, decision.reset), (False, 10.0))
+        decision, tat = throttling.gcra(tat, 110.0, 10.0, 3)
+        self.assertTrue(decision.allowed)
+        self.assertEqual(throttling.gcra(tat, 110.0, 10.0, 3)[0].allowed, False)
+
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('50/minute'), (50, 60))
+        self.assertEqual(throttling.parse_rate('100/10m'), (100, 600))
+
+
+class SQLiteStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = throttling.SQLiteStore(os.path.join(directory.name, 'throttle.sqlite3'), timeout=0.05)
+        self.addCleanup(lambda: self.store.connection().close())
+
+    def test_decisions_are_stored(self):
+        self.assertTrue(self.store.hit('client', 100.0, 10.0, 1).allowed)
+        self.assertFalse(self.store.hit('client', 101.0, 10.0, 1).allowed)
+        self.assertTrue(self.store.hit('other', 101.0, 10.0, 1).allowed)
+
+    def test_locked_file_lets_the_request_through(self):
+        self.store.hit('client', 100.0, 10.0, 1)
+        other = sqlite3.connect(self.store.path, isolation_level=None)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        self.assertEqual(self.store.hit('client', 101.0, 10.0, 1), throttling.Decision(True, 0, 0.0))
+        self.assertFalse(self.store.connection().in_transaction)
+        other.execute('ROLLBACK')
+        self.assertFalse(self.store.hit('client', 101.0, 10.0, 1).allowed)
+
+
+class ThrottleTests(ApiTestCase):
+
+    @override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'user': '2/minute'}))
+    def test_requests_beyond_the_rate_are_refused(self):
+        for remaining in ('1', '0'):
+            response = self.client.get('/core/ngo/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['RateLimit-Remaining'], remaining)
+        response = self.client.get('/core/ngo/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(response['RateLimit-Policy'], '2;w=60;burst=2')
+
+
+class IdempotencyTests(ApiTestCase):
+
+    def test_retries_replay_the_first_response(self):
+        first = self.client.post('/core/ngo/', ngo_data(1), HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.post('/core/ngo/', ngo_data(1), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(Ngo.objects.count(), 1)
+
+    def test_a_key_reused_for_another_request_is_refused(self):
+        self.client.post('/core/ngo/', ngo_data(1), HTTP_IDEMPOTENCY_KEY='key-1')
+        response = self.client.post('/core/ngo/', ngo_data(2), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Ngo.objects.count(), 1)
+
+    def test_keys_belong_to_their_user(self):
+        self.client.post('/core/ngo/', ngo_data(1), HTTP_IDEMPOTENCY_KEY='key-1')
+        other = get_user_model().objects.create_user('other', 'other@example.org', 'secret-password')
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=other).key)
+        response = self.client.post('/core/ngo/', ngo_data(2), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Ngo.objects.count(), 2)
+
+    def test_failures_are_not_stored(self):
+        response = self.client.post('/core/ngo/', ngo_data(1, name='1'), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/core/ngo/', ngo_data(1), HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_long_keys_are_refused(self):
+        response = self.client.post('/core/ngo/', ngo_data(1), HTTP_IDEMPOTENCY_KEY='k' * 256)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Ngo.objects.exists())
+
+
+class ValidationTests(ApiTestCase):
+
+    def test_all_the_errors_are_reported_at_once(self):
+        response = self.client.post('/core/ngo/', ngo_data(
+            1, name='Hands 4 All', purpose='Too short', phone_primary='+91 20 1234', location_city='Pune 1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            set(response.data), {'name', 'purpose', 'phone_primary', 'location_city'})
+        self.assertFalse(Ngo.objects.exists())
+
+    def test_locations_are_upper_cased(self):
+        self.client.post('/core/ngo/', ngo_data(1, location_city='Navi  Mumbai', location_state='maharashtra'))
+        ngo = Ngo.objects.get()
+        self.assertEqual((ngo.location_city, ngo.location_state), ('NAVI  MUMBAI', 'MAHARASHTRA'))
+
+    def test_detail_choices_are_checked(self):
+        self.client.post('/core/ngo/', ngo_data(1))
+        ngo = Ngo.objects.get()
+        data = {
+            'ngo': ngo.pk, 'orientation': 'X', 'level': 'X', 'activity': 'X', 'staffing': 'X',
+            'fund': 'X', 'fund_acceptance_from': 'X', 'legal_status': 'X', 'overhead_cost': 10,
+        }
+        response = self.client.post('/core/ngo_detail/', data)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Ngo_Detail.objects.exists())
+
+    def test_character_classes(self):
+        self.assertTrue(validation.isalphaspace('Helping\tHands  Trust'))
+        self.assertTrue(validation.isalphaspace('Aide à Enfance'))
+        self.assertFalse(validation.isalphaspace('Hands 4 All'))
+        self.assertTrue(validation.isnumeric(''))
+        self.assertFalse(validation.isnumeric('+9120'))
+
+
+class VerificationStateTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/core/ngo/', ngo_data(1))
+        self.verification = Ngo_Verification.objects.get()
+        self.url = '/core/ngo_verification/%d/' % self.verification.pk
+
+    def events(self):
+        return [(event['event'], event['field']) for event in self.client.get(self.url + 'events/').data]
+
+    def test_verifying_every_field_completes_the_verification(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, {'verified_phone_primary': True, 'v_email': True})
+        self.assertFalse(self.client.get(self.url).data['is_fully_verified'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'verified_phone_secondary': True, 'v_website': True})
+        self.assertTrue(response.data['is_fully_verified'])
+        self.assertEqual(self.events(), [
+            ('verified', 'verified_phone_primary'), ('verified', 'v_email'),
+            ('verified', 'verified_phone_secondary'), ('verified', 'v_website'), ('completed', '')])
+        # verification_completed gives the Ngo its details
+        self.assertTrue(Ngo_Detail.objects.filter(ngo_id=self.verification.ngo_id).exists())
+
+    def test_revoking_a_field_reopens_the_verification(self):
+        flags = dict.fromkeys(Ngo_Verification.FLAGS, True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, flags)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'v_website': False})
+        self.assertFalse(response.data['is_fully_verified'])
+        self.assertEqual(self.events()[-2:], [('revoked', 'v_website'), ('reopened', '')])
+
+    def test_saves_of_instances_not_loaded_log_their_events(self):
+        # Built with the pk of the stored record, not loaded from it
+        built = Ngo_Verification(pk=self.verification.pk, ngo_id=self.verification.ngo_id, v_email=True)
+        built.save()
+        partial = Ngo_Verification.objects.only('pk').get()
+        partial.v_website = True
+        partial.save(update_fields=['v_website', 'modified_at', 'version'])
+        self.assertEqual(self.events(), [('verified', 'v_email'), ('verified', 'v_website')])
+        stored = Ngo_Verification.objects.get()
+        self.assertEqual((stored.v_email, stored.v_website, stored.version), (True, True, 3))
+
+    def test_saves_changing_no_flag_log_nothing(self):
+        self.client.patch(self.url, {'v_email': False})
+        self.assertEqual(self.events(), [])
+
+    def test_is_fully_verified_is_read_only(self):
+        response = self.client.patch(self.url, {'is_fully_verified': True})
+        self.assertFalse(response.data['is_fully_verified'])
+
+
+class ChangeFeedTests(ApiTestCase):
+
+    def changes(self, since=0, **params):
+        response = self.client.get('/core/changes/', dict(params, since=since))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_changes_follow_the_writes(self):
+        self.client.post('/core/ngo/', ngo_data(1))
+        ngo = Ngo.objects.get()
+        data = self.changes()
+        self.assertEqual([(change['model'], change['ngo']) for change in data['changes']], [
+            ('ngo', ngo.pk), ('ngo_verification', ngo.pk)])
+        self.assertEqual(data['changes'][0]['data']['name'], ngo.name)
+        seqs = [change['seq'] for change in data['changes']]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(data['last_seq'], seqs[-1])
+        self.assertEqual(self.changes(data['last_seq'])['changes'], [])
+
+        self.client.patch('/core/ngo/%d/' % ngo.pk, {'name': 'Helping Hands Pune'})
+        data = self.changes(data['last_seq'])
+        self.assertEqual([change['data']['name'] for change in data['changes']], ['Helping Hands Pune'])
+        # The update replaced the first change of the Ngo
+        self.assertEqual([change['model'] for change in self.changes()['changes']], ['ngo_verification', 'ngo'])
+
+    def test_deletes_leave_a_tombstone(self):
+        self.client.post('/core/ngo/', ngo_data(1))
+        ngo = Ngo.objects.get()
+        since = self.changes()['last_seq']
+        self.client.delete('/core/ngo/%d/' % ngo.pk)
+        data = self.changes(since)
+        self.assertEqual(
+            {(change['model'], change['deleted'], change['data']) for change in data['changes']},
+            {('ngo', True, None), ('ngo_verification', True, None)})
+
+    def test_batches(self):
+        for index in range(3):
+            self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(index))
+        first = self.changes(limit=4)
+        self.assertEqual((len(first['changes']), first['more']), (4, True))
+        rest = self.changes(first['last_seq'], limit=4)
+        self.assertEqual((len(rest['changes']), rest['more']), (2, False))
+
+    def test_invalid_parameters(self):
+        for params in ({'since': -1}, {'since': 'x'}, {'since': 0, 'limit': 0}, {'since': 0, 'wait': 'nan'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/core/changes/', params).status_code, 400)
+
+
+class DuplicateDetectionTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/core/ngo/', ngo_data(1, name='Clean River Society'))
+        self.ngo = Ngo.objects.get()
+
+    def test_shared_contact_is_a_conflict(self):
+        response = self.client.post('/core/ngo/', ngo_data(2, email='NGO1@example.org'))
+        self.assertEqual(response.status_code, 409)
+        [duplicate] = response.data['duplicates']
+        self.assertEqual((duplicate['id'], duplicate['matches']), (self.ngo.pk, ['email']))
+        response = self.client.post('/core/ngo/', ngo_data(3, website='http://www.ngo1.example.org/'))
+        self.assertEqual(response.data['duplicates'][0]['matches'], ['website'])
+        response = self.client.post('/core/ngo/', ngo_data(4, phone_secondary='0091%s' % self.ngo.phone_primary))
+        self.assertEqual(response.data['duplicates'][0]['matches'], ['phone'])
+        self.assertEqual(Ngo.objects.count(), 1)
+
+    def test_similar_name_in_the_same_city_is_a_conflict(self):
+        response = self.client.post('/core/ngo/', ngo_data(2, name='Clean River Trust'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['duplicates'][0]['matches'], ['name'])
+        response = self.client.post('/core/ngo/', ngo_data(2, name='Clean River Trust', location_city='Mumbai'))
+        self.assertEqual(response.status_code, 201)
+
+    def test_allow_duplicate(self):
+        response = self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(2, email='ngo1@example.org'))
+        self.assertEqual(response.status_code, 201)
+
+    def test_updates_move_the_signature(self):
+        self.client.patch('/core/ngo/%d/' % self.ngo.pk, {'email': 'river@example.org'})
+        self.assertEqual(self.client.post('/core/ngo/', ngo_data(2, name='Other Name')).status_code, 201)
+        response = self.client.post('/core/ngo/', ngo_data(3, name='Third Name', email='river@example.org'))
+        self.assertEqual(response.status_code, 409)
+
+    def test_normalizers(self):
+        self.assertEqual(duplicates.normalize_website('HTTPS://www.Example.org/about/'), 'example.org/about')
+        self.assertEqual(duplicates.normalize_phone('+91 (20) 1234-5678'), '2012345678')
+        self.assertEqual(duplicates.normalize_phone('1234'), '')
+        self.assertEqual(duplicates.normalize_name('The Clean-River Foundation'), 'clean river')
+        self.assertEqual(duplicates.similarity('Clean River', 'clean river'), 1.0)
+
+
+class AuditTests(ApiTestCase):
+
+    def test_api_writes_record_the_request_user(self):
+        self.client.post('/core/ngo/', ngo_data(1))
+        ngo = Ngo.objects.get()
+        other = get_user_model().objects.create_user('other', 'other@example.org', 'secret-password')
+        client = APIClient()
+        client.force_authenticate(other)
+        client.patch('/core/ngo/%d/' % ngo.pk, {'name': 'Helping Hands Pune'})
+        ngo.refresh_from_db()
+        self.assertEqual((ngo.created_by, ngo.modified_by), (self.user, other))
+
+    def test_verification_writes_record_the_request_user(self):
+        self.client.post('/core/ngo/', ngo_data(1))
+        verification = Ngo_Verification.objects.get()
+        other = get_user_model().objects.create_user('other', 'other@example.org', 'secret-password')
+        client = APIClient()
+        client.force_authenticate(other)
+        client.post('/core/ngo_verification/%d/verify/' % verification.pk, {'checks': ['website']}, format='json')
+        client.patch('/core/ngo_verification/%d/' % verification.pk, {'v_email': True})
+        self.assertEqual(Verification_Job.objects.get().requested_by, other)
+        self.assertEqual(Ngo_Verification.objects.get().modified_by, other)
+        self.assertEqual(Ngo.objects.get().created_by, self.user)
+
+    def test_acting_as_ends_with_its_block(self):
+        with acting_as(self.user):
+            with acting_as(None):
+                self.assertIsNone(get_current_user())
+            self.assertEqual(get_current_user(), self.user)
+        self.assertIsNone(get_current_user())
+
+    def test_import_command_records_its_user(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            writer = csv.DictWriter(csv_file, importer.IMPORT_FIELDS)
+            writer.writeheader()
+            writer.writerow(ngo_data(1))
+        self.addCleanup(os.remove, csv_file.name)
+        call_command('import_ngos', csv_file.name, user='member', verbosity=0, stdout=io.StringIO())
+        ngo = Ngo.objects.get()
+        self.assertEqual((ngo.created_by, ngo.modified_by, ngo.Verification.modified_by), (self.user,) * 3)
+
+    def test_bulk_writes_record_the_user_of_acting_as(self):
+        with acting_as(self.user):
+            ngos = importer.write_batch([{field: ngo_data(1)[field] for field in importer.IMPORT_FIELDS}])
+        self.assertEqual(Ngo.objects.get(pk=ngos[0].pk).created_by_id, self.user.pk)
+        ngos = importer.write_batch([{field: ngo_data(2)[field] for field in importer.IMPORT_FIELDS}])
+        self.assertIsNone(Ngo.objects.get(pk=ngos[0].pk).created_by_id)
+
+
+DETAIL_DATA = {
+    'orientation': 'C', 'level': 'CIT', 'activity': 'O', 'staffing': 'V',
+    'fund': 'L', 'fund_acceptance_from': 'I', 'legal_status': 'TCF', 'overhead_cost': 10,
+}
+
+
+class FacetTests(ApiTestCase):
+
+    def facets(self):
+        response = self.client.get('/core/ngo/facets/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_follow_the_writes(self):
+        self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(1))
+        self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(2))
+        self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(3, location_city='Mumbai'))
+        first, second, third = Ngo.objects.order_by('id')
+        self.assertEqual(self.facets()['location_city'], {'PUNE': 2, 'MUMBAI': 1})
+        Ngo_Detail.objects.create(ngo=first, **DETAIL_DATA)
+        Ngo_Detail.objects.create(ngo=second, **dict(DETAIL_DATA, level='NAT'))
+        self.assertEqual(self.facets()['level'], {'CIT': 1, 'NAT': 1})
+
+        self.client.patch('/core/ngo/%d/' % first.pk, {'location_city': 'Mumbai'})
+        self.client.patch('/core/ngo_detail/%d/' % first.detail.pk, {'level': 'NAT'})
+        facets = self.facets()
+        self.assertEqual((facets['location_city'], facets['level']), ({'MUMBAI': 2, 'PUNE': 1}, {'NAT': 2}))
+        # Unchanged dimensions keep their counts
+        self.assertEqual(facets['location_state'], {'MAHARASHTRA': 3})
+
+        self.client.delete('/core/ngo/%d/' % third.pk)
+        self.client.delete('/core/ngo/%d/' % first.pk)
+        facets = self.facets()
+        self.assertEqual((facets['location_city'], facets['level']), ({'PUNE': 1}, {'NAT': 1}))
+
+    def test_incremental_counts_match_a_rebuild(self):
+        for index in range(4):
+            self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(
+                index, location_city=('Pune', 'Nagpur')[index % 2]))
+        ngo = Ngo.objects.first()
+        Ngo_Detail.objects.create(ngo=ngo, **DETAIL_DATA)
+        self.client.patch('/core/ngo/%d/' % ngo.pk, {'location_state': 'Goa'})
+        importer.write_batch([{field: ngo_data(9)[field] for field in importer.IMPORT_FIELDS}])
+        incremental = self.facets()
+        facets.rebuild()
+        self.assertEqual(self.facets(), incremental)
+        # The filtered facets are counted on the queryset
+        response = self.client.get('/core/ngo/facets/', {'location_city': 'NAGPUR'})
+        self.assertEqual(response.data['location_city'], {'NAGPUR': 2})
+
+
+class ImporterTests(ApiTestCase):
+
+    def row(self, index, **fields):
+        data = ngo_data(index, **dict({'name': 'Import Trust %s' % 'abcdefghij'[index]}, **fields))
+        return {field: data[field] for field in importer.IMPORT_FIELDS}
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        rows = [self.row(1), self.row(2, name='Trust 2', email='nobody'), 'not an object', self.row(3)]
+        del rows[3]['purpose']
+        with acting_as(self.user):
+            report = importer.import_ngos(importer.read_rows(rows), batch_size=2)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3, 4])
+        self.assertEqual(set(report['errors'][0]['errors']), {'name', 'email'})
+        self.assertEqual(report['errors'][1]['errors'], {'non_field_errors': ['Expected an object']})
+        self.assertEqual(report['errors'][2]['errors'], {'purpose': ['This field is required.']})
+        self.assertEqual(list(Ngo.objects.values_list('name', 'location_city')), [('Import Trust b', 'PUNE')])
+
+    def test_jsonl_lines_are_numbered(self):
+        lines = io.StringIO('%s\n\n{not json\n[1]\n' % json.dumps(self.row(1)))
+        with acting_as(self.user):
+            report = importer.import_ngos(importer.read_jsonl(lines))
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4])
+
+    def test_created_ngos_get_their_primary_keys_and_derived_rows(self):
+        Ngo.objects.create(**dict(ngo_data(9, name='Existing Trust'), created_by=self.user, modified_by=self.user))
+        valid, errors = importer.validate_batch(enumerate(self.row(index) for index in range(3)))
+        self.assertEqual(errors, [])
+        with acting_as(self.user):
+            ngos = importer.write_batch([row for _, row in valid])
+        # Recovered from the database on the backends that do not return them
+        self.assertEqual(
+            [(ngo.pk, ngo.name) for ngo in ngos],
+            list(Ngo.objects.filter(pk__in=[ngo.pk for ngo in ngos]).order_by('id').values_list('id', 'name')))
+        self.assertEqual(Ngo_Verification.objects.filter(ngo__in=ngos).count(), 3)
+        self.assertEqual(search.search_ngo_ids('import', 10), [ngo.pk for ngo in ngos])
+        self.assertEqual(
+            {change['ngo'] for change in self.client.get('/core/changes/', {'since': 0}).data['changes']},
+            {ngo.pk for ngo in Ngo.objects.all()})
+        self.assertEqual(self.client.get('/core/ngo/facets/').data['location_city'], {'PUNE': 4})
+        response = self.client.post('/core/ngo/', ngo_data(5, name='Another Name', email=ngos[1].email))
+        self.assertEqual(response.data['duplicates'][0]['id'], ngos[1].pk)
+
+    def test_the_command_reads_csv_files(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            writer = csv.DictWriter(csv_file, importer.IMPORT_FIELDS)
+            writer.writeheader()
+            writer.writerow(self.row(1))
+            writer.writerow(self.row(2, phone_primary='not a phone'))
+        self.addCleanup(os.remove, csv_file.name)
+        errors = io.StringIO()
+        call_command('import_ngos', csv_file.name, user='member', stdout=io.StringIO(), stderr=errors)
+        self.assertEqual(Ngo.objects.count(), 1)
+        self.assertIn('Row 3', errors.getvalue())
+
+
+class ExportTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.description = ' '.join(['Meals, "lessons" and\nshelter.'] * 12)
+        self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(1, name='Aide Enfance', description=self.description))
+        self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(2, location_city='Mumbai'))
+        self.first, self.second = Ngo.objects.order_by('id')
+        Ngo_Detail.objects.create(ngo=self.first, **DETAIL_DATA)
+
+    def export(self, **params):
+        response = self.client.get('/core/ngo/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.first.pk, self.second.pk])
+        self.assertEqual(list(rows[0]), [name for name, _ in export.COLUMNS])
+        self.assertEqual(
+            (rows[0]['description'], rows[0]['v_email'], rows[0]['level'], rows[0]['overhead_cost']),
+            (self.description, False, 'CIT', 10))
+        # Ngos without details have empty detail columns
+        self.assertEqual((rows[1]['level'], rows[1]['overhead_cost']), (None, None))
+
+    def test_csv(self):
+        response, content = self.export(output='csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="ngos.csv"')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([row['description'] for row in rows], [self.description, self.second.description])
+        self.assertEqual((rows[0]['level'], rows[1]['level'], rows[1]['overhead_cost']), ('CIT', '', ''))
+        self.assertEqual(rows[0]['created_at'], self.first.created_at.isoformat())
+
+    def test_filters_and_formats(self):
+        _, content = self.export(location_city='MUMBAI')
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [self.second.pk])
+        self.assertEqual(self.client.get('/core/ngo/export/', {'output': 'xml'}).status_code, 400)
+
+    def test_rows_are_read_in_chunks(self):
+        rows = export.export_rows(Ngo.objects.all(), chunk_size=1)
+        self.assertEqual(next(rows)[0], self.first.pk)
+        self.assertEqual([row[0] for row in rows], [self.second.pk])
+
+
+@override_settings(NGO_HUB_RESPONSE_CACHE=True)
+class ResponseCacheTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response_cache().clear()
+        self.client.post('/core/ngo/', ngo_data(1))
+        self.ngo = Ngo.objects.get()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_writes_invalidate_the_responses(self):
+        for url in ('/core/ngo/', '/core/ngo/%d/' % self.ngo.pk, '/core/ngo_profile/%d/' % self.ngo.pk):
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+                self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+        self.client.patch('/core/ngo/%d/' % self.ngo.pk, {'name': 'Helping Hands Pune'})
+        response = self.get('/core/ngo/%d/' % self.ngo.pk)
+        self.assertEqual((response['X-Cache'], response.data['name']), ('MISS', 'Helping Hands Pune'))
+        self.assertEqual(self.get('/core/ngo/')['X-Cache'], 'MISS')
+        # The profile depends on the verification of the Ngo too
+        self.get('/core/ngo_profile/%d/' % self.ngo.pk)
+        self.client.patch('/core/ngo_verification/%d/' % self.ngo.Verification.pk, {'v_email': True})
+        response = self.get('/core/ngo_profile/%d/' % self.ngo.pk)
+        self.assertEqual((response['X-Cache'], response.data['verification']['v_email']), ('MISS', True))
+
+    def test_query_parameters_are_part_of_the_key(self):
+        self.get('/core/ngo/?page_size=1')
+        self.assertEqual(self.get('/core/ngo/?page_size=2')['X-Cache'], 'MISS')
+        self.assertEqual(self.get('/core/ngo/?page_size=1')['X-Cache'], 'HIT')
+
+    def test_writes_in_a_transaction_are_invalidated_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.ngo.name = 'Helping Hands Pune'
+                self.ngo.save()
+                # Cached from the old state while the transaction is open
+                self.client.get('/core/ngo/%d/' % self.ngo.pk)
+        self.assertEqual(self.get('/core/ngo/%d/' % self.ngo.pk)['X-Cache'], 'MISS')
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def make_cache(self, **options):
+        return LRUCache('test', {'OPTIONS': options})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        lru = self.make_cache(MAX_ENTRIES=3)
+        for key in 'abc':
+            lru.set(key, key)
+        lru.get('a')
+        lru.set('d', 'd')
+        self.assertEqual([lru.get(key) for key in 'abcd'], ['a', None, 'c', 'd'])
+        self.assertEqual((lru.info()['entries'], lru.evictions), (3, 1))
+
+    def test_size_is_bounded(self):
+        lru = self.make_cache(MAX_ENTRIES=100, MAX_BYTES=1000)
+        for index in range(10):
+            lru.set(index, 'x' * 300)
+        info = lru.info()
+        self.assertLessEqual(info['bytes'], 1000)
+        self.assertEqual(info['entries'], 3)
+        self.assertEqual(lru.get(9), 'x' * 300)
+        # Larger than the cache, not stored
+        self.assertFalse(lru.set('big', 'x' * 2000))
+        self.assertIsNone(lru.get('big'))
+
+    def test_expired_entries_are_dropped(self):
+        lru = self.make_cache()
+        lru.set('a', 1, timeout=-1)
+        self.assertIsNone(lru.get('a'))
+        self.assertTrue(lru.add('a', 2))
+        self.assertFalse(lru.add('a', 3))
+        self.assertEqual(lru.get('a'), 2)
+
+
+class JobRowSerializer(serializers.ModelSerializer):
+    """
+    Null datetimes, decimals and floats, none of which the API serializers have.
+    """
+    attempts = serializers.DecimalField(max_digits=6, decimal_places=2)
+    failed_confirmations = serializers.FloatField()
+
+    class Meta:
+        model = Verification_Job
+        fields = ('id', 'kind', 'attempts', 'failed_confirmations', 'run_after', 'locked_at', 'expires_at', 'last_error')
+
+
+class FastListTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for index, name in enumerate(('Aide à Enfance', 'Helping Hands')):
+            self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(
+                index, name=name, description=' '.join(['Meals   and "shelter" for all.'] * 12)))
+        self.assertEqual(Ngo.objects.count(), 2)
+
+    def test_compiled_rows_render_like_the_serializer(self):
+        jobs.enqueue(Ngo_Verification.objects.first(), ['website', 'email'])
+        Verification_Job.objects.filter(kind='email').update(
+            locked_at=timezone.now(), attempts=3, failed_confirmations=2, last_error='Timeout é')
+        for serializer_class, queryset in ((NgoSerializer, Ngo.objects.all()),
+                                           (JobRowSerializer, Verification_Job.objects.order_by('id'))):
+            with self.subTest(serializer=serializer_class.__name__):
+                compiled = fast.compile_serializer(serializer_class)
+                self.assertIsNotNone(compiled)
+                self.assertEqual(
+                    fast.FastJSONRenderer().render(compiled.represent(compiled.values(queryset))),
+                    JSONRenderer().render(serializer_class(queryset, many=True).data))
+
+    def test_list_responses_are_byte_identical(self):
+        for params in ({}, {'page_size': 1}, {'fields': 'name,website'}):
+            with self.subTest(params=params):
+                with mock.patch.object(fast.CompiledSerializer, 'represent', autospec=True,
+                                       side_effect=fast.CompiledSerializer.represent) as represent:
+                    fast_content = self.client.get('/core/ngo/', params).content
+                self.assertTrue(represent.called)
+                with mock.patch.object(NgoViewSet, 'get_compiled_serializer', return_value=None), \
+                        mock.patch.object(NgoViewSet, 'renderer_classes', [JSONRenderer]):
+                    regular = self.client.get('/core/ngo/', params)
+                self.assertEqual(fast_content, regular.content)
+
+    def test_nested_serializers_are_not_compiled(self):
+        self.assertIsNone(fast.compile_serializer(NgoProfileSerializer))
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.created = 0
+        self.discarded = []
+        self.broken = set()
+
+    def connect(self):
+        self.created += 1
+        return 'connection-%d' % self.created
+
+    def make_pool(self, size=2, timeout=0.05, max_idle=60):
+        return db.ConnectionPool(
+            size=size, timeout=timeout, max_idle=max_idle,
+            check=lambda connection: connection not in self.broken, discard=self.discarded.append)
+
+    def test_released_connections_are_reused(self):
+        pool = self.make_pool()
+        first = pool.acquire(self.connect)
+        second = pool.acquire(self.connect)
+        pool.release(first)
+        self.assertEqual(pool.acquire(self.connect), first)
+        pool.release(second, reusable=False)
+        self.assertEqual(self.discarded, [second])
+        self.assertEqual(pool.stats(), {
+            'size': 2, 'in_use': 1, 'idle': 0, 'created': 2, 'reused': 1, 'discarded': 1,
+            'waits': 0, 'timeouts': 0})
+
+    def test_acquire_times_out_when_the_pool_is_full(self):
+        pool = self.make_pool(size=1)
+        pool.acquire(self.connect)
+        with self.assertRaisesMessage(OperationalError, 'within 0.05 seconds'):
+            pool.acquire(self.connect)
+        self.assertEqual((pool.stats()['waits'], pool.stats()['timeouts'], self.created), (1, 1, 1))
+
+    def test_waiting_threads_get_the_released_connection(self):
+        pool = self.make_pool(size=1, timeout=5)
+        connection = pool.acquire(self.connect)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire(self.connect)))
+        waiter.start()
+        pool.release(connection)
+        waiter.join(5)
+        self.assertEqual(acquired, [connection])
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_broken_and_idle_connections_are_replaced(self):
+        pool = self.make_pool()
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        self.broken.add(connection)
+        replacement = pool.acquire(self.connect)
+        self.assertEqual((replacement, self.discarded), ('connection-2', [connection]))
+        pool.release(replacement)
+        pool.max_idle = 0
+        self.assertEqual(pool.acquire(self.connect), 'connection-3')
+        self.assertEqual(self.discarded, [connection, replacement])
+
+    def test_failed_connects_free_their_slot(self):
+        pool = self.make_pool(size=1)
+
+        def fail():
+            raise OperationalError('refused')
+
+        with self.assertRaises(OperationalError):
+            pool.acquire(fail)
+        self.assertEqual(pool.acquire(self.connect), 'connection-1')
+
+
+class NearbyTests(ApiTestCase):
+
+    PUNE = (18.52, 73.86)
+
+    def setUp(self):
+        super().setUp()
+        places = [('Pune', 'Maharashtra'), ('Mumbai', 'Maharashtra'), ('Delhi', 'Delhi'),
+                  ('Nagpur', 'Maharashtra'), ('Pune', 'Maharashtra'), ('Nowhere', 'Maharashtra')]
+        for index, (city, state) in enumerate(places):
+            self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(index, location_city=city, location_state=state))
+        self.ids = {ngo.location_city: ngo.pk for ngo in Ngo.objects.order_by('-id')}
+
+    def nearby(self, **params):
+        response = self.client.get('/core/ngo/nearby/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_nearest_first_with_their_distance(self):
+        results = self.nearby(lat=self.PUNE[0], lon=self.PUNE[1])['results']
+        self.assertEqual([ngo['location_city'] for ngo in results], ['PUNE', 'PUNE', 'MUMBAI', 'NAGPUR', 'DELHI'])
+        self.assertEqual(results[0]['distance_km'], 0)
+        self.assertEqual(results[2]['distance_km'], round(geo.distance_km(*self.PUNE, 19.08, 72.88), 3))
+        self.assertEqual([ngo['distance_km'] for ngo in results], sorted(ngo['distance_km'] for ngo in results))
+
+    def test_radius_pages_and_filters(self):
+        within = self.nearby(lat=self.PUNE[0], lon=self.PUNE[1], radius_km=200)['results']
+        self.assertEqual([ngo['location_city'] for ngo in within], ['PUNE', 'PUNE', 'MUMBAI'])
+        self.assertTrue(all(ngo['distance_km'] <= 200 for ngo in within))
+        data = self.nearby(lat=self.PUNE[0], lon=self.PUNE[1], page_size=2, page=2)
+        self.assertEqual([ngo['location_city'] for ngo in data['results']], ['MUMBAI', 'NAGPUR'])
+        self.assertIsNotNone(data['next'])
+        filtered = self.nearby(lat=self.PUNE[0], lon=self.PUNE[1], location_state='DELHI')['results']
+        self.assertEqual([ngo['location_city'] for ngo in filtered], ['DELHI'])
+
+    def test_from_a_known_city(self):
+        results = self.nearby(city='Mumbai', state='Maharashtra', country='India')['results']
+        self.assertEqual([ngo['location_city'] for ngo in results][:3], ['MUMBAI', 'PUNE', 'PUNE'])
+
+    def test_moves_follow_the_ngo(self):
+        self.client.patch('/core/ngo/%d/' % self.ids['DELHI'], {'location_city': 'Pune', 'location_state': 'Maharashtra'})
+        within = self.nearby(lat=self.PUNE[0], lon=self.PUNE[1], radius_km=10)['results']
+        self.assertEqual(len(within), 3)
+
+    def test_invalid_points(self):
+        for params in ({}, {'lat': 91, 'lon': 0}, {'lat': 'x', 'lon': 0}, {'city': 'Atlantis'},
+                       {'lat': 0, 'lon': 0, 'radius_km': -1}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/core/ngo/nearby/', params).status_code, 400)
+
+
+class SparseFieldsTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            self.client.post('/core/ngo/?allow_duplicate=true', ngo_data(index))
+        self.ngo = Ngo.objects.order_by('id').first()
+        self.url = '/core/ngo/%d/' % self.ngo.pk
+
+    def selected_sql(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries if 'FROM "core_ngo"' in query['sql']]
+
+    def test_list_outputs_and_reads_only_the_fields(self):
+        response, sql = self.selected_sql('/core/ngo/?fields=name,website')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual([set(ngo) for ngo in response.data['results']], [{'name', 'website'}] * 3)
+        self.assertTrue(sql)
+        self.assertTrue(all('"description"' not in query and '"purpose"' not in query for query in sql))
+        response = self.client.get('/core/ngo/', {'exclude': 'description,purpose'})
+        self.assertNotIn('description', response.data['results'][0])
+        self.assertIn('website', response.data['results'][0])
+
+    def test_retrieve_and_search_are_sparse(self):
+        response, sql = self.selected_sql(self.url + '?fields=name')
+        self.assertEqual(response.data, {'name': self.ngo.name})
+        self.assertTrue(all('"description"' not in query for query in sql))
+        results = self.client.get('/core/ngo/search/', {'q': 'Feeding', 'fields': 'email'}).data['results']
+        self.assertEqual([set(ngo) for ngo in results], [{'email'}] * 3)
+
+    def test_sparse_representations_have_their_own_etag(self):
+        full = self.client.get(self.url)['ETag']
+        sparse = self.client.get(self.url, {'fields': 'name,website'})
+        self.assertEqual(sparse['ETag'], '"ngo-%d-1;name+website"' % self.ngo.pk)
+        self.assertNotEqual(sparse['ETag'], full)
+        # Field order in the query string does not matter, only the set
+        self.assertEqual(self.client.get(self.url, {'fields': 'website,name'})['ETag'], sparse['ETag'])
+        response = self.client.get(self.url + '?fields=name,website', HTTP_IF_NONE_MATCH=sparse['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=sparse['ETag']).status_code, 200)
+        self.client.patch(self.url, {'name': 'Helping Hands Pune'})
+        self.assertEqual(
+            self.client.get(self.url + '?fields=name,website', HTTP_IF_NONE_MATCH=sparse['ETag']).status_code, 200)
+
+    def test_unknown_fields_are_refused(self):
+        response = self.client.get('/core/ngo/', {'fields': 'name,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.data['fields'])
+        response = self.client.get(self.url, {'exclude': 'nothing'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('exclude', response.data)
+
+    def test_writes_ignore_the_fields(self):
+        response = self.client.patch(self.url + '?fields=name', {'website': 'https://pune.example.org'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('website', response.data)
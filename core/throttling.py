@@ -0,0 +1,309 @@
+"""
+Rate limiting shared by all the worker processes.
+
+The throttles use GCRA, the generic cell rate algorithm, a token bucket
+whose whole state is one number per client: the theoretical arrival time
+(TAT) of its next request. A rate of N requests per period spaces the
+requests by period / N seconds; a client may run ahead of that schedule
+by `burst` requests (N by default, NGO_HUB_THROTTLE_BURSTS per scope or
+route). Checking a request reads and writes that single number, instead
+of the growing timestamp list DRF's throttles rewrite on every request.
+
+The numbers live in a store shared by the processes, NGO_HUB_THROTTLE_STORE:
++ SQLiteStore   a SQLite file, shared by the workers of one host (default)
++ CacheStore    a Django cache alias, e.g. memcached shared by several hosts
++ LocalStore    the memory of the process, for tests and single processes
+
+Rates come from DEFAULT_THROTTLE_RATES (the anon and user scopes, and the
+throttle_scope of a view) and NGO_HUB_THROTTLE_ROUTE_RATES, by route name.
+They are read on every request, so override_settings applies to them.
+RateLimitHeadersMiddleware adds the RateLimit-Limit, RateLimit-Remaining,
+RateLimit-Reset and RateLimit-Policy headers of the tightest limit.
+"""
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# allowed, remaining: requests left right now, reset: seconds until the
+# bucket is full again (allowed) or until the next request is (denied)
+Decision = namedtuple('Decision', 'allowed remaining reset')
+
+
+def parse_rate(rate):
+    """
+    Returns (requests, period in seconds) of a rate such as 50/minute or 100/10m.
+    """
+    count, period = rate.split('/')
+    multiplier = ''.join(character for character in period if character.isdigit())
+    unit = period[len(multiplier):][:1]
+    return int(count), PERIODS[unit] * int(multiplier or 1)
+
+
+def gcra(tat, now, interval, burst):
+    """
+    Returns (Decision, new tat) of a request at now for a stored tat (None
+    for a new client), requests being spaced by interval seconds.
+    """
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + interval
+    allowed_at = new_tat - burst * interval
+    if allowed_at > now:
+        return Decision(False, 0, allowed_at - now), tat
+    return Decision(True, int((now - allowed_at) // interval), new_tat - now), new_tat
+
+
+class LocalStore:
+    """
+    TATs in the memory of the process, at most max_entries clients.
+    """
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, now, interval, burst):
+        with self._lock:
+            decision, tat = gcra(self._tats.get(key), now, interval, burst)
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            while len(self._tats) > self.max_entries:
+                # A full bucket drops nothing, the oldest one is the likeliest full
+                self._tats.popitem(last=False)
+        return decision
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class SQLiteStore:
+    """
+    TATs in a SQLite file shared by the processes of the host. Every
+    check is one IMMEDIATE transaction; rows of full buckets are purged
+    every purge_seconds. When the file stays locked beyond timeout the
+    request is let through, as with CacheStore.
+    """
+    def __init__(self, path=None, timeout=1.0, purge_seconds=60):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'ngo-hub-throttle.sqlite3')
+        self.timeout = timeout
+        self.purge_seconds = purge_seconds
+        self._local = threading.local()
+        self._purged = 0.0
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # The state is disposable, losing the last writes on a crash is fine
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS throttle (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def hit(self, key, now, interval, burst):
+        try:
+            connection = self.connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT tat FROM throttle WHERE key = ?', (key,)).fetchone()
+                decision, tat = gcra(row[0] if row else None, now, interval, burst)
+                if decision.allowed:
+                    connection.execute('INSERT OR REPLACE INTO throttle (key, tat) VALUES (?, ?)', (key, tat))
+                if now - self._purged > self.purge_seconds:
+                    self._purged = now
+                    connection.execute('DELETE FROM throttle WHERE tat < ?', (now,))
+                connection.execute('COMMIT')
+            finally:
+                # Also after a failed COMMIT, which leaves the transaction open
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+        except sqlite3.OperationalError:
+            # Locked beyond the timeout: the request is let through rather than failed
+            return Decision(True, 0, 0.0)
+        return decision
+
+    def clear(self):
+        self.connection().execute('DELETE FROM throttle')
+
+
+class CacheStore:
+    """
+    TATs in a Django cache. Memcached and the other caches have no
+    compare-and-swap, so each check holds a short lock made with add(),
+    which is atomic on memcached and the database cache. When the lock
+    stays busy the request is let through rather than stalled.
+    """
+    def __init__(self, alias='default', key_prefix='ngo-hub-throttle:', lock_attempts=20):
+        self.alias = alias
+        self.key_prefix = key_prefix
+        self.lock_attempts = lock_attempts
+
+    def hit(self, key, now, interval, burst):
+        cache = caches[self.alias]
+        key = self.key_prefix + key
+        for attempt in range(self.lock_attempts):
+            if cache.add(key + ':lock', 1, timeout=1):
+                break
+            time.sleep(0.001 * (attempt + 1))
+        else:
+            return Decision(True, 0, 0.0)
+        try:
+            decision, tat = gcra(cache.get(key), now, interval, burst)
+            if decision.allowed:
+                cache.set(key, tat, timeout=math.ceil(tat - now) + 1)
+        finally:
+            cache.delete(key + ':lock')
+        return decision
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Returns the NGO_HUB_THROTTLE_STORE of this process.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_class = import_string(getattr(settings, 'NGO_HUB_THROTTLE_STORE', 'core.throttling.SQLiteStore'))
+                _store = store_class(**getattr(settings, 'NGO_HUB_THROTTLE_STORE_OPTIONS', {}))
+    return _store
+
+
+def reset_store(setting, **kwargs):
+    global _store
+    if setting in ('NGO_HUB_THROTTLE_STORE', 'NGO_HUB_THROTTLE_STORE_OPTIONS'):
+        _store = None
+
+
+setting_changed.connect(reset_store)
+
+
+class RateThrottle(BaseThrottle):
+    """
+    GCRA throttle of a scope. Subclasses return the rate and the client key.
+    """
+    scope = None
+
+    def get_rate(self, request, view):
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def get_burst(self, limit):
+        return getattr(settings, 'NGO_HUB_THROTTLE_BURSTS', {}).get(self.scope, limit)
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def client_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            return 'user:%s' % request.user.pk
+        return 'ip:%s' % self.get_ident(request)
+
+    def allow_request(self, request, view):
+        self.decision = None
+        rate = self.get_rate(request, view)
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        limit, period = parse_rate(rate)
+        burst = self.get_burst(limit)
+        self.decision = get_store().hit(key, time.time(), period / limit, burst)
+        # Read by RateLimitHeadersMiddleware
+        request._request.ratelimits = getattr(request._request, 'ratelimits', []) + [
+            (limit, period, burst, self.decision)]
+        return self.decision.allowed
+
+    def wait(self):
+        if self.decision is None or self.decision.allowed:
+            return None
+        return self.decision.reset
+
+
+class AnonRateThrottle(RateThrottle):
+    """
+    Limits the unauthenticated requests by client address.
+    """
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return '%s:%s' % (self.scope, self.client_ident(request))
+
+
+class UserRateThrottle(RateThrottle):
+    """
+    Limits the requests by user, and by address for the unauthenticated ones.
+    """
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        return '%s:%s' % (self.scope, self.client_ident(request))
+
+
+class RouteRateThrottle(RateThrottle):
+    """
+    Limits the requests of a client to one route, with the rate of the
+    route name in NGO_HUB_THROTTLE_ROUTE_RATES or, failing that, the rate
+    of the view's throttle_scope. Bursts are configured under the same name.
+    """
+    def get_route(self, request, view):
+        match = request.resolver_match
+        return match.view_name if match else None
+
+    def get_rate(self, request, view):
+        self.scope = None
+        route = self.get_route(request, view)
+        rate = getattr(settings, 'NGO_HUB_THROTTLE_ROUTE_RATES', {}).get(route)
+        if rate is not None:
+            self.scope = route
+            return rate
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is not None:
+            self.scope = scope
+            return api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        return None
+
+    def get_cache_key(self, request, view):
+        return 'route:%s:%s' % (self.scope, self.client_ident(request))
+
+
+class RateLimitHeadersMiddleware(MiddlewareMixin):
+    """
+    Adds the RateLimit-* headers of the tightest limit the request was checked against.
+    """
+    def process_response(self, request, response):
+        ratelimits = getattr(request, 'ratelimits', None)
+        if not ratelimits:
+            return response
+        limit, period, burst, decision = min(ratelimits, key=lambda item: (item[3].remaining, -item[3].reset))
+        response['RateLimit-Limit'] = str(limit)
+        response['RateLimit-Remaining'] = str(decision.remaining)
+        response['RateLimit-Reset'] = str(math.ceil(decision.reset))
+        response['RateLimit-Policy'] = '%d;w=%d;burst=%d' % (limit, period, burst)
+        return response
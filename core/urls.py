@@ -7,8 +7,13 @@ router = DefaultRouter()
 router.register(r'ngo', views.NgoViewSet)
 router.register(r'ngo_verification', views.Ngo_VerificationViewSet)
 router.register(r'ngo_detail', views.Ngo_DetailViewSet)
+router.register(r'ngo_profile', views.NgoProfileViewSet)
 
 # The API URLs are now determined automatically by the router.
 urlpatterns = [
-    url(r'^', include(router.urls))
+    url(r'^', include(router.urls)),
+    url(r'^verify_email/$', views.ConfirmEmailView.as_view(), name='verify-email'),
+    url(r'^changes/$', views.ChangesView.as_view(), name='changes'),
+    url(r'^cache_stats/$', views.CacheStatsView.as_view(), name='cache-stats'),
+    url(r'^db_stats/$', views.DatabaseStatsView.as_view(), name='db-stats'),
 ]
\ No newline at end of file
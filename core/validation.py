@@ -0,0 +1,171 @@
+"""
+Field validation of the core models.
+
+Each model declares its Rules: the normalizers and the checks of its
+fields. Checks are built once, with the model: choices become frozensets,
+character classes are tested with single str method calls instead of a
+Python generator per character. A Rules object validates every field in
+one pass and reports all the errors at once as a ValidationError dict.
+
+The same Rules run in the serializers (ValidatedSerializerMixin, errors
+become a 400) and in the models' save(). A serializer saves inside
+validated(), so save() only normalizes and does not check the data the
+serializer just checked a second time.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+
+
+def isalphaspace(value):
+    """
+    Whether value only holds letters and whitespace.
+    """
+    if value.isalpha():
+        return True
+    # Plain spaces first, replace() is cheaper than split() and join()
+    letters = value.replace(' ', '')
+    if not letters or letters.isalpha():
+        return True
+    letters = ''.join(letters.split())
+    return not letters or letters.isalpha()
+
+
+def isnumeric(value):
+    """
+    Whether value only holds numeric characters.
+    """
+    return not value or value.isnumeric()
+
+
+class Check:
+    """
+    A test of a field value and the error reported when it fails.
+    params are the message parameters besides the value.
+    """
+    __slots__ = ('test', 'message', 'params', 'value_param')
+
+    def __init__(self, test, message, params=None, value_param='value'):
+        self.test = test
+        self.message = message
+        self.params = params or {}
+        self.value_param = value_param
+
+    def error(self, value):
+        return ValidationError(self.message, params=dict(self.params, **{self.value_param: value}))
+
+
+def alphaspace():
+    return Check(isalphaspace, _('%(value)s : cannot contain anything other than alphabet, space'))
+
+
+def numeric():
+    return Check(isnumeric, _('%(value)s : cannot contain anything other than number'))
+
+
+def min_length(length):
+    return Check(
+        lambda value: len(value) >= length,
+        _('%(value)s : length is less than %(constraint)s'), {'constraint': length})
+
+
+@lru_cache(maxsize=None)
+def choice(choices):
+    """
+    Check of a choices tuple, built once per tuple.
+    Empty values are left to the required checks.
+    """
+    values = frozenset(key for key, label in choices)
+    return Check(
+        lambda selection: not selection or selection in values,
+        _('%(selection)s : selection is not in %(values)s'),
+        {'values': [key for key, label in choices]}, value_param='selection')
+
+
+# Model classes whose data the current serializer save has validated already
+_validated = ContextVar('ngo_hub_validated', default=frozenset())
+
+
+@contextmanager
+def validated(model):
+    """
+    Marks the saves of model instances in the block as validated.
+    """
+    token = _validated.set(_validated.get() | {model})
+    try:
+        yield
+    finally:
+        _validated.reset(token)
+
+
+class Rules:
+    """
+    Normalizers ({field: function}) and checks ({field: (Check, ...)}) of a model.
+    The checks of a field stop at its first error.
+    """
+    def __init__(self, checks, normalizers=None):
+        self.checks = {field: tuple(field_checks) for field, field_checks in checks.items()}
+        self.normalizers = normalizers or {}
+
+    def normalize(self, values):
+        for field, normalizer in self.normalizers.items():
+            value = values.get(field)
+            if value is not None:
+                values[field] = normalizer(value)
+
+    def errors(self, values):
+        """
+        Normalizes the values dict in place and returns {field: [ValidationError]}.
+        Fields missing from values (or None) are not checked.
+        """
+        self.normalize(values)
+        errors = {}
+        for field, checks in self.checks.items():
+            value = values.get(field)
+            if value is None:
+                continue
+            for check in checks:
+                if not check.test(value):
+                    errors[field] = [check.error(value)]
+                    break
+        return errors
+
+    def validate(self, values):
+        """
+        Normalizes the values dict in place, raises ValidationError with every error.
+        """
+        errors = self.errors(values)
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    def clean(self, instance):
+        """
+        Normalizes and, unless a serializer validated it, checks a model instance.
+        """
+        # The loaded field values, deferred fields are neither saved nor checked
+        values = instance.__dict__
+        if type(instance) in _validated.get():
+            self.normalize(values)
+        else:
+            self.validate(values)
+
+
+class ValidatedSerializerMixin:
+    """
+    Runs the Rules of the serializer's model on the validated data and
+    saves without running them again.
+    """
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        rules = getattr(self.Meta.model, 'rules', None)
+        if rules is not None:
+            rules.validate(attrs)
+        return attrs
+
+    def save(self, **kwargs):
+        with validated(self.Meta.model):
+            return super().save(**kwargs)
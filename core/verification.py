@@ -0,0 +1,380 @@
+"""
+Automated verification checks.
+
+Each Verification_Job kind has a check, run by the workers of core.jobs:
++ email            the mail domain must have a mail server (MX record, or
+                   an address record as RFC 5321 allows), then a link with
+                   a one-time token is mailed; v_email is set when the Ngo
+                   follows it (ConfirmEmailView)
++ website          a HEAD request must answer 2xx or 3xx; v_website is set
+                   right away
++ phone_primary /  a one-time code is sent by SMS; the flag is set when the
+  phone_secondary  Ngo posts it back (Ngo_VerificationViewSet.confirm)
+
+The network goes through backends named in the settings, like Django's
+EMAIL_BACKEND: NGO_HUB_MX_BACKEND, NGO_HUB_HTTP_CHECK_BACKEND and
+NGO_HUB_SMS_BACKEND. The Locmem* backends are local stand-ins answering
+from the settings and recording what was sent, for tests and development.
+The confirmation email itself goes through EMAIL_BACKEND.
+"""
+import hashlib
+import http.client
+import ipaddress
+import logging
+import secrets
+import socket
+import ssl
+from datetime import timedelta
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from core.models import Ngo_Verification, Verification_Job
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:
+    dns = None
+
+
+logger = logging.getLogger(__name__)
+
+# Ngo_Verification flag set by each kind of job
+FLAGS = {
+    'email': 'v_email',
+    'website': 'v_website',
+    'phone_primary': 'verified_phone_primary',
+    'phone_secondary': 'verified_phone_secondary',
+}
+
+# Concurrency key of the phone checks, they all go through the SMS backend
+SMS_DOMAIN = 'sms'
+
+
+class TemporaryError(Exception):
+    """
+    The check could not run (timeout, server error), it is retried later.
+    """
+
+
+class CheckFailed(Exception):
+    """
+    The check ran and the value is not valid, it is not retried.
+    """
+
+
+class LeaseLost(Exception):
+    """
+    The lease of the worker on the job ran out, another worker may run it.
+    """
+
+
+class DnsMxBackend:
+    """
+    Looks the mail servers of a domain up in the DNS. Uses dnspython for
+    MX records when it is installed, otherwise only the address record
+    fallback of RFC 5321 section 5.1.
+    """
+    timeout = 5
+
+    def lookup(self, domain):
+        if dns is not None:
+            try:
+                answer = dns.resolver.resolve(domain, 'MX', lifetime=self.timeout)
+                return [str(record.exchange).rstrip('.') for record in answer]
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoNameservers):
+                return []
+            except dns.resolver.NoAnswer:
+                pass
+            except dns.exception.Timeout as error:
+                raise TemporaryError('DNS timeout for %s' % domain) from error
+        try:
+            socket.getaddrinfo(domain, 25, proto=socket.IPPROTO_TCP)
+        except socket.gaierror as error:
+            if error.errno == socket.EAI_AGAIN:
+                raise TemporaryError('DNS lookup of %s failed: %s' % (domain, error)) from error
+            return []
+        return [domain]
+
+
+class LocmemMxBackend:
+    """
+    Answers from the NGO_HUB_MX_RECORDS setting, {domain: [mail server]}.
+    """
+    def lookup(self, domain):
+        return list(getattr(settings, 'NGO_HUB_MX_RECORDS', {}).get(domain, []))
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    """
+    Connects to the address that was checked instead of resolving the host
+    again, which a DNS rebinding could point elsewhere. The Host header
+    still names the host.
+    """
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """
+    PinnedHTTPConnection over TLS, the certificate is verified for the host.
+    """
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+        self.ssl_context = ssl.create_default_context()
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+
+
+class HttpClientBackend:
+    """
+    Sends HEAD requests with http.client, following up to max_redirects
+    redirects. Servers that do not allow HEAD get a GET whose body is not
+    read. The host of every hop must only resolve to public addresses
+    (unless NGO_HUB_HTTP_CHECK_ALLOW_PRIVATE is set), and the connection
+    goes to the address that was checked.
+    """
+    user_agent = 'NGO-Hub-Verification/1.0'
+    max_redirects = 5
+    redirect_codes = (301, 302, 303, 307, 308)
+
+    def is_allowed(self, address):
+        if getattr(settings, 'NGO_HUB_HTTP_CHECK_ALLOW_PRIVATE', False):
+            return True
+        return ipaddress.ip_address(address.split('%')[0]).is_global
+
+    def check_host(self, host, port):
+        """
+        Returns the address to connect to for host, raises CheckFailed when
+        the host resolves to an address that is not allowed.
+        """
+        try:
+            addresses = [info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)]
+        except socket.gaierror as error:
+            if error.errno == socket.EAI_AGAIN:
+                raise TemporaryError('DNS lookup of %s failed: %s' % (host, error)) from error
+            raise CheckFailed('Unknown host %s' % host) from error
+        if not addresses or not all(self.is_allowed(address) for address in addresses):
+            raise CheckFailed('%s is not a public address' % host)
+        return addresses[0]
+
+    def request(self, url, timeout):
+        """
+        Returns the status and the Location header of the answer to url.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise CheckFailed('%s is not an http(s) url' % url)
+        secure = parts.scheme == 'https'
+        try:
+            port = parts.port or (443 if secure else 80)
+        except ValueError as error:
+            raise CheckFailed('%s has an invalid port' % url) from error
+        address = self.check_host(parts.hostname, port)
+        connection_class = PinnedHTTPSConnection if secure else PinnedHTTPConnection
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        for method in ('HEAD', 'GET'):
+            connection = connection_class(parts.hostname, address, port=port, timeout=timeout)
+            try:
+                connection.request(method, path, headers={'User-Agent': self.user_agent})
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError) as error:
+                raise TemporaryError('%s %s failed: %s' % (method, url, error)) from error
+            finally:
+                connection.close()
+            if method == 'HEAD' and response.status in (405, 501):
+                continue
+            return response.status, response.getheader('Location')
+
+    def status(self, url, timeout):
+        for _ in range(self.max_redirects + 1):
+            code, location = self.request(url, timeout)
+            if code not in self.redirect_codes or not location:
+                return code
+            # The next hop is checked like the first one
+            url = urljoin(url, location)
+        raise CheckFailed('%s redirects more than %d times' % (url, self.max_redirects))
+
+
+class LocmemHttpBackend:
+    """
+    Answers from the NGO_HUB_HTTP_CHECK_RESPONSES setting, {url: status}
+    (200 for other urls), and records the requested urls in requests.
+    """
+    requests = []
+
+    def status(self, url, timeout):
+        self.requests.append(url)
+        return getattr(settings, 'NGO_HUB_HTTP_CHECK_RESPONSES', {}).get(url, 200)
+
+
+class LogSmsBackend:
+    """
+    Logs the messages instead of sending them, the default until an SMS
+    provider is configured.
+    """
+    def send(self, number, message):
+        logger.info('SMS to %s: %s', number, message)
+
+
+class LocmemSmsBackend:
+    """
+    Keeps the messages in outbox, a list of (number, message).
+    """
+    outbox = []
+
+    def send(self, number, message):
+        self.outbox.append((number, message))
+
+
+def get_backend(setting, default):
+    return import_string(getattr(settings, setting, default))()
+
+
+def hash_secret(secret):
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+
+def job_domain(ngo, kind):
+    """
+    Returns the host a job of this kind contacts, its concurrency key.
+    """
+    if kind == 'email':
+        return ngo.email.rsplit('@', 1)[-1].lower()
+    if kind == 'website':
+        return (urlsplit(ngo.website).hostname or '').lower()
+    return SMS_DOMAIN
+
+
+def leased(job):
+    """
+    The row of a running job, while it is still claimed by the worker that ran it.
+    """
+    return Verification_Job.objects.filter(
+        pk=job.pk, status=Verification_Job.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at)
+
+
+def check_lease(job):
+    """
+    Raises LeaseLost unless the worker still holds the job and its lease
+    has time left. Called in the transaction of every side effect of a
+    check (email, SMS, flag): the row lock keeps the lease from being
+    released before the effect is done, so that it happens once.
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.NGO_HUB_VERIFICATION_LEASE_SECONDS)
+    if not list(leased(job).filter(locked_at__gt=deadline).select_for_update().values_list('pk')):
+        raise LeaseLost('Verification job %d lost its lease' % job.pk)
+
+
+def mark_verified(job):
+    """
+    Sets the flag of the job on its Ngo_Verification.
+    """
+    ngo_verification = Ngo_Verification.objects.get(pk=job.verification_id)
+    setattr(ngo_verification, FLAGS[job.kind], True)
+    ngo_verification.modified_by_id = job.requested_by_id
+    # Only the flag, a concurrent change of the other flags is kept
+    ngo_verification.save(update_fields=[FLAGS[job.kind], 'modified_by', 'modified_at', 'version'])
+
+
+def challenge(job, secret):
+    """
+    Remembers the hash of the secret sent for the job and when it expires.
+    """
+    job.secret = hash_secret(secret)
+    job.expires_at = timezone.now() + settings.NGO_HUB_VERIFICATION_CODE_TTL
+    job.failed_confirmations = 0
+    return Verification_Job.WAITING
+
+
+def check_email(job):
+    ngo = job.verification.ngo
+    domain = job_domain(ngo, 'email')
+    if not get_backend('NGO_HUB_MX_BACKEND', 'core.verification.DnsMxBackend').lookup(domain):
+        raise CheckFailed('%s has no mail server' % domain)
+    token = secrets.token_urlsafe(32)
+    link = '%s%s?token=%s' % (
+        settings.NGO_HUB_PUBLIC_URL.rstrip('/'), reverse('verify-email'), token)
+    with transaction.atomic():
+        check_lease(job)
+        send_mail(
+            'Confirm the email address of %s on NGO-Hub' % ngo.name,
+            'Follow this link to confirm that %s is the email address of %s:\n\n%s\n' % (
+                ngo.email, ngo.name, link),
+            None, [ngo.email])
+    return challenge(job, token)
+
+
+def check_website(job):
+    url = job.verification.ngo.website
+    code = get_backend('NGO_HUB_HTTP_CHECK_BACKEND', 'core.verification.HttpClientBackend').status(
+        url, settings.NGO_HUB_HTTP_CHECK_TIMEOUT)
+    if code == 429 or code >= 500:
+        raise TemporaryError('%s answered %d' % (url, code))
+    if code >= 400:
+        raise CheckFailed('%s answered %d' % (url, code))
+    with transaction.atomic():
+        check_lease(job)
+        mark_verified(job)
+    return Verification_Job.SUCCEEDED
+
+
+def check_phone(job):
+    ngo = job.verification.ngo
+    code = '%06d' % secrets.randbelow(10 ** 6)
+    with transaction.atomic():
+        check_lease(job)
+        get_backend('NGO_HUB_SMS_BACKEND', 'core.verification.LogSmsBackend').send(
+            getattr(ngo, job.kind), 'Your NGO-Hub verification code for %s is %s' % (ngo.name, code))
+    return challenge(job, code)
+
+
+CHECKS = {
+    'email': check_email,
+    'website': check_website,
+    'phone_primary': check_phone,
+    'phone_secondary': check_phone,
+}
+
+
+def run_check(job):
+    """
+    Runs the check of the job, returns its new status.
+    Raises TemporaryError, CheckFailed or LeaseLost.
+    """
+    return CHECKS[job.kind](job)
+
+
+def confirm(job, secret):
+    """
+    Checks the secret the Ngo sent back for a waiting job, marks the field
+    verified when it matches. Returns whether it matched.
+    """
+    if job.status != Verification_Job.WAITING or job.expires_at <= timezone.now():
+        return False
+    if not constant_time_compare(job.secret, hash_secret(secret)):
+        job.failed_confirmations += 1
+        if job.failed_confirmations >= settings.NGO_HUB_VERIFICATION_MAX_ATTEMPTS:
+            job.status = Verification_Job.FAILED
+            job.last_error = 'Too many wrong codes'
+        job.save(update_fields=['failed_confirmations', 'status', 'last_error', 'modified_at'])
+        return False
+    mark_verified(job)
+    job.status = Verification_Job.SUCCEEDED
+    job.secret = ''
+    job.save(update_fields=['status', 'secret', 'modified_at'])
+    return True
@@ -1,19 +1,154 @@
-from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
-from core.models import Ngo, Ngo_Verification, Ngo_Detail
-from core.serializers import NgoSerializer,Ngo_VerificationSerializer,Ngo_DetailSerializer
+from functools import partial
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from core import cache, changes, db, duplicates, export, facets, gazetteer, geo, importer, jobs, verification
+from core.cache import CachedResponseMixin, cache_response
+from core.async_views import AsyncReadMixin, async_view
+from core.audit import AuditMixin, acting_as
+from core.conditional import ConditionalMixin
+from core.fast import FastListMixin
+from core.filters import NgoFilterBackend
+from core.idempotency import idempotent
+from core.models import Geo_Place, Ngo, Ngo_Verification, Ngo_Detail, Verification_Job
+from core.pagination import RankedPagination
+from core.search import search_ngo_ids
+from core.sparse import SparseFieldsMixin
+from core.serializers import NgoSerializer,Ngo_VerificationSerializer,Ngo_DetailSerializer,NgoProfileSerializer,Verification_EventSerializer,Verification_JobSerializer
 
 
-class NgoViewSet(viewsets.ModelViewSet):
+class NgoViewSet(SparseFieldsMixin, AsyncReadMixin, AuditMixin, ConditionalMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     Kindly fill all the details in order to register the NGO in NGO-Hub.
     """
     permission_classes = (IsAuthenticated,)
     queryset = Ngo.objects.all()
     serializer_class = NgoSerializer
+    keyset_ordering = ('created_at', 'id')
+    filter_backends = (NgoFilterBackend,)
+    sparse_actions = ('list', 'retrieve', 'search', 'nearby')
 
+    def create(self, request, *args, **kwargs):
+        """
+        Registers an Ngo. Send an Idempotency-Key header to retry safely.
+        """
+        parent = super().create
+        return idempotent(request, lambda: parent(request, *args, **kwargs))
 
-class Ngo_VerificationViewSet(viewsets.ModelViewSet):
+    def perform_create(self, serializer):
+        """
+        Refuses an Ngo that looks already registered with a 409 listing its
+        duplicates, unless ?allow_duplicate=true (see core.duplicates).
+        """
+        if self.request.query_params.get('allow_duplicate') != 'true':
+            duplicates.check(tuple(serializer.validated_data.get(field) for field in duplicates.FIELDS))
+        super().perform_create(serializer)
+
+    @action(detail=False)
+    @cache_response('ngo')
+    def search(self, request):
+        """
+        Full-text search over name, purpose and description (?q=), best match first.
+        """
+        paginator = RankedPagination()
+        ids = paginator.paginate_ids(partial(search_ngo_ids, request.query_params.get('q', '')), request)
+        ngos = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([ngos[pk] for pk in ids if pk in ngos], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    @cache_response('ngo', 'ngo_verification', 'ngo_detail')
+    def nearby(self, request):
+        """
+        Ngos nearest to ?lat=&lon= (or to the place ?city=&state=&country=),
+        nearest first, with their distance_km. ?radius_km= limits the
+        distance. Accepts the same filters as the list.
+        """
+        params = request.query_params
+        if 'city' in params:
+            place = Geo_Place.objects.filter(
+                pk=gazetteer.geocode(params['city'], params.get('state', ''), params.get('country', ''))).first()
+            point = (place.latitude, place.longitude) if place else None
+        else:
+            point = geo.parse_point(params.get('lat'), params.get('lon'))
+        try:
+            radius_km = float(params['radius_km']) if 'radius_km' in params else None
+        except ValueError:
+            radius_km = -1
+        if point is None or (radius_km is not None and not 0 <= radius_km < float('inf')):
+            return Response(
+                {'detail': 'Expected ?lat=&lon= or a known ?city=&state=&country=, and a ?radius_km= in km.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        filtered = NgoFilterBackend().get_filters(request)
+        paginator = RankedPagination()
+        neighbours = paginator.paginate_ids(partial(
+            geo.nearest_ngos, point[0], point[1], radius_km=radius_km,
+            queryset=self.filter_queryset(self.get_queryset()) if filtered else None), request)
+        ngos = self.get_queryset().in_bulk([neighbour.ngo_id for neighbour in neighbours])
+        data = []
+        for neighbour in neighbours:
+            if neighbour.ngo_id in ngos:
+                item = self.get_serializer(ngos[neighbour.ngo_id]).data
+                item['distance_km'] = round(neighbour.distance_km, 3)
+                data.append(item)
+        return paginator.get_paginated_response(data)
+
+    @action(detail=False)
+    @cache_response('ngo', 'ngo_detail')
+    def facets(self, request):
+        """
+        Number of Ngos per value of every filter dimension.
+        Accepts the same filters as the list.
+        """
+        if NgoFilterBackend().get_filters(request):
+            return Response(facets.queryset_counts(self.filter_queryset(self.get_queryset())))
+        return Response(facets.precomputed_counts())
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Streams the whole directory, verification and detail columns included.
+        ?output=ndjson (default) or ?output=csv, accepts the list filters.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in export.CONTENT_TYPES:
+            return Response(
+                {'detail': 'output must be one of %s.' % ', '.join(export.CONTENT_TYPES)},
+                status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            export.stream(self.filter_queryset(self.get_queryset()), output),
+            content_type=export.CONTENT_TYPES[output])
+        response['Content-Disposition'] = 'attachment; filename="ngos.%s"' % output
+        return response
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Registers a list of Ngos at once. Invalid rows are reported and skipped.
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'detail': 'Expected a list of Ngos.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = getattr(settings, 'NGO_HUB_BULK_MAX_ROWS', 10000)
+        if len(rows) > max_rows:
+            return Response(
+                {'detail': 'At most %d Ngos per request.' % max_rows},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        def register():
+            with acting_as(request.user):
+                report = importer.import_ngos(importer.read_rows(rows))
+            return Response(
+                report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST)
+        return idempotent(request, register)
+
+
+class Ngo_VerificationViewSet(SparseFieldsMixin, AsyncReadMixin, AuditMixin, ConditionalMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     Update the verification status of the NGO. These steps are to be taken upon manual verification.
     """
@@ -21,11 +156,170 @@ class Ngo_VerificationViewSet(viewsets.ModelViewSet):
     queryset = Ngo_Verification.objects.all()
     serializer_class = Ngo_VerificationSerializer
 
+    @action(detail=True, methods=['post'])
+    def verify(self, request, pk=None):
+        """
+        Queues the automated checks of the fields listed in "checks" (email,
+        website, phone_primary, phone_secondary; all the unverified ones by
+        default). Answers 202 with the jobs, see the jobs action.
+        """
+        ngo_verification = self.get_object()
+        kinds = request.data.get('checks') if isinstance(request.data, dict) else None
+        if kinds is None:
+            kinds = [kind for kind, flag in verification.FLAGS.items() if not getattr(ngo_verification, flag)]
+        elif not isinstance(kinds, list) or not all(kind in verification.FLAGS for kind in kinds):
+            return Response(
+                {'detail': 'checks must be a list of %s.' % ', '.join(verification.FLAGS)},
+                status=status.HTTP_400_BAD_REQUEST)
+        with acting_as(request.user):
+            queued = jobs.enqueue(ngo_verification, list(dict.fromkeys(kinds)))
+        return Response(Verification_JobSerializer(queued, many=True).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True)
+    def jobs(self, request, pk=None):
+        """
+        The verification jobs of the Ngo, newest first.
+        """
+        ngo_verification = self.get_object()
+        return Response(Verification_JobSerializer(ngo_verification.jobs.order_by('-id'), many=True).data)
+
+    @action(detail=True)
+    def events(self, request, pk=None):
+        """
+        The history of the verification: verified and revoked fields, and
+        when the Ngo became or stopped being fully verified. Oldest first.
+        """
+        ngo_verification = self.get_object()
+        return Response(Verification_EventSerializer(
+            ngo_verification.events.select_related('user').order_by('id'), many=True).data)
 
-class Ngo_DetailViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'])
+    def confirm(self, request, pk=None):
+        """
+        Confirms a phone number with the code sent to it by SMS:
+        {"check": "phone_primary", "code": "123456"}.
+        """
+        ngo_verification = self.get_object()
+        data = request.data if isinstance(request.data, dict) else {}
+        kind, code = data.get('check'), data.get('code')
+        if kind not in ('phone_primary', 'phone_secondary') or not isinstance(code, str):
+            return Response(
+                {'detail': 'Expected a check (phone_primary or phone_secondary) and a code.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        job = ngo_verification.jobs.filter(kind=kind, status=Verification_Job.WAITING).order_by('-id').first()
+        if job is None or not verification.confirm(job, code):
+            return Response({'detail': 'Invalid or expired code.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'detail': 'Phone number verified.'})
+
+
+class Ngo_DetailViewSet(SparseFieldsMixin, AsyncReadMixin, AuditMixin, ConditionalMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     These are optional details which could be updated by the NGO.
     """
     permission_classes = (IsAuthenticated,)
     queryset = Ngo_Detail.objects.all()
-    serializer_class = Ngo_DetailSerializer
\ No newline at end of file
+    serializer_class = Ngo_DetailSerializer
+
+
+class NgoProfileViewSet(AsyncReadMixin, ConditionalMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    The NGO with its verification status and details, fetched in a single query.
+    """
+    permission_classes = (IsAuthenticated,)
+    queryset = Ngo.objects.select_related('Verification', 'detail', 'created_by', 'modified_by')
+    serializer_class = NgoProfileSerializer
+    keyset_ordering = ('created_at', 'id')
+    etag_fields = ('version', 'Verification__version', 'detail__version')
+    last_modified_fields = ('modified_at', 'Verification__modified_at', 'detail__modified_at')
+    cache_dependencies = ('ngo', 'ngo_verification', 'ngo_detail')
+    cache_object_tag = 'ngo:{pk}'
+    filter_backends = (NgoFilterBackend,)
+
+
+class ConfirmEmailView(APIView):
+    """
+    Confirms the email address of an Ngo, target of the link mailed by the email check.
+    """
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        token = request.query_params.get('token', '')
+        job = Verification_Job.objects.filter(
+            kind='email', status=Verification_Job.WAITING, secret=verification.hash_secret(token),
+        ).select_related('verification').first()
+        if job is None or not verification.confirm(job, token):
+            return Response({'detail': 'Invalid or expired link.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'detail': 'Email address verified.'})
+
+
+class ChangesView(APIView):
+    """
+    Changes of the Ngos, their verification and details after ?since=<seq>,
+    oldest first, deletes included (see core.changes). Pass the last_seq
+    of a response as the next since. ?limit= changes per response,
+    ?wait=<seconds> waits for a change when there is none yet, and
+    Accept: text/event-stream streams the changes as Server-Sent Events.
+    """
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (changes.EventStreamRenderer,)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        if not getattr(settings, 'NGO_HUB_ASYNC_VIEWS', False):
+            return view
+        # Waiting requests must not hold up the thread of the sync views
+        return async_view(view, {'get', 'head'})
+
+    def get(self, request):
+        params = request.query_params
+        # EventSource reconnects to the same url with the id of the last event
+        since = request.META.get('HTTP_LAST_EVENT_ID') or params.get('since', '0')
+        limit = params.get('limit', settings.NGO_HUB_CHANGES_BATCH_SIZE)
+        wait = params.get('wait', 0)
+        try:
+            since, limit, wait = int(since), int(limit), float(wait)
+        except ValueError:
+            since = limit = wait = -1
+        if since < 0 or not 0 < limit <= settings.NGO_HUB_CHANGES_MAX_BATCH_SIZE or not 0 <= wait < float('inf'):
+            return Response(
+                {'detail': 'since must be a sequence number, limit at most %d and wait a number of seconds.'
+                 % settings.NGO_HUB_CHANGES_MAX_BATCH_SIZE},
+                status=status.HTTP_400_BAD_REQUEST)
+        wait = min(wait, settings.NGO_HUB_CHANGES_MAX_WAIT)
+        if isinstance(request.accepted_renderer, changes.EventStreamRenderer):
+            # Under ASGI the response is drained before it is sent, end it
+            # with the first changes and let EventSource reconnect
+            once = getattr(settings, 'NGO_HUB_ASYNC_VIEWS', False)
+            response = StreamingHttpResponse(
+                changes.stream(since, limit, settings.NGO_HUB_CHANGES_MAX_WAIT if once
+                               else settings.NGO_HUB_CHANGES_STREAM_SECONDS, once=once),
+                content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            # Tells nginx not to buffer the events
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        found, last_seq, more = changes.changes_since(since, limit)
+        if not found and not more and wait and changes.wait(last_seq, wait):
+            found, last_seq, more = changes.changes_since(last_seq, limit)
+        return Response({'changes': found, 'last_seq': last_seq, 'more': more})
+
+
+class CacheStatsView(APIView):
+    """
+    Hit and miss counters of the response cache in this process.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(cache.stats())
+
+
+class DatabaseStatsView(APIView):
+    """
+    Connections and connection pool usage of each database in this process.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(db.stats())
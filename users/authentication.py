@@ -0,0 +1,146 @@
+"""
+Token authentication with an in-process token cache and expiring tokens.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_lifetime():
+    """
+    Returns the configured token lifetime as a timedelta, None if tokens never expire.
+    """
+    lifetime = getattr(settings, 'NGO_HUB_TOKEN_LIFETIME', None)
+    if lifetime is None or isinstance(lifetime, timedelta):
+        return lifetime
+    return timedelta(seconds=lifetime)
+
+
+def token_expired(token, now=None):
+    lifetime = token_lifetime()
+    return lifetime is not None and token.created + lifetime <= (now or timezone.now())
+
+
+def snapshot(instance):
+    """
+    Returns the database values of a model instance, see restore().
+    """
+    names = [field.attname for field in instance._meta.concrete_fields]
+    return type(instance), instance._state.db, names, [getattr(instance, name) for name in names]
+
+
+def restore(values):
+    """
+    Builds a new instance from a snapshot() without any query.
+    """
+    model, db, names, row = values
+    return model.from_db(db, names, row)
+
+
+class TokenCache:
+    """
+    Bounded token key -> (user, token) cache whose entries live ttl seconds.
+    Entries are also dropped by the Token and CustomUser signals, see users.signals.
+    The cache is local to the process, other processes see a change
+    within ttl seconds at the latest. It keeps the field values, every get()
+    returns new instances, so that a request changing its user or token
+    does not change those of the other requests.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, user_values, token_values, _ = entry
+        user, token = restore(user_values), restore(token_values)
+        token.user = user
+        return user, token
+
+    def set(self, key, user, token):
+        entry = (user.pk, snapshot(user), snapshot(token), time.monotonic() + self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        user_id = self._entries.pop(key)[0]
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+
+token_cache = TokenCache(
+    max_entries=getattr(settings, 'NGO_HUB_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'NGO_HUB_TOKEN_CACHE_TTL', 60),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication resolving known tokens from token_cache instead of
+    the Token + CustomUser query, and rejecting tokens older than
+    NGO_HUB_TOKEN_LIFETIME.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            token_cache.set(key, user, token)
+        else:
+            user, token = cached
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        if token_expired(token):
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        return (user, token)
@@ -1,3 +1,97 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import throttling
+from users.authentication import token_cache
+
+
+@override_settings(
+    NGO_HUB_THROTTLE_STORE='core.throttling.LocalStore', NGO_HUB_THROTTLE_STORE_OPTIONS={},
+    NGO_HUB_RESPONSE_CACHE=False, NGO_HUB_TOKEN_LIFETIME=timedelta(days=30))
+class TokenAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('member', 'member@example.org', 'secret-password')
+
+    def setUp(self):
+        throttling.get_store().clear()
+        token_cache.clear()
+        self.client = APIClient()
+
+    def obtain_token(self):
+        response = self.client.post(
+            '/api-token-auth/', {'username': 'member', 'password': 'secret-password'})
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def get_ngos(self, key):
+        return self.client.get('/core/ngo/', HTTP_AUTHORIZATION='Token %s' % key)
+
+    def age_token(self, key, age):
+        # A queryset update, so the cached token keeps its old created
+        Token.objects.filter(key=key).update(created=timezone.now() - age)
+        token_cache.clear()
+
+    def test_the_token_is_reused(self):
+        key = self.obtain_token()
+        self.assertEqual(self.obtain_token(), key)
+        self.assertEqual(self.get_ngos(key).status_code, 200)
+
+    def test_wrong_credentials(self):
+        response = self.client.post('/api-token-auth/', {'username': 'member', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(self.get_ngos('0' * 40).status_code, 401)
+
+    def test_expired_tokens_are_refused_then_replaced(self):
+        key = self.obtain_token()
+        self.age_token(key, timedelta(days=29))
+        self.assertEqual(self.get_ngos(key).status_code, 200)
+        self.age_token(key, timedelta(days=30))
+        response = self.get_ngos(key)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Token has expired.')
+        new_key = self.obtain_token()
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(self.get_ngos(key).status_code, 401)
+        self.assertEqual(self.get_ngos(new_key).status_code, 200)
+
+    @override_settings(NGO_HUB_TOKEN_LIFETIME=None)
+    def test_tokens_may_never_expire(self):
+        key = self.obtain_token()
+        self.age_token(key, timedelta(days=3650))
+        self.assertEqual(self.get_ngos(key).status_code, 200)
+
+    def test_deleted_tokens_leave_the_cache(self):
+        key = self.obtain_token()
+        self.get_ngos(key)
+        self.assertIsNotNone(token_cache.get(key))
+        Token.objects.get(key=key).delete()
+        self.assertIsNone(token_cache.get(key))
+        self.assertEqual(self.get_ngos(key).status_code, 401)
+
+    def test_deactivated_users_leave_the_cache(self):
+        key = self.obtain_token()
+        self.get_ngos(key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(token_cache.get(key))
+        self.assertEqual(self.get_ngos(key).status_code, 401)
+
+    def test_cached_users_are_not_shared(self):
+        key = self.obtain_token()
+        self.get_ngos(key)
+        (user, token), (other_user, other_token) = token_cache.get(key), token_cache.get(key)
+        self.assertIsNot(user, other_user)
+        self.assertIsNot(token, other_token)
+        user.is_active = False
+        self.assertTrue(token_cache.get(key)[0].is_active)
+        self.assertEqual((other_user, other_token.user, other_token.key), (self.user, self.user, key))
+        with self.assertNumQueries(0):
+            token_cache.get(key)[1].user
@@ -1,3 +1,24 @@
-from django.shortcuts import render
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 
-# Create your views here.
+from core.throttling import RouteRateThrottle
+from users.authentication import token_expired
+
+
+class ObtainExpiringAuthToken(ObtainAuthToken):
+    """
+    Returns the user's token, replacing it with a new one once it has expired.
+    """
+    # Unauthenticated by nature, limited by NGO_HUB_THROTTLE_ROUTE_RATES only
+    throttle_classes = (RouteRateThrottle,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        if not created and token_expired(token):
+            token.delete()
+            token = Token.objects.create(user=user)
+        return Response({'token': token.key})